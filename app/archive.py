@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from sqlalchemy import delete, func, select
+from .config import settings
+from .db import DATA_DIR, ChatSessionLocal
+from .models import ArchiveBlock, Group, Message
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = DATA_DIR / "archive"
+
+
+@dataclass(frozen=True, slots=True)
+class ArchivedMessage:
+    id: int
+    group_id: int
+    author_id: int
+    content: str
+    created_at: datetime
+
+
+class Archive:
+    """Cold storage for messages moved out of chat.sqlite3 by the retention rules.
+
+    Each compaction step writes one immutable segment file per group
+    (``<group_id>/<first_id>-<last_id>.seg``): a run of independently
+    zlib-compressed blocks of JSON lines. The ``archive_blocks`` table indexes
+    every block by id and time range, so a history page decompresses only the
+    blocks it touches. Segments are written and fsynced before the index rows
+    are inserted and the messages deleted in one transaction; a crash in
+    between leaves the rows hot and the next run rewrites the same segment.
+    """
+
+    def __init__(
+        self,
+        directory: Path = ARCHIVE_DIR,
+        session_factory=ChatSessionLocal,
+        max_age_days: float = settings.retention_max_age_days,
+        max_messages: int = settings.retention_max_messages,
+        segment_messages: int = settings.archive_segment_messages,
+        block_messages: int = settings.archive_block_messages,
+        cache_blocks: int = 64,
+    ):
+        self.directory = directory
+        self.session_factory = session_factory
+        self.max_age = timedelta(days=max_age_days) if max_age_days > 0 else None
+        self.max_messages = max_messages
+        self.segment_messages = segment_messages
+        self.block_messages = block_messages
+        self.cache_blocks = cache_blocks
+        # (segment, offset) -> decoded block; reads run in worker threads
+        self._cache: "OrderedDict[Tuple[str, int], List[ArchivedMessage]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.archived = 0
+        self.block_reads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_age is not None or self.max_messages > 0
+
+    def cutoff(self, db, group_id: int) -> Optional[int]:
+        """Highest id of the group that the retention rules send to the archive."""
+        cutoff = None
+        if self.max_age is not None:
+            cutoff = db.scalar(
+                select(func.max(Message.id)).where(
+                    Message.group_id == group_id, Message.created_at < datetime.utcnow() - self.max_age
+                )
+            )
+        if self.max_messages > 0:
+            boundary = db.scalar(
+                select(Message.id)
+                .where(Message.group_id == group_id)
+                .order_by(Message.id.desc())
+                .offset(self.max_messages)
+                .limit(1)
+            )
+            if boundary is not None:
+                cutoff = max(cutoff or 0, boundary)
+        return cutoff
+
+    def compact(self) -> int:
+        """Move every message past the retention rules into segments; returns how many moved."""
+        moved = 0
+        with self.session_factory() as db:
+            group_ids = list(db.scalars(select(Group.id)))
+        for group_id in group_ids:
+            while True:
+                with self.session_factory() as db:
+                    cutoff = self.cutoff(db, group_id)
+                    if cutoff is None:
+                        break
+                    rows = list(db.scalars(
+                        select(Message)
+                        .where(Message.group_id == group_id, Message.id <= cutoff)
+                        .order_by(Message.id)
+                        .limit(self.segment_messages)
+                    ))
+                    if not rows:
+                        break
+                    db.add_all(self._write_segment(group_id, rows))
+                    db.execute(
+                        delete(Message)
+                        .where(Message.group_id == group_id, Message.id.between(rows[0].id, rows[-1].id))
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.commit()
+                moved += len(rows)
+                if len(rows) < self.segment_messages:
+                    break
+        self.archived += moved
+        return moved
+
+    def _write_segment(self, group_id: int, rows: List[Message]) -> List[ArchiveBlock]:
+        name = f"{group_id}/{rows[0].id:012d}-{rows[-1].id:012d}.seg"
+        path = self.directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        blocks, offset = [], 0
+        with open(tmp, "wb") as f:
+            for start in range(0, len(rows), self.block_messages):
+                chunk = rows[start:start + self.block_messages]
+                lines = "\n".join(json.dumps([m.id, m.author_id, m.content, m.created_at.isoformat()]) for m in chunk)
+                data = zlib.compress(lines.encode(), 6)
+                f.write(data)
+                blocks.append(ArchiveBlock(
+                    group_id=group_id, segment=name, offset=offset, length=len(data), count=len(chunk),
+                    first_id=chunk[0].id, last_id=chunk[-1].id,
+                    first_at=chunk[0].created_at, last_at=chunk[-1].created_at,
+                ))
+                offset += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return blocks
+
+    def _load(self, block: ArchiveBlock) -> List[ArchivedMessage]:
+        key = (block.segment, block.offset)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        messages = self._read(block)
+        with self._lock:
+            self.block_reads += 1
+            self._cache[key] = messages
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return messages
+
+    def _read(self, block: ArchiveBlock) -> List[ArchivedMessage]:
+        with open(self.directory / block.segment, "rb") as f:
+            f.seek(block.offset)
+            data = zlib.decompress(f.read(block.length)).decode()
+        return [
+            ArchivedMessage(message_id, block.group_id, author_id, content, datetime.fromisoformat(created_at))
+            for message_id, author_id, content, created_at in map(json.loads, data.split("\n"))
+        ]
+
+    def scan(self, db) -> Iterator[List[ArchivedMessage]]:
+        """Every archived block in group and id order, bypassing the block cache (for exports).
+
+        The index is read through ``db`` so a caller can pin it to the snapshot of its other reads.
+        """
+        query = select(ArchiveBlock).order_by(ArchiveBlock.group_id, ArchiveBlock.first_id)
+        for block in db.scalars(query.execution_options(yield_per=256)):
+            yield self._read(block)
+
+    def read_before(self, group_id: int, before_id: Optional[int], limit: int) -> List[ArchivedMessage]:
+        """Up to ``limit`` archived messages older than ``before_id`` (all when None), newest first."""
+        found: List[ArchivedMessage] = []
+        with self.session_factory() as db:
+            query = select(ArchiveBlock).where(ArchiveBlock.group_id == group_id).order_by(ArchiveBlock.last_id.desc())
+            if before_id is not None:
+                query = query.where(ArchiveBlock.first_id < before_id)
+            for block in db.scalars(query):
+                for m in reversed(self._load(block)):
+                    if before_id is None or m.id < before_id:
+                        found.append(m)
+                        if len(found) >= limit:
+                            return found
+        return found
+
+    def read_after(self, group_id: int, after_id: int, limit: int) -> List[ArchivedMessage]:
+        """Up to ``limit`` archived messages newer than ``after_id``, oldest first."""
+        found: List[ArchivedMessage] = []
+        with self.session_factory() as db:
+            query = (
+                select(ArchiveBlock)
+                .where(ArchiveBlock.group_id == group_id, ArchiveBlock.last_id > after_id)
+                .order_by(ArchiveBlock.last_id)
+            )
+            for block in db.scalars(query):
+                for m in self._load(block):
+                    if m.id > after_id:
+                        found.append(m)
+                        if len(found) >= limit:
+                            return found
+        return found
+
+    async def run(self, interval: float = settings.archive_interval):
+        while True:
+            try:
+                moved = await asyncio.to_thread(self.compact)
+                if moved:
+                    logger.info("archived %d messages", moved)
+            except Exception:
+                logger.exception("archive compaction failed")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "archived": self.archived, "block_reads": self.block_reads}
+
+
+archive = Archive()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the message retention rules once")
+    parser.add_argument("--vacuum", action="store_true", help="rebuild chat.sqlite3 afterwards to return freed pages to the OS")
+    args = parser.parse_args()
+    from .db import chat_engine, init_db
+    init_db()
+    if not archive.enabled:
+        parser.error("set SCD_RETENTION_MAX_AGE_DAYS and/or SCD_RETENTION_MAX_MESSAGES")
+    print(f"archived {archive.compact()} messages into {archive.directory}")
+    if args.vacuum:
+        with chat_engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+
+
+if __name__ == "__main__":
+    main()
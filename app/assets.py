@@ -0,0 +1,75 @@
+import gzip
+import hashlib
+import mimetypes
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # optional: gzip alone is served when brotli is not installed
+    brotli = None
+
+
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".html", ".svg", ".json", ".txt"}
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+
+class _Asset:
+    __slots__ = ("media_type", "etag", "variants")
+
+    def __init__(self, path: Path):
+        body = path.read_bytes()
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+        # encoding -> body; "identity" is the uncompressed file
+        self.variants: Dict[str, bytes] = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def pick(self, accept_encoding: str) -> str:
+        for encoding in ("br", "gzip"):
+            if encoding in accept_encoding and encoding in self.variants:
+                if len(self.variants[encoding]) < len(self.variants["identity"]):
+                    return encoding
+        return "identity"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves text assets from memory, precompressed at startup.
+
+    Requests carrying the current ``?v=<asset_version>`` are cached forever by
+    the browser; unversioned ones revalidate with the ETag.
+    """
+
+    def __init__(self, *, directory: Path, asset_version: str, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.asset_version = asset_version
+        self.assets: Dict[str, _Asset] = {}
+        for path in Path(directory).rglob("*"):
+            if path.is_file() and path.suffix in COMPRESSIBLE_SUFFIXES:
+                self.assets[str(path.relative_to(directory))] = _Asset(path)
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        asset: Optional[_Asset] = self.assets.get(path)
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        request_headers = Headers(scope=scope)
+        encoding = asset.pick(request_headers.get("accept-encoding", ""))
+        versioned = parse_qs(scope.get("query_string", b"").decode()).get("v") == [self.asset_version]
+        headers = {
+            "ETag": f'"{asset.etag}-{encoding}"',
+            "Cache-Control": IMMUTABLE_CACHE if versioned else "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request_headers.get("if-none-match", "")
+        if headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, Form, HTTPException, Request, Response
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from passlib.hash import bcrypt_sha256, bcrypt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .db import get_users_db
 from .models import User
+from .directory import CachedUser, user_directory
+from .sessions import session_store
+from .hashing import hashing_pool, needs_rehash
 
-import secrets
 from typing import Optional
 
 
@@ -13,84 +15,85 @@ router = APIRouter()
 
 
 SESSION_COOKIE = "scd_session"
-_SESSION_STORE: dict[str, int] = {}
-_SESSION_SECRET = secrets.token_urlsafe(32)
 
 
-def get_db():
-    yield from get_users_db()
+async def get_db():
+    async for db in get_users_db():
+        yield db
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> Optional[User]:
+async def get_current_user(request: Request) -> Optional[CachedUser]:
     sid = request.cookies.get(SESSION_COOKIE)
     if not sid:
         return None
-    user_id = _SESSION_STORE.get(sid)
+    user_id = await session_store.get_async(sid)
     if not user_id:
         return None
-    return db.get(User, user_id)
+    return await user_directory.get(user_id)
+
 
 
 @router.get("/login")
-def login_page(request: Request, user: Optional[User] = Depends(get_current_user)):
+def login_page(request: Request, user: Optional[CachedUser] = Depends(get_current_user)):
     if user:
         return RedirectResponse(url="/", status_code=302)
-    from fastapi.templating import Jinja2Templates
-    templates = Jinja2Templates(directory=str((request.app.state.templates_dir)))
+    templates = request.app.state.templates
     return templates.TemplateResponse("login.html", {"request": request})
 
 
 @router.post("/login")
-def login(request: Request, response: Response, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def login(request: Request, response: Response, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(User).where(User.username == username))
     ok = False
     if user:
-        try:
-            ok = bcrypt_sha256.verify(password, user.password_hash)
-        except Exception:
-            ok = False
-        if not ok:
-            try:
-                ok = bcrypt.verify(password, user.password_hash)
-            except Exception:
-                ok = False
+        # bcrypt is CPU-bound; it runs in a dedicated process pool
+        ok = await hashing_pool.verify(password, user.password_hash)
     if not user or not ok:
         raise HTTPException(status_code=400, detail="Invalid credentials")
-    sid = secrets.token_urlsafe(24)
-    _SESSION_STORE[sid] = user.id
+    if needs_rehash(user.password_hash):
+        # upgrade legacy plain-bcrypt hashes while the password is at hand; best effort:
+        # a busy pool must not fail a login whose password already checked out
+        try:
+            user.password_hash = await hashing_pool.hash(password)
+            await db.commit()
+        except HTTPException as e:
+            if e.status_code != 503:
+                raise
+    user_directory.put(CachedUser(user.id, user.username))
+    sid = await session_store.create_async(user.id)
     resp = RedirectResponse(url="/", status_code=302)
     resp.set_cookie(SESSION_COOKIE, sid, httponly=True, samesite="lax")
     return resp
 
 
 @router.get("/register")
-def register_page(request: Request, user: Optional[User] = Depends(get_current_user)):
+def register_page(request: Request, user: Optional[CachedUser] = Depends(get_current_user)):
     if user:
         return RedirectResponse(url="/", status_code=302)
-    from fastapi.templating import Jinja2Templates
-    templates = Jinja2Templates(directory=str((request.app.state.templates_dir)))
+    templates = request.app.state.templates
     return templates.TemplateResponse("register.html", {"request": request})
 
 
 @router.post("/register")
-def register(request: Request, username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
+async def register(request: Request, username: str = Form(...), password: str = Form(...), db: AsyncSession = Depends(get_db)):
     username = username.strip()
     if len(username) < 3:
         raise HTTPException(status_code=400, detail="Username too short")
-    if db.query(User).filter(User.username == username).first():
+    if await db.scalar(select(User).where(User.username == username)):
         raise HTTPException(status_code=400, detail="User exists")
-    # Use bcrypt_sha256 to support long passwords securely (pre-hash then bcrypt)
-    user = User(username=username, password_hash=bcrypt_sha256.hash(password))
+    user = User(username=username, password_hash=await hashing_pool.hash(password))
     db.add(user)
-    db.commit()
+    await db.commit()
+    # drop any stale entry for this id so the next lookup sees the new row
+    user_directory.invalidate(user.id)
     return RedirectResponse(url="/login", status_code=302)
 
 
 @router.post("/logout")
-def logout(request: Request, response: Response):
+async def logout(request: Request, response: Response):
     sid = request.cookies.get(SESSION_COOKIE)
-    if sid and sid in _SESSION_STORE:
-        _SESSION_STORE.pop(sid, None)
+    if sid:
+        await session_store.delete_async(sid)
     resp = RedirectResponse(url="/login", status_code=302)
     resp.delete_cookie(SESSION_COOKIE)
     return resp
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import struct
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# every bus frame is a 4-byte big-endian length followed by a JSON object
+_FRAME = struct.Struct("!I")
+
+
+def _encode(event: dict) -> bytes:
+    data = json.dumps(event).encode()
+    return _FRAME.pack(len(data)) + data
+
+
+async def _read_raw(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(_FRAME.size)
+    return header + await reader.readexactly(_FRAME.unpack(header)[0])
+
+
+class Bus(ABC):
+    """Publish/subscribe channel between the worker processes of one server.
+
+    Events published here reach every *other* worker; the publisher delivers to
+    its own sockets directly.
+    """
+
+    # worker slot in [0, settings.workers), assigned once the bus is connected
+    slot: int = 0
+
+    @abstractmethod
+    async def start(self, handler: Callable[[dict], None]):
+        ...
+
+    @abstractmethod
+    def publish(self, event: dict):
+        ...
+
+    async def stop(self):
+        pass
+
+
+class LocalBus(Bus):
+    """Stand-in for single-worker runs: there are no peers to relay to."""
+
+    async def start(self, handler: Callable[[dict], None]):
+        self.handler = handler
+
+    def publish(self, event: dict):
+        pass
+
+
+class UnixSocketBus(Bus):
+    """Client side of the relay run by ``BusBroker`` in the parent process."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.handler: Optional[Callable[[dict], None]] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Callable[[dict], None]):
+        self.handler = handler
+        # the broker may still be binding while workers boot
+        for _ in range(100):
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError(f"bus broker not reachable at {self.path}")
+        welcome = json.loads((await _read_raw(self._reader))[_FRAME.size:])
+        self.slot = welcome["slot"]
+        self._task = asyncio.create_task(self._run())
+
+    def publish(self, event: dict):
+        if self._writer is not None:
+            self._writer.write(_encode(event))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self):
+        try:
+            while True:
+                raw = await _read_raw(self._reader)
+                try:
+                    self.handler(json.loads(raw[_FRAME.size:]))
+                except Exception:
+                    logger.exception("bus event handler failed")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # the broker lives in the supervisor process, so this only happens on shutdown
+            logger.error("lost connection to bus broker; cross-worker delivery stopped")
+            self._writer = None
+
+
+class BusBroker:
+    """Relays every frame from one worker to all the others over a Unix socket."""
+
+    def __init__(self, path: str, slots: int):
+        self.path = path
+        self.slots = slots
+        self.peers: Dict[asyncio.StreamWriter, int] = {}
+        self.ready = threading.Event()
+
+    async def serve(self):
+        Path(self.path).unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(self._client, self.path)
+        self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self) -> threading.Thread:
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="bus-broker", daemon=True)
+        thread.start()
+        self.ready.wait()
+        return thread
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        free = sorted(set(range(self.slots)) - set(self.peers.values()))
+        if not free:
+            logger.error("bus broker: no free worker slot, rejecting connection")
+            writer.close()
+            return
+        self.peers[writer] = free[0]
+        writer.write(_encode({"type": "welcome", "slot": free[0]}))
+        try:
+            while True:
+                raw = await _read_raw(reader)
+                # relay without decoding; a slow peer only grows its own transport buffer
+                for peer in self.peers:
+                    if peer is not writer:
+                        peer.write(raw)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            slot = self.peers.pop(writer, None)
+            writer.close()
+            # let the survivors forget the connections this worker held
+            for peer in self.peers:
+                peer.write(_encode({"type": "peer_down", "slot": slot}))
+
+
+def create_bus(path: Optional[str] = settings.bus_path) -> Bus:
+    if path:
+        return UnixSocketBus(path)
+    return LocalBus()
+
+
+bus = create_bus()
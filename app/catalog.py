@@ -0,0 +1,88 @@
+import bisect
+import json
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select
+from .db import ChatSessionLocal
+from .models import Group
+
+
+class GroupCatalog:
+    """In-memory, append-only list of groups with a change counter.
+
+    Groups are never renamed or deleted, so every change is an addition:
+    ``version`` counts them in the order this catalog learned of them and
+    ``_log`` records that order, which makes "what changed since version v"
+    the log past position v, whatever the ids. Groups created on other workers
+    can arrive with lower ids than ones already known, which is why the
+    version is not the highest id. Listing, deltas and prefix lookups never query.
+    """
+
+    def __init__(self, session_factory=ChatSessionLocal):
+        self.session_factory = session_factory
+        self.ids: List[int] = []
+        self.names: Dict[int, str] = {}
+        # (casefolded name, id), sorted for prefix lookups
+        self._by_name: List[Tuple[str, int]] = []
+        # number of groups added so far; _log[v:] is everything added after version v
+        self.version = 0
+        self._log: List[int] = []
+        # sum of the ids: with the count it tells two catalogs' contents apart in the ETag
+        self._checksum = 0
+        # full listing, encoded once per version
+        self._encoded: Optional[bytes] = None
+
+    def warm(self):
+        with self.session_factory() as db:
+            for group_id, name in db.execute(select(Group.id, Group.name).order_by(Group.id)):
+                self.add(group_id, name)
+
+    def add(self, group_id: int, name: str) -> bool:
+        """Record a group; returns False when it was already known."""
+        if group_id in self.names:
+            return False
+        # ids normally arrive in order, making this an append
+        bisect.insort(self.ids, group_id)
+        self.names[group_id] = name
+        bisect.insort(self._by_name, (name.casefold(), group_id))
+        self._log.append(group_id)
+        self.version += 1
+        self._checksum += group_id
+        self._encoded = None
+        return True
+
+    @property
+    def etag(self) -> str:
+        # by content rather than arrival order, so workers holding the same groups agree
+        return f'W/"groups-{self.version}-{self._checksum}"'
+
+    def since(self, version: int) -> List[dict]:
+        """Groups added after ``version`` of this catalog, by id."""
+        return [{"id": group_id, "name": self.names[group_id]} for group_id in sorted(self._log[version:])]
+
+    def page(self, after: int = 0, limit: Optional[int] = None) -> List[dict]:
+        """Groups with an id above ``after``, oldest first."""
+        start = bisect.bisect_right(self.ids, after)
+        end = len(self.ids) if limit is None else start + limit
+        return [{"id": group_id, "name": self.names[group_id]} for group_id in self.ids[start:end]]
+
+    def prefixed(self, prefix: str, limit: int) -> List[dict]:
+        """Up to ``limit`` groups whose name starts with ``prefix`` (case-insensitive), by name."""
+        key = prefix.casefold()
+        found = []
+        for i in range(bisect.bisect_left(self._by_name, (key,)), len(self._by_name)):
+            name, group_id = self._by_name[i]
+            if not name.startswith(key) or len(found) >= limit:
+                break
+            found.append({"id": group_id, "name": self.names[group_id]})
+        return found
+
+    def encoded(self) -> bytes:
+        if self._encoded is None:
+            self._encoded = json.dumps(self.page()).encode()
+        return self._encoded
+
+    def stats(self) -> dict:
+        return {"groups": len(self.ids), "version": self.version}
+
+
+catalog = GroupCatalog()
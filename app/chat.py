@@ -1,251 +1,737 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Form, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from starlette.responses import HTMLResponse, RedirectResponse
-from .db import get_users_db, get_chat_db
-from .models import User, Group, Message, Membership
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Form, WebSocket, WebSocketDisconnect
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response
+from .db import ChatAsyncSession, get_chat_db
+from .models import Group, Message, Membership
 from .auth import get_current_user
-from datetime import datetime
-from typing import Optional, Dict, Set, List
+from .directory import CachedUser, user_directory
+from .sessions import session_store
+from .config import settings
+from .fanout import Connection
+from .envelope import MSGPACK_SUBPROTOCOL, Event, choose_subprotocol
+from .bus import bus
+from .presence import presence
+from .hashing import hashing_pool
+from .writer import message_writer
+from .history import recent_messages, serialize_message
+from .search import highlight, search_messages
+from . import metrics
+from .archive import archive
+from .ratelimit import flood_control
+from .membership import memberships
+from .catalog import catalog
+from typing import Optional, Dict, Set, List, Tuple, Union
+import asyncio
+import base64
 import json
+import time
 
 
 router = APIRouter()
 
 
 class ConnectionManager:
-    def __init__(self):
-        self.group_connections: Dict[int, Set[WebSocket]] = {}
-        self.active_users: Dict[int, datetime] = {}
-        self.active_connections: List[WebSocket] = []
-        # map each websocket to the associated user id for per-group active lists
-        self.ws_user: Dict[WebSocket, int] = {}
-        # track user -> last known client IP
-        self.user_ips: Dict[int, str] = {}
-
-    async def connect(self, websocket: WebSocket, group_id: Optional[int] = None, user_id: Optional[int] = None):
-        await websocket.accept()
-        if group_id is not None:
-            self.group_connections.setdefault(group_id, set()).add(websocket)
-            if user_id is not None:
-                self.active_users[user_id] = datetime.utcnow()
-                self.ws_user[websocket] = user_id
-                try:
-                    if websocket.client and getattr(websocket.client, 'host', None):
-                        self.user_ips[user_id] = websocket.client.host
-                except Exception:
-                    pass
-        else:
-            self.active_connections.append(websocket)
-
-    def disconnect(self, websocket: WebSocket, group_id: Optional[int] = None, user_id: Optional[int] = None):
-        if group_id in self.group_connections:
-            self.group_connections[group_id].discard(websocket)
+    """Registry of this worker's sockets, indexed by socket, group and user.
+
+    Each socket is one :class:`Connection` record; ``by_group`` (``None`` holds
+    the notification sockets) and ``by_user`` (every signed-in socket, chat or
+    notification) are reverse indexes over the same records, so fan-out and
+    per-user pushes such as unread counts never scan unrelated sockets.
+    Presence counting lives in ``presence``.
+    """
+
+    def __init__(
+        self,
+        outbox_size: int = settings.outbox_size,
+        policy: str = settings.slow_consumer_policy,
+        batch_window: float = settings.ws_batch_window_ms / 1000,
+        batch_max: int = settings.ws_batch_max_events,
+        resume_grace: float = settings.resume_grace_seconds,
+        stall_timeout: float = settings.ws_stall_timeout,
+    ):
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.by_group: Dict[Optional[int], Set[Connection]] = {}
+        self.by_user: Dict[int, Set[Connection]] = {}
+        # read by every Connection; broadcast only enqueues into their outboxes
+        self.outbox_size = outbox_size
+        self.policy = policy
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self.resume_grace = resume_grace
+        self.stall_timeout = stall_timeout
+        # (group_id, user_id) -> timer announcing a departure unless the user reconnects first
+        self._pending_leaves: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+        # sockets dropped by their writer, an eviction or the reaper that were their user's last
+        # in the group; the handler's disconnect() still has to announce the departure
+        self._departed: Set[WebSocket] = set()
+        self.dropped_frames = 0
+        self.evicted = 0
+        self.reaped = 0
+
+    async def connect(
+        self, websocket: WebSocket, group_id: Optional[int] = None, user_id: Optional[int] = None, hold: bool = False
+    ) -> bool:
+        """Register a socket; returns True for the user's first connection to the group.
+
+        With ``hold`` events are queued but not sent until :meth:`release`.
+        """
+        subprotocol = choose_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        ip = websocket.client.host if websocket.client else None
+        conn = Connection(websocket, self, group_id, user_id, ip, binary=subprotocol == MSGPACK_SUBPROTOCOL)
+        self.connections[websocket] = conn
+        self.by_group.setdefault(group_id, set()).add(conn)
+        if not hold:
+            conn.start()
+        if user_id is None:
+            return False
+        self.by_user.setdefault(user_id, set()).add(conn)
+        return group_id is not None and presence.join(group_id, user_id, ip)
+
+    def disconnect(self, websocket: WebSocket) -> bool:
+        """Forget a socket; returns True when it was the user's last connection to the group."""
+        conn = self.connections.get(websocket)
+        if conn is None:
+            # already dropped by its writer, an eviction or the reaper, which may have been the last one
+            if websocket in self._departed:
+                self._departed.discard(websocket)
+                return True
+            return False
+        conn.close()
+        return self._forget(conn)
+
+    def _forget(self, conn: Connection) -> bool:
+        if self.connections.pop(conn.websocket, None) is None:
+            return False
+        peers = self.by_group.get(conn.group_id)
+        if peers is not None:
+            peers.discard(conn)
+            if not peers:
+                del self.by_group[conn.group_id]
+        if conn.user_id is None:
+            return False
+        tabs = self.by_user.get(conn.user_id)
+        if tabs is not None:
+            tabs.discard(conn)
+            if not tabs:
+                del self.by_user[conn.user_id]
+        if conn.group_id is None:
+            return False
+        # presence is reference-counted, so the user's other tabs keep them online
+        return presence.leave(conn.group_id, conn.user_id)
+
+    def _connection_closed(self, conn: Connection):
+        # writer failed or the consumer was evicted: stop routing frames to this socket
+        if self._forget(conn):
+            self._departed.add(conn.websocket)
+
+    async def run_reaper(self, interval: Optional[float] = None):
+        """Evict sockets whose current write has not completed within ``stall_timeout``.
+
+        Half-open peers are normally closed by the protocol-level ping/pong
+        (``SCD_WS_PING_INTERVAL``/``SCD_WS_PING_TIMEOUT``); this catches the ones
+        whose writer is wedged on a transport that stopped draining.
+        """
+        interval = interval or self.stall_timeout / 4
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for conn in list(self.connections.values()):
+                if conn.sending_since is not None and now - conn.sending_since > self.stall_timeout:
+                    self.reaped += 1
+                    conn.evict()
+
+    def release(self, websocket: WebSocket, initial: List[Event]):
+        """Start sending to a held socket, ``initial`` events first."""
+        conn = self.connections.get(websocket)
+        if conn is not None and conn.task is None:
+            conn.start(initial)
+
+    def leave_later(self, group_id: int, user_id: int, username: str):
+        """Announce a departure unless the user is back within the grace period."""
+        self.cancel_leave(group_id, user_id)
+        self._pending_leaves[(group_id, user_id)] = asyncio.get_running_loop().call_later(
+            self.resume_grace, self._announce_left, group_id, user_id, username
+        )
+
+    def cancel_leave(self, group_id: int, user_id: int) -> bool:
+        handle = self._pending_leaves.pop((group_id, user_id), None)
+        if handle is None:
+            return False
+        handle.cancel()
+        return True
+
+    def _announce_left(self, group_id: int, user_id: int, username: str):
+        self._pending_leaves.pop((group_id, user_id), None)
+        if user_id in presence.groups.get(group_id, ()):
+            # reconnected, possibly to another worker
+            return
+        asyncio.create_task(self.broadcast("system", {"group_id": group_id, "user": username, "action": "left"}, group_id=group_id))
+
+    def send_to(self, websocket: WebSocket, event: Event):
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.offer(event)
+
+    async def broadcast(
+        self,
+        kind: str,
+        data: Union[str, dict],
+        group_id: Optional[int] = None,
+        message_id: Optional[int] = None,
+        author_id: Optional[int] = None,
+    ):
+        started = time.perf_counter()
+        # serialize once; every outbox shares the same event object
+        event = Event(kind, data)
+        self.deliver(event, group_id)
+        published = {"type": "frame", "group_id": group_id, "kind": kind, "data": event.data}
+        if message_id is not None:
+            published["message_id"] = message_id
+            published["author_id"] = author_id
+        bus.publish(published)
+        metrics.broadcast_seconds.observe(time.perf_counter() - started)
+
+    def deliver(self, event: Event, group_id: Optional[int] = None):
+        """Enqueue an event for this worker's sockets (``None``: notification sockets)."""
+        # copied: an eviction inside offer() removes the record from the index
+        conns = list(self.by_group.get(group_id, ()))
+        metrics.broadcast_recipients.inc(len(conns))
+        for conn in conns:
+            if not conn.offer(event):
+                self.dropped_frames += 1
+                if conn.closed:
+                    self.evicted += 1
+
+    def push_unread(self, group_id: int, user_id: Optional[int] = None, skip: Optional[int] = None):
+        """Send ``group_id``'s unread count to notification sockets on this worker.
+
+        Goes to one user, or with ``user_id`` None to every member except ``skip``
+        (the author of the message that moved the count).
+        """
         if user_id is not None:
-            self.active_users.pop(user_id, None)
-            # Optionally clear IP mapping when user disconnects
-            self.user_ips.pop(user_id, None)
-        # remove websocket mapping
-        self.ws_user.pop(websocket, None)
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-
-    async def broadcast(self, message: str, group_id: Optional[int] = None):
-        if group_id is not None:
-            conns = list(self.group_connections.get(group_id, set()))
-            for ws in conns:
-                try:
-                    await ws.send_text(message)
-                except RuntimeError:
-                    # silently drop broken connections
-                    self.group_connections[group_id].discard(ws)
-                    self.ws_user.pop(ws, None)
+            users = [user_id]
         else:
-            for connection in self.active_connections:
-                await connection.send_text(message)
+            members = memberships.members.get(group_id, {})
+            # walk whichever side is smaller: the group's members or the users connected here
+            if len(self.by_user) < len(members):
+                users = [u for u in self.by_user if u in members]
+            else:
+                users = [u for u in members if u in self.by_user]
+        for uid in users:
+            if uid == skip:
+                continue
+            tabs = [conn for conn in self.by_user.get(uid, ()) if conn.group_id is None]
+            if tabs:
+                event = Event("unread", {"group_id": group_id, "unread": memberships.unread(group_id, uid)})
+                for conn in tabs:
+                    conn.offer(event)
 
 
 manager = ConnectionManager()
+metrics.connections.set_function(lambda: len(manager.connections))
+metrics.group_connections.set_function(lambda: {g: len(c) for g, c in manager.by_group.items() if g is not None})
+
+
+def handle_bus_event(event: dict):
+    # events published by other workers
+    kind = event.get("type")
+    if kind == "frame":
+        if "message_id" in event:
+            message_writer.observe(event["message_id"])
+            memberships.on_message(event["group_id"], event["message_id"], event.get("author_id"))
+            recent_messages.append(event["group_id"], event["message_id"], event["data"])
+            manager.push_unread(event["group_id"], skip=event.get("author_id"))
+        elif event["kind"] == "failed":
+            lost = json.loads(event["data"])
+            _forget_lost(lost["group_id"], lost["ids"])
+        elif event["kind"] == "group":
+            group = json.loads(event["data"])
+            if not catalog.add(group["id"], group["name"]):
+                return
+            # versions are per catalog: our clients resume deltas from this worker's count, not the sender's
+            group["version"] = catalog.version
+            manager.deliver(Event("group", group))
+            return
+        manager.deliver(Event(event["kind"], event["data"]), event.get("group_id"))
+    elif kind == "member":
+        memberships.add_member(event["group_id"], event["user_id"], event["last_read_id"])
+    elif kind == "read":
+        memberships.mark_read(event["group_id"], event["user_id"], event["last_read_id"], event["unread"])
+        manager.push_unread(event["group_id"], event["user_id"])
+    elif kind == "presence":
+        presence.apply_remote(event)
+    elif kind == "presence_sync":
+        presence.sync(event["slot"], event["entries"])
+    elif kind == "hello":
+        presence.publish_sync()
+    elif kind == "peer_down":
+        presence.drop_worker(event["slot"])
+
+
+def handle_dropped_messages(batch: List[dict]):
+    # the writer gave up on these rows after they were broadcast: every worker forgets them
+    # and every client in the group marks them, not only their authors
+    lost: Dict[int, List[int]] = {}
+    for row in batch:
+        lost.setdefault(row["group_id"], []).append(row["id"])
+    for group_id, ids in lost.items():
+        _forget_lost(group_id, ids)
+        asyncio.create_task(manager.broadcast("failed", {"group_id": group_id, "ids": ids}, group_id=group_id))
+
+
+def _forget_lost(group_id: int, ids: List[int]):
+    recent_messages.discard(group_id, ids)
+    memberships.on_lost(group_id, len(ids))
+    manager.push_unread(group_id)
 
 
 @router.get("/")
-def index(request: Request, user: Optional[User] = Depends(get_current_user)):
-    from fastapi.templating import Jinja2Templates
-    templates = Jinja2Templates(directory=str((request.app.state.templates_dir)))
+def index(request: Request, user: Optional[CachedUser] = Depends(get_current_user)):
+    templates = request.app.state.templates
     if not user:
         return HTMLResponse("<script>location='/login'</script>")
     return templates.TemplateResponse("index.html", {"request": request, "user": user})
 
 
 @router.get("/api/users/active")
-def active_users(db: Session = Depends(get_users_db)):
-    ids = list(manager.active_users.keys())
-    users = db.query(User).filter(User.id.in_(ids)).all() if ids else []
-    return [{"id": u.id, "username": u.username, "ip": manager.user_ips.get(u.id)} for u in users]
+async def active_users():
+    # polling fallback; clients normally receive presence deltas over /ws
+    users = (await user_directory.get_many(presence.online_user_ids())).values()
+    return [{"id": u.id, "username": u.username, "ip": presence.user_ips.get(u.id)} for u in users]
 
 
 @router.get("/api/groups/{group_id}/active_users")
-def active_users_in_group(group_id: int, db: Session = Depends(get_users_db)):
-    conns = manager.group_connections.get(group_id, set())
-    user_ids: Set[int] = set()
-    for ws in conns:
-        uid = manager.ws_user.get(ws)
-        if uid:
-            user_ids.add(uid)
-    users = db.query(User).filter(User.id.in_(user_ids)).all() if user_ids else []
-    return [{"id": u.id, "username": u.username, "ip": manager.user_ips.get(u.id)} for u in users]
+async def active_users_in_group(group_id: int):
+    # polling fallback; clients normally receive presence deltas over the chat socket
+    users = (await user_directory.get_many(presence.group_user_ids(group_id))).values()
+    return [{"id": u.id, "username": u.username, "ip": presence.user_ips.get(u.id)} for u in users]
+
+
+@router.get("/api/stats")
+def stats():
+    return {
+        "user_directory": user_directory.stats(),
+        "fanout": {
+            "connections": len(manager.connections),
+            "users": len(manager.by_user),
+            "dropped_frames": manager.dropped_frames,
+            "evicted": manager.evicted,
+            "reaped": manager.reaped,
+        },
+        "writer": {
+            "batches": message_writer.batches,
+            "written": message_writer.written,
+            "pending": message_writer.queue.qsize() if message_writer.queue else 0,
+            "dropped": message_writer.dropped,
+        },
+        "history": recent_messages.stats(),
+        "memberships": memberships.stats(),
+        "catalog": catalog.stats(),
+        "archive": archive.stats(),
+        "hashing": {"pending": hashing_pool.pending, "rejected": hashing_pool.rejected},
+    }
+
+
+@router.get("/metrics")
+def prometheus_metrics():
+    # per worker process: with --workers N each scrape reaches whichever worker accepts it
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def _member_added(group_id: int, user_id: int, last_read_id: int):
+    memberships.add_member(group_id, user_id, last_read_id)
+    bus.publish({"type": "member", "group_id": group_id, "user_id": user_id, "last_read_id": last_read_id})
+
+
+async def _group_created(group: Group):
+    catalog.add(group.id, group.name)
+    # clients add the one group to their list instead of refetching all of them
+    await manager.broadcast("group", {"id": group.id, "name": group.name, "action": "created", "version": catalog.version})
 
 
 @router.get("/api/groups")
-def list_groups(db: Session = Depends(get_chat_db)):
-    groups = db.query(Group).all()
-    return [{"id": g.id, "name": g.name} for g in groups]
+async def list_groups(
+    request: Request,
+    since_version: Optional[int] = Query(None, ge=0),
+    after: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    prefix: Optional[str] = Query(None, min_length=1, max_length=100),
+):
+    """Groups from the in-memory catalog, oldest first.
+
+    ``since_version`` returns only groups added after that catalog version
+    (``after`` and ``limit`` then do not apply), ``after`` and ``limit`` page by
+    id, ``prefix`` looks names up (by name, 20 unless ``limit``). The version is
+    sent as ``X-Groups-Version`` and every variant revalidates with the
+    catalog's ETag.
+    """
+    headers = {"ETag": catalog.etag, "X-Groups-Version": str(catalog.version), "Cache-Control": "no-cache"}
+    if catalog.etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    if prefix is not None:
+        return JSONResponse(catalog.prefixed(prefix, limit or 20), headers=headers)
+    if since_version is not None:
+        return JSONResponse(catalog.since(since_version), headers=headers)
+    if after == 0 and limit is None:
+        return Response(catalog.encoded(), media_type="application/json", headers=headers)
+    return JSONResponse(catalog.page(after, limit), headers=headers)
 
 
 @router.post("/api/groups")
-async def create_group(name: str, user: User = Depends(get_current_user), db: Session = Depends(get_chat_db)):
+async def create_group(name: str, user: CachedUser = Depends(get_current_user), db: AsyncSession = Depends(get_chat_db)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     name = name.strip()
     if not name:
         raise HTTPException(status_code=400, detail="Empty name")
-    if db.query(Group).filter(Group.name == name).first():
+    if await db.scalar(select(Group).where(Group.name == name)):
         raise HTTPException(status_code=400, detail="Group exists")
     g = Group(name=name)
     db.add(g)
-    db.flush()
+    await db.flush()
     m = Membership(user_id=user.id, group_id=g.id)
     db.add(m)
-    db.commit()
-    # notify other clients to refresh group list
-    await manager.broadcast(f"new_group:{g.name}")
+    await db.commit()
+    _member_added(g.id, user.id, 0)
+    await _group_created(g)
     return {"id": g.id, "name": g.name}
 
 
 @router.post("/api/groups/join")
-def join_group(group_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_chat_db)):
+async def join_group(group_id: int, user: CachedUser = Depends(get_current_user), db: AsyncSession = Depends(get_chat_db)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    g = db.get(Group, group_id)
+    g = await db.get(Group, group_id)
     if not g:
         raise HTTPException(status_code=404, detail="Not found")
-    if not db.query(Membership).filter_by(user_id=user.id, group_id=g.id).first():
-        db.add(Membership(user_id=user.id, group_id=g.id))
-        db.commit()
+    if not await db.scalar(select(Membership).filter_by(user_id=user.id, group_id=g.id)):
+        # history from before joining does not count as unread
+        last_read_id = memberships.newest.get(g.id, 0)
+        db.add(Membership(user_id=user.id, group_id=g.id, last_read_id=last_read_id))
+        await db.commit()
+        _member_added(g.id, user.id, last_read_id)
     return {"ok": True}
 
 
-@router.get("/api/messages")
-def get_messages(
+@router.get("/api/me/groups")
+async def my_groups(user: Optional[CachedUser] = Depends(get_current_user)):
+    """Every group with the caller's membership and unread count, for the sidebar."""
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    result = []
+    for group_id in catalog.ids:
+        name = catalog.names[group_id]
+        state = memberships.state(group_id, user.id)
+        result.append({
+            "id": group_id,
+            "name": name,
+            "member": state is not None,
+            "unread": memberships.unread(group_id, user.id),
+            "last_read_id": state.last_read_id if state else None,
+        })
+    # the catalog version this list reflects: the starting point for since_version
+    return JSONResponse(result, headers={"X-Groups-Version": str(catalog.version)})
+
+
+@router.post("/api/groups/{group_id}/read")
+async def mark_read(
     group_id: int,
-    db_chat: Session = Depends(get_chat_db),
-    db_users: Session = Depends(get_users_db),
+    message_id: int,
+    user: Optional[CachedUser] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_chat_db),
 ):
-    msgs = (
-        db_chat.query(Message)
-        .filter(Message.group_id == group_id)
-        .order_by(Message.created_at.asc())
-        .limit(100)
-        .all()
-    )
-    author_ids = {m.author_id for m in msgs}
-    users = db_users.query(User).filter(User.id.in_(author_ids)).all() if author_ids else []
-    name_by_id = {u.id: u.username for u in users}
-    return [
-        {
-            "id": m.id,
-            "group_id": m.group_id,
-            "author": name_by_id.get(m.author_id, f"user#{m.author_id}"),
-            "content": m.content,
-            "created_at": m.created_at.isoformat(),
-        }
-        for m in msgs
-    ]
+    """Move the caller's read pointer forward to ``message_id``."""
+    await _require_member(group_id, user)
+    state = memberships.state(group_id, user.id)
+    # a pointer past the newest message would hide every later one from the unread count
+    newest = memberships.newest.get(group_id, 0)
+    message_id = min(message_id, newest)
+    if message_id > state.last_read_id:
+        if message_id == newest:
+            unread = 0
+        else:
+            # reading up to an older message: count what is left once, on this write path
+            unread = await db.scalar(
+                select(func.count()).where(Message.group_id == group_id, Message.id > message_id)
+            )
+        await db.execute(
+            update(Membership)
+            .where(Membership.user_id == user.id, Membership.group_id == group_id, Membership.last_read_id < message_id)
+            .values(last_read_id=message_id)
+        )
+        await db.commit()
+        memberships.mark_read(group_id, user.id, message_id, unread)
+        # the user's other tabs clear their badge without polling
+        manager.push_unread(group_id, user.id)
+        bus.publish({"type": "read", "group_id": group_id, "user_id": user.id, "last_read_id": message_id, "unread": unread})
+    return {"last_read_id": state.last_read_id, "unread": memberships.unread(group_id, user.id)}
+
+
+async def _is_member(group_id: int, user_id: int) -> bool:
+    """Membership from the index, or from SQLite when the index has not heard of it yet.
+
+    With several workers a join handled by a peer reaches this worker's index
+    over the bus, possibly after the client's next request; a miss is checked
+    against the table and back-filled before anyone is turned away.
+    """
+    if memberships.is_member(group_id, user_id):
+        return True
+    async with ChatAsyncSession() as db:
+        last_read_id = await db.scalar(
+            select(Membership.last_read_id).where(Membership.group_id == group_id, Membership.user_id == user_id)
+        )
+    if last_read_id is None:
+        return False
+    memberships.add_member(group_id, user_id, last_read_id)
+    return True
+
+
+async def _require_member(group_id: int, user: Optional[CachedUser]):
+    # same rule as the chat socket (4403): a group's history is for its members only
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not await _is_member(group_id, user.id):
+        raise HTTPException(status_code=403, detail="Not a member")
 
 
-@router.websocket("/ws/chat/{group_id}")
-async def websocket_chat(
-    websocket: WebSocket,
+def _encode_cursor(message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"m{message_id}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        if not raw.startswith("m"):
+            raise ValueError(raw)
+        return int(raw[1:])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@router.get("/api/messages")
+async def get_messages(
+    group_id: int,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    user: Optional[CachedUser] = Depends(get_current_user),
+    db_chat: AsyncSession = Depends(get_chat_db),
+):
+    """Newest-first page of a group's history.
+
+    Without a cursor the newest page is returned. ``before`` pages back in time,
+    ``after`` resumes forward from a known message. ``older``/``newer`` in the
+    response are opaque cursors for the adjacent pages (null when there is none).
+    """
+    await _require_member(group_id, user)
+    if before is not None:
+        before_id = _decode_cursor(before)
+    if after is not None:
+        after_id = _decode_cursor(after)
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before or after")
+
+    if before_id is None and after_id is None:
+        # newest page: joined from the pre-serialized ring without touching SQLite
+        cached = await recent_messages.newest_page(group_id, limit)
+        if cached is not None:
+            page, has_older = cached
+            older = _encode_cursor(page[-1][0]) if page and has_older else None
+            body = '{"messages":[%s],"older":%s,"newer":null}' % (",".join(f for _, f in page), json.dumps(older))
+            return Response(body, media_type="application/json")
+
+    # fetch one extra row to learn whether another page exists, walking ix_messages_group_id_id.
+    # Archived messages are all older than the group's hot rows, so a page that runs past
+    # the oldest hot row continues into the archive and one that starts before it begins there.
+    msgs: list = []
+    if after_id is not None:
+        msgs = await asyncio.to_thread(archive.read_after, group_id, after_id, limit + 1)
+    if len(msgs) <= limit:
+        query = select(Message).where(Message.group_id == group_id).limit(limit + 1 - len(msgs))
+        if after_id is not None:
+            query = query.where(Message.id > after_id).order_by(Message.id.asc())
+        else:
+            if before_id is not None:
+                query = query.where(Message.id < before_id)
+            query = query.order_by(Message.id.desc())
+        msgs += (await db_chat.scalars(query)).all()
+    if after_id is None and len(msgs) <= limit:
+        older_than = msgs[-1].id if msgs else before_id
+        msgs += await asyncio.to_thread(archive.read_before, group_id, older_than, limit + 1 - len(msgs))
+    more = len(msgs) > limit
+    del msgs[limit:]
+    if after_id is not None:
+        msgs.reverse()
+
+    authors = await user_directory.get_many(m.author_id for m in msgs)
+    if after_id is not None:
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = before_id is not None, more
+    return {
+        "messages": [
+            {
+                "id": m.id,
+                "group_id": m.group_id,
+                "author": authors[m.author_id].username if m.author_id in authors else f"user#{m.author_id}",
+                "content": m.content,
+                "created_at": m.created_at.isoformat(),
+            }
+            for m in msgs
+        ],
+        "older": _encode_cursor(msgs[-1].id) if msgs and has_older else None,
+        "newer": _encode_cursor(msgs[0].id) if msgs and has_newer else None,
+    }
+
+
+@router.get("/api/groups/{group_id}/search")
+async def search_group(
     group_id: int,
-    db_chat: Session = Depends(get_chat_db),
-    db_users: Session = Depends(get_users_db),
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    user: Optional[CachedUser] = Depends(get_current_user),
+    db_chat: AsyncSession = Depends(get_chat_db),
 ):
+    """Best matches first (bm25), with ``<mark>``-highlighted, HTML-escaped snippets."""
+    await _require_member(group_id, user)
+    rows = await search_messages(db_chat, group_id, q, limit + 1, offset)
+    more = len(rows) > limit
+    del rows[limit:]
+    authors = await user_directory.get_many(r.author_id for r in rows)
+    return {
+        "results": [
+            {
+                "id": r.id,
+                "group_id": group_id,
+                "author": authors[r.author_id].username if r.author_id in authors else f"user#{r.author_id}",
+                "snippet": highlight(r.snippet),
+                "created_at": r.created_at.isoformat(),
+            }
+            for r in rows
+        ],
+        "next_offset": offset + limit if more else None,
+    }
+
+
+async def _socket_user_id(websocket: WebSocket) -> Optional[int]:
     # Simple auth via cookie-backed session
-    from .auth import SESSION_COOKIE, _SESSION_STORE
+    from .auth import SESSION_COOKIE
     sid = websocket.cookies.get(SESSION_COOKIE)
     if not isinstance(sid, str):
-        await websocket.close(code=4401)
-        return
-    user_id = _SESSION_STORE.get(sid)
+        return None
+    return await session_store.get_async(sid)
+
+
+@router.websocket("/ws/chat/{group_id}")
+async def websocket_chat(websocket: WebSocket, group_id: int, since: Optional[int] = None):
+    """Chat socket; ``since`` is the last message id a reconnecting client saw.
+
+    The gap after it is replayed ahead of live events, followed by a ``resume``
+    event whose ``complete`` is false when the gap was too large and the client
+    should reload the newest history page instead.
+    """
+    user_id = await _socket_user_id(websocket)
     if not user_id:
         await websocket.close(code=4401)
         return
-    user = db_users.get(User, user_id)
+    user = await user_directory.get(user_id)
     if not user:
         await websocket.close(code=4401)
         return
-    await manager.connect(websocket, group_id, user_id)
+    if not await _is_member(group_id, user_id):
+        await websocket.close(code=4403)
+        return
+    # held: live events queue up behind the snapshot and replay built below
+    first = await manager.connect(websocket, group_id, user_id, hold=True)
+    returning = manager.cancel_leave(group_id, user_id)
+    guard = flood_control.acquire(group_id, user_id)
     try:
-        await manager.broadcast(f"[system] {user.username} joined", group_id=group_id)
+        initial = [await presence.snapshot(group_id)]
+        if since is not None:
+            gap = await recent_messages.since(group_id, since, settings.resume_max_messages)
+            initial.extend(Event("message", frame) for frame in gap or ())
+            initial.append(Event("resume", {"group_id": group_id, "since": since, "replayed": len(gap or ()), "complete": gap is not None}))
+        manager.release(websocket, initial)
+        # a resumed session was announced before; its "left" line was either cancelled or already sent
+        if first and not returning and since is None:
+            await manager.broadcast("system", {"group_id": group_id, "user": user.username, "action": "joined"}, group_id=group_id)
         while True:
             text = await websocket.receive_text()
+            # checked before anything is stored or broadcast; may wait out the rate limit
+            verdict = await guard.admit(text)
+            if verdict is not None:
+                if verdict:
+                    await websocket.close(code=verdict)
+                    break
+                continue
             text = text.strip()
             if not text:
                 continue
-            
-            created_at = datetime.utcnow()
-            msg = Message(group_id=group_id, author_id=user_id, content=text)
-            db_chat.add(msg)
-            db_chat.commit()
-            await manager.broadcast(json.dumps({
-                "author": user.username,
-                "content": text,
-                "created_at": msg.created_at.isoformat()
-            }), group_id=group_id)
+
+            # id and timestamp are assigned up front; the batch commit happens behind the broadcast
+            msg = await message_writer.submit(group_id, user_id, text)
+            memberships.on_message(group_id, msg["id"], user_id)
+            frame = serialize_message(msg["id"], group_id, user.username, text, msg["created_at"])
+            recent_messages.append(group_id, msg["id"], frame)
+            await manager.broadcast("message", frame, group_id=group_id, message_id=msg["id"], author_id=user_id)
+            manager.push_unread(group_id, skip=user_id)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, group_id, user_id)
-        await manager.broadcast(f"[system] {user.username} left", group_id=group_id)
+        pass
+    finally:
+        flood_control.release(group_id, user_id)
+        if manager.disconnect(websocket):
+            manager.leave_later(group_id, user_id, user.username)
 
 
 @router.websocket("/ws")
 async def websocket_notifications(websocket: WebSocket):
-    await manager.connect(websocket)
+    """Site-wide events; a signed-in socket also receives the user's unread counts."""
+    await manager.connect(websocket, user_id=await _socket_user_id(websocket))
     try:
+        manager.send_to(websocket, await presence.snapshot())
         while True:
             data = await websocket.receive_text()
             # We can handle incoming messages here if needed
     except WebSocketDisconnect:
+        pass
+    finally:
+        # any exit, not only a clean disconnect, must drop the registry record
         manager.disconnect(websocket)
 
 
 @router.post("/create_group")
 async def create_group_form(
     name: str = Form(...),
-    user: User = Depends(get_current_user),
-    db_chat: Session = Depends(get_chat_db),
+    user: CachedUser = Depends(get_current_user),
+    db_chat: AsyncSession = Depends(get_chat_db),
 ):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     name = name.strip()
     if not name:
         raise HTTPException(status_code=400, detail="Empty name")
-    if db_chat.query(Group).filter(Group.name == name).first():
+    if await db_chat.scalar(select(Group).where(Group.name == name)):
         raise HTTPException(status_code=400, detail="Group exists")
     new_group = Group(name=name)
     db_chat.add(new_group)
-    db_chat.commit()
-    db_chat.refresh(new_group)
+    await db_chat.commit()
+    await db_chat.refresh(new_group)
 
     # Add the creator to the group
     db_chat.add(Membership(user_id=user.id, group_id=new_group.id))
-    db_chat.commit()
-
-    await manager.broadcast(f"new_group:{new_group.name}")
+    await db_chat.commit()
+    _member_added(new_group.id, user.id, 0)
+    await _group_created(new_group)
 
     return RedirectResponse(url=f"/chat/{new_group.id}", status_code=303)
 
 
 @router.get("/chat/{group_id}")
-def chat_room(request: Request, group_id: int, user: User = Depends(get_current_user)):
-    from fastapi.templating import Jinja2Templates
-    templates = Jinja2Templates(directory=str((request.app.state.templates_dir)))
+def chat_room(request: Request, group_id: int, user: CachedUser = Depends(get_current_user)):
+    templates = request.app.state.templates
     return templates.TemplateResponse("chat.html", {"request": request, "user": user, "group_id": group_id})
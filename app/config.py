@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Json
 from pathlib import Path
+from typing import Any, Dict, Literal, Optional
 import json
+import os
 
 
 class TLSConfig(BaseModel):
@@ -10,7 +12,17 @@ class TLSConfig(BaseModel):
     organization: str = "Demo Chat"
     common_name: str = "localhost"
     valid_days: int = 365
-    key_bits: int = 2048
+    # ECDSA P-256 signs handshakes far cheaper than RSA; Ed25519 is faster still but browsers reject it
+    key_type: Literal["rsa", "ecdsa-p256", "ed25519"] = "ecdsa-p256"
+    key_bits: int = 2048  # rsa only
+    # "1.3" refuses TLS 1.2 clients
+    min_version: Literal["1.2", "1.3"] = "1.2"
+    # TLS 1.2 suites (TLS 1.3 suites are fixed by OpenSSL); None keeps uvicorn's default
+    ciphers: Optional[str] = "ECDHE+AESGCM:ECDHE+CHACHA20"
+    # Stateless resumption tickets; when off, sessions are cached server-side per worker process
+    session_tickets: bool = True
+    # TLS 1.3 tickets issued per full handshake (0 disables TLS 1.3 resumption)
+    num_tickets: int = 2
 
 
 def load_tls_config(path: Path) -> TLSConfig:
@@ -19,3 +31,95 @@ def load_tls_config(path: Path) -> TLSConfig:
     with path.open("r", encoding="utf-8") as f:
         data = json.load(f)
     return TLSConfig(**data)
+
+
+class Settings(BaseModel):
+    # Directory holding the SQLite databases (default: <repo>/data)
+    data_dir: Optional[str] = None
+    # Outgoing frames buffered per WebSocket before the slow-consumer policy kicks in
+    outbox_size: int = 256
+    # drop: discard new frames; drop_oldest: discard the oldest queued frame; both then send an
+    # incomplete "resume" so the client reloads. coalesce: fold a new unread/presence event into
+    # the queued one for the same group, else as drop_oldest. disconnect: close the socket
+    slow_consumer_policy: Literal["drop", "drop_oldest", "coalesce", "disconnect"] = "drop"
+    # Protocol-level ping/pong that closes half-open sockets (passed to uvicorn)
+    ws_ping_interval: float = 20.0
+    ws_ping_timeout: float = 20.0
+    # Sockets whose current write has been stuck this long are evicted by the reaper
+    ws_stall_timeout: float = 60.0
+    # Events for a busy socket are gathered for this long and sent as one frame (0 = no lingering)
+    ws_batch_window_ms: int = 5
+    ws_batch_max_events: int = 64
+    # Negotiate permessage-deflate with clients that offer it
+    ws_per_message_deflate: bool = True
+    # Reconnects: a gap of up to this many messages is replayed; a "left" line waits out the grace period
+    resume_max_messages: int = 500
+    resume_grace_seconds: float = 10.0
+    # Chat socket flood control: token buckets (messages/s, burst) per connection and per user
+    # in a group (0 rate disables one), a message size cap, and what happens to excess traffic
+    flood_connection_rate: float = 5.0
+    flood_connection_burst: int = 10
+    flood_user_rate: float = 10.0
+    flood_user_burst: int = 20
+    flood_max_message_bytes: int = 4000
+    flood_mode: Literal["drop", "delay", "disconnect"] = "delay"
+    # Per-group overrides of the flood_ fields, without the prefix, as JSON:
+    # {"<group_id>": {"user_rate": 1, "mode": "disconnect"}}
+    flood_groups: Json[Dict[int, Dict[str, Any]]] = {}
+    # Write-behind message persistence: a batch is committed when either bound is reached
+    writer_batch_size: int = 500
+    writer_max_delay_ms: int = 20
+    # Senders wait while this many rows are queued; a batch that still fails after this many
+    # commit attempts is dropped and its senders get a "failed" event
+    writer_max_pending: int = 10000
+    writer_max_attempts: int = 5
+    # Storage profile applied to every chat DB connection
+    sqlite_journal_mode: Literal["WAL", "DELETE", "TRUNCATE", "MEMORY"] = "WAL"
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    # In-process id -> username directory in front of users.sqlite3
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 600.0
+    # Newest messages kept serialized in memory per group, under one byte budget for all groups
+    history_ring_size: int = 200
+    history_cache_bytes: int = 64 * 1024 * 1024
+    # Retention: messages older than the age, or beyond the newest N per group, move to
+    # compressed archive segments under <data_dir>/archive (0 disables either rule)
+    retention_max_age_days: float = 0
+    retention_max_messages: int = 0
+    archive_interval: float = 3600.0
+    archive_segment_messages: int = 10000
+    archive_block_messages: int = 256
+    # memory: per-process; sqlite: data/sessions.sqlite3, shared by workers and kept across restarts
+    session_backend: Literal["memory", "sqlite"] = "sqlite"
+    session_ttl: float = 7 * 24 * 3600
+    session_sweep_interval: float = 300.0
+    session_max_entries: int = 100000
+    # sqlite backend: a worker answers a session it has seen from memory for this long, so a
+    # logout on another worker can take up to this long to reach it (0 disables the cache)
+    session_cache_seconds: float = 5.0
+    # Password hashing runs in its own process pool; beyond max pending jobs requests get 503
+    hash_workers: int = 2
+    hash_max_pending: int = 32
+    # Re-check template files on every render (development only)
+    template_auto_reload: bool = False
+    # Presence join/leave bursts inside this window are pushed as one delta
+    presence_window_ms: int = 250
+    # Log the event loop's stack when it is blocked longer than this (0 = monitor off)
+    loop_stall_ms: int = 0
+    # Set by run.py --workers: worker count and the pub/sub broker socket shared by them
+    workers: int = 1
+    bus_path: Optional[str] = None
+
+
+def load_settings() -> Settings:
+    # Every field can be overridden with an SCD_<FIELD> environment variable
+    data = {}
+    for name in Settings.model_fields:
+        value = os.getenv(f"SCD_{name.upper()}")
+        if value is not None:
+            data[name] = value
+    return Settings(**data)
+
+
+settings = load_settings()
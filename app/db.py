@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from pathlib import Path
+from .config import settings
+from .metrics import instrument_engine
 
 
 class UsersBase(DeclarativeBase):
@@ -12,7 +16,7 @@ class ChatBase(DeclarativeBase):
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(settings.data_dir) if settings.data_dir else BASE_DIR / "data"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 USERS_DB_PATH = DATA_DIR / "users.sqlite3"
 CHAT_DB_PATH = DATA_DIR / "chat.sqlite3"
@@ -20,28 +24,70 @@ CHAT_DB_PATH = DATA_DIR / "chat.sqlite3"
 users_engine = create_engine(f"sqlite:///{USERS_DB_PATH}", connect_args={"check_same_thread": False})
 chat_engine = create_engine(f"sqlite:///{CHAT_DB_PATH}", connect_args={"check_same_thread": False})
 
+
+@event.listens_for(chat_engine, "connect")
+def _apply_storage_profile(dbapi_conn, _record):
+    # WAL lets readers proceed during the writer's batch commits; NORMAL syncs only at checkpoints
+    cur = dbapi_conn.cursor()
+    cur.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cur.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cur.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cur.close()
+
+
+# aiosqlite runs each connection in its own thread, keeping queries off the event loop
+users_async_engine = create_async_engine(f"sqlite+aiosqlite:///{USERS_DB_PATH}")
+chat_async_engine = create_async_engine(f"sqlite+aiosqlite:///{CHAT_DB_PATH}")
+event.listen(chat_async_engine.sync_engine, "connect", _apply_storage_profile)
+instrument_engine(users_engine, "users")
+instrument_engine(chat_engine, "chat")
+instrument_engine(users_async_engine.sync_engine, "users")
+instrument_engine(chat_async_engine.sync_engine, "chat")
+
 UsersSessionLocal = sessionmaker(bind=users_engine, autoflush=False, autocommit=False)
 ChatSessionLocal = sessionmaker(bind=chat_engine, autoflush=False, autocommit=False)
+UsersAsyncSession = async_sessionmaker(bind=users_async_engine, autoflush=False, expire_on_commit=False)
+ChatAsyncSession = async_sessionmaker(bind=chat_async_engine, autoflush=False, expire_on_commit=False)
 
 
 def init_db():
     from . import models  # noqa: F401 ensure models imported
+    from .search import ensure_search_index
     # Create tables in respective DBs
     UsersBase.metadata.create_all(bind=users_engine)
     ChatBase.metadata.create_all(bind=chat_engine)
+    _ensure_columns(ChatBase, chat_engine)
+    _ensure_indexes(ChatBase, chat_engine)
+    ensure_search_index(chat_engine)
+
+
+def _ensure_columns(base, engine):
+    # nor does it add columns; ones added later need a server default to fill existing rows
+    with engine.begin() as conn:
+        for table in base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}")
+
+
+def _ensure_indexes(base, engine):
+    # create_all skips tables that already exist, including indexes added to them later
+    for table in base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+async def dispose_async_engines():
+    await users_async_engine.dispose()
+    await chat_async_engine.dispose()
 
 
-def get_users_db():
-    db = UsersSessionLocal()
-    try:
+async def get_users_db():
+    async with UsersAsyncSession() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_chat_db():
-    db = ChatSessionLocal()
-    try:
+async def get_chat_db():
+    async with ChatAsyncSession() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+from sqlalchemy import select
+from .config import settings
+from .db import UsersAsyncSession, UsersSessionLocal
+from .models import User
+
+
+@dataclass(frozen=True, slots=True)
+class CachedUser:
+    id: int
+    username: str
+
+
+class UserDirectory:
+    """Bounded LRU/TTL cache of id -> user in front of the users database."""
+
+    def __init__(self, maxsize: int = settings.user_cache_size, ttl: float = settings.user_cache_ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[float, CachedUser]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, user_id: int) -> Optional[CachedUser]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires, user = entry
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return user
+
+    def put(self, user: CachedUser):
+        self._entries[user.id] = (time.monotonic() + self.ttl, user)
+        self._entries.move_to_end(user.id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    async def get(self, user_id: int) -> Optional[CachedUser]:
+        return (await self.get_many((user_id,))).get(user_id)
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, CachedUser]:
+        found: Dict[int, CachedUser] = {}
+        missing = []
+        for uid in set(user_ids):
+            user = self._lookup(uid)
+            if user is None:
+                missing.append(uid)
+            else:
+                found[uid] = user
+        self.hits += len(found)
+        if missing:
+            self.misses += len(missing)
+            async with UsersAsyncSession() as db:
+                rows = await db.execute(select(User.id, User.username).where(User.id.in_(missing)))
+                for uid, username in rows:
+                    user = CachedUser(uid, username)
+                    self.put(user)
+                    found[uid] = user
+        return found
+
+    def warm(self):
+        # most recently registered users first, up to the cache bound
+        with UsersSessionLocal() as db:
+            rows = db.execute(select(User.id, User.username).order_by(User.id.desc()).limit(self.maxsize)).all()
+        for uid, username in reversed(rows):
+            self.put(CachedUser(uid, username))
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+user_directory = UserDirectory()
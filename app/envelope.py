@@ -0,0 +1,76 @@
+import json
+import struct
+from typing import List, Optional, Sequence, Union
+
+try:
+    import msgpack
+except ImportError:  # optional: only the JSON encoding is offered when msgpack is not installed
+    msgpack = None
+
+
+# Every server -> client frame is {"v": 1, "e": [event, ...]} and every event is
+# {"t": kind, "d": data}. One frame may carry several events when a socket is busy.
+PROTOCOL_VERSION = 1
+EVENT_KINDS = ("message", "system", "presence", "group", "resume", "unread", "failed")
+
+# WebSocket subprotocols, in server preference order
+JSON_SUBPROTOCOL = "scd.v1.json"
+MSGPACK_SUBPROTOCOL = "scd.v1.msgpack"
+
+_JSON_PREFIX = '{"v":%d,"e":[' % PROTOCOL_VERSION
+# msgpack fixmap of two entries: "v" -> version, "e" -> array (header appended per frame)
+_MSGPACK_PREFIX = b"\x82\xa1v" + bytes([PROTOCOL_VERSION]) + b"\xa1e"
+
+
+class Event:
+    """One typed event, encoded lazily and at most once per encoding.
+
+    The same instance is queued to every recipient, so fan-out cost does not
+    depend on how many sockets use which encoding.
+    """
+
+    __slots__ = ("kind", "data", "_text", "_packed")
+
+    def __init__(self, kind: str, data: Union[str, dict]):
+        self.kind = kind
+        # serialized JSON; history frames from serialize_message are used as-is
+        self.data = data if isinstance(data, str) else json.dumps(data)
+        self._text: Optional[str] = None
+        self._packed: Optional[bytes] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = '{"t":"%s","d":%s}' % (self.kind, self.data)
+        return self._text
+
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = msgpack.packb({"t": self.kind, "d": json.loads(self.data)})
+        return self._packed
+
+
+def choose_subprotocol(offered: Sequence[str]) -> Optional[str]:
+    """Pick the encoding for a socket from the client's Sec-WebSocket-Protocol offer."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in offered:
+        return JSON_SUBPROTOCOL
+    # clients that do not negotiate still get the JSON envelope
+    return None
+
+
+def _array_header(n: int) -> bytes:
+    if n < 16:
+        return bytes([0x90 | n])
+    if n < 0x10000:
+        return b"\xdc" + struct.pack("!H", n)
+    return b"\xdd" + struct.pack("!I", n)
+
+
+def encode_frame(events: List[Event], binary: bool) -> Union[str, bytes]:
+    """Join already encoded events into one frame without re-serializing them."""
+    if binary:
+        return _MSGPACK_PREFIX + _array_header(len(events)) + b"".join(e.packed for e in events)
+    return _JSON_PREFIX + ",".join(e.text for e in events) + "]}"
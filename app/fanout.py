@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+from collections import deque
+from fastapi import WebSocket
+from typing import Deque, List, Optional, Sequence
+from .envelope import Event, encode_frame
+from .metrics import send_bytes, send_events, send_frames, send_seconds
+
+
+# Close code sent to clients evicted by the "disconnect" slow-consumer policy or the stall reaper
+SLOW_CONSUMER_CLOSE_CODE = 4408
+
+
+# events that carry the latest state of one group, so a newer one can absorb a queued one
+_STATE_KINDS = ("unread", "presence")
+
+
+def _merge_presence(older: dict, newer: dict) -> dict:
+    """One presence event equivalent to ``older`` followed by ``newer``."""
+    if "snapshot" in newer:
+        return newer
+    gone = set(newer.get("left", ()))
+    arrived = {user["id"]: user for user in newer.get("joined", ())}
+    if "snapshot" in older:
+        users = [user for user in older["snapshot"] if user["id"] not in gone and user["id"] not in arrived]
+        return {"group_id": older["group_id"], "snapshot": users + list(arrived.values())}
+    joined = [user for user in older.get("joined", ()) if user["id"] not in gone and user["id"] not in arrived]
+    left = [user_id for user_id in older.get("left", ()) if user_id not in arrived]
+    return {
+        "group_id": older["group_id"],
+        "joined": joined + list(arrived.values()),
+        "left": sorted(set(left) | gone),
+    }
+
+
+class Connection:
+    """Registry record of one WebSocket with its bounded outbox and writer task.
+
+    The writer sends everything queued at once as a single envelope frame. When
+    the socket was written less than ``batch_window`` seconds ago it lingers for
+    that long first, so a busy room costs one frame per window instead of one
+    per event while an idle one is not delayed.
+
+    When a full outbox sheds an event (``drop``: the new one, ``drop_oldest``:
+    the oldest) the next frame starts with an incomplete ``resume`` event so
+    the client reloads instead of silently missing it. ``coalesce`` first
+    folds the new event into a queued one it supersedes (the same group's
+    ``unread`` count or ``presence`` change) and sheds only when there is none.
+
+    Limits and policies are read from ``owner`` (the ConnectionManager), which
+    is also told when the connection closes, so a record carries only
+    per-socket state.
+    """
+
+    __slots__ = (
+        "websocket", "owner", "group_id", "user_id", "ip", "binary",
+        "pending", "dropped", "gap", "closed", "task", "_waiter", "_last_send", "sending_since",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        owner,
+        group_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        ip: Optional[str] = None,
+        binary: bool = False,
+    ):
+        self.websocket = websocket
+        self.owner = owner
+        self.group_id = group_id
+        self.user_id = user_id
+        self.ip = ip
+        self.binary = binary
+        # a plain deque and one future: far lighter per socket than an asyncio.Queue
+        self.pending: Deque[Event] = deque()
+        self.dropped = 0
+        # events were shed since the last frame; the client must be told before anything else
+        self.gap = False
+        self.closed = False
+        self.task: Optional[asyncio.Task] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self._last_send = 0.0
+        # monotonic start of the write in progress, None while idle
+        self.sending_since: Optional[float] = None
+
+    def start(self, initial: Sequence[Event] = ()):
+        """Start the writer; ``initial`` events are sent ahead of anything already queued."""
+        self.task = asyncio.create_task(self._run(list(initial)))
+
+    def offer(self, event: Event) -> bool:
+        """Queue an event without awaiting; returns False when it was not accepted."""
+        if self.closed:
+            return False
+        if len(self.pending) >= self.owner.outbox_size:
+            self.dropped += 1
+            policy = self.owner.policy
+            if policy == "coalesce" and self._coalesce(event):
+                return True
+            if policy in ("drop_oldest", "coalesce"):
+                # keep the most recent events and flag the hole for the client
+                self.pending.popleft()
+                self.gap = True
+            else:
+                if policy == "disconnect":
+                    self.evict()
+                else:
+                    self.gap = True
+                return False
+        self.pending.append(event)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        return True
+
+    def _coalesce(self, event: Event) -> bool:
+        """Replace a queued event that ``event`` supersedes with the two combined."""
+        if event.kind not in _STATE_KINDS:
+            return False
+        data = json.loads(event.data)
+        pending = self.pending
+        for i in range(len(pending) - 1, -1, -1):
+            queued = pending[i]
+            if queued.kind != event.kind:
+                continue
+            older = json.loads(queued.data)
+            if older.get("group_id") != data.get("group_id"):
+                continue
+            del pending[i]
+            merged = event if event.kind == "unread" else Event("presence", _merge_presence(older, data))
+            # the combined event goes to the back: it is as new as the one being offered
+            pending.append(merged)
+            return True
+        return False
+
+    def close(self):
+        self.closed = True
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def evict(self):
+        self.close()
+        self.owner._connection_closed(self)
+        # The writer may be stuck on a stalled transport, so close from a fresh task
+        self.task = asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE), timeout=5)
+        except Exception:
+            pass
+
+    async def _send(self, events: List[Event]):
+        frame = encode_frame(events, self.binary)
+        started = time.perf_counter()
+        self.sending_since = time.monotonic()
+        if self.binary:
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+        self.sending_since = None
+        send_seconds.observe(time.perf_counter() - started)
+        self._last_send = time.monotonic()
+        send_frames.inc()
+        send_events.inc(len(events))
+        send_bytes.inc(len(frame))
+
+    async def _run(self, initial: List[Event]):
+        batch_max = self.owner.batch_max
+        batch_window = self.owner.batch_window
+        pending = self.pending
+        try:
+            for start in range(0, len(initial), batch_max):
+                await self._send(initial[start:start + batch_max])
+            while True:
+                while not pending:
+                    self._waiter = asyncio.get_running_loop().create_future()
+                    await self._waiter
+                self._waiter = None
+                if batch_window and time.monotonic() - self._last_send < batch_window:
+                    await asyncio.sleep(batch_window)
+                events = [pending.popleft() for _ in range(min(batch_max, len(pending)))]
+                if self.gap:
+                    self.gap = False
+                    events.insert(0, Event("resume", {"group_id": self.group_id, "since": None, "replayed": 0, "complete": False}))
+                await self._send(events)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # peer went away mid-send; let the manager forget this socket
+            self.closed = True
+            self.owner._connection_closed(self)
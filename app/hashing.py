@@ -0,0 +1,83 @@
+import asyncio
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from fastapi import HTTPException
+from passlib.hash import bcrypt_sha256, bcrypt
+from .config import settings
+from .metrics import hash_seconds
+
+
+BCRYPT_SHA256_PREFIX = "$bcrypt-sha256$"
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+
+def hash_password(password: str) -> str:
+    # Use bcrypt_sha256 to support long passwords securely (pre-hash then bcrypt)
+    return bcrypt_sha256.hash(password)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    # pick the scheme from the hash prefix so a wrong password costs one bcrypt run, not two
+    try:
+        if password_hash.startswith(BCRYPT_SHA256_PREFIX):
+            return bcrypt_sha256.verify(password, password_hash)
+        if password_hash.startswith(BCRYPT_PREFIXES):
+            return bcrypt.verify(password, password_hash)
+    except ValueError:
+        pass
+    return False
+
+
+def _init_worker():
+    # Ctrl+C reaches the whole process group; the server shuts the pool down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return not password_hash.startswith(BCRYPT_SHA256_PREFIX)
+
+
+class HashingPool:
+    """Size-limited process pool for bcrypt with queue-depth admission control."""
+
+    def __init__(self, workers: int = settings.hash_workers, max_pending: int = settings.hash_max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        # spawn: forking a process that already runs an event loop and DB threads is unsafe
+        self._executor = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+        )
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, op: str, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+            hash_seconds.labels(op).observe(time.perf_counter() - started)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", hash_password, password)
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run("verify", verify_password, password, password_hash)
+
+
+hashing_pool = HashingPool()
@@ -0,0 +1,198 @@
+import json
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+from sqlalchemy import select
+from .config import settings
+from .db import ChatAsyncSession
+from .directory import user_directory
+from .models import ArchiveBlock, Message
+
+
+def serialize_message(message_id: int, group_id: int, author: str, content: str, created_at) -> str:
+    """The one JSON shape used for live frames, history pages and the ring buffer."""
+    return json.dumps({
+        "id": message_id,
+        "group_id": group_id,
+        "author": author,
+        "content": content,
+        "created_at": created_at.isoformat(),
+    })
+
+
+class _Ring:
+    __slots__ = ("entries", "size", "complete")
+
+    def __init__(self):
+        # (message id, serialized message), oldest first
+        self.entries: Deque[Tuple[int, str]] = deque()
+        self.size = 0
+        # True when nothing older than the first entry exists for the group
+        self.complete = False
+
+
+class RecentMessages:
+    """Per-group ring of the last N serialized messages with a global byte cap.
+
+    Rings are filled as messages are written and warmed from SQLite on first
+    read; whole groups are evicted least-recently-used first.
+    """
+
+    def __init__(self, per_group: int = settings.history_ring_size, max_bytes: int = settings.history_cache_bytes):
+        self.per_group = per_group
+        self.max_bytes = max_bytes
+        self.groups: "OrderedDict[int, _Ring]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def append(self, group_id: int, message_id: int, frame: str):
+        ring = self.groups.get(group_id)
+        if ring is None:
+            ring = self.groups[group_id] = _Ring()
+        self.groups.move_to_end(group_id)
+        entries = ring.entries
+        if entries and message_id < entries[-1][0]:
+            # ids from other workers can arrive slightly out of order
+            index = len(entries)
+            while index and entries[index - 1][0] > message_id:
+                index -= 1
+            entries.insert(index, (message_id, frame))
+        else:
+            entries.append((message_id, frame))
+        ring.size += len(frame)
+        self.size += len(frame)
+        if len(entries) > self.per_group:
+            _, dropped = entries.popleft()
+            ring.size -= len(dropped)
+            self.size -= len(dropped)
+            ring.complete = False
+        self._evict()
+
+    def discard(self, group_id: int, message_ids: List[int]):
+        """Forget messages that were announced but never stored."""
+        ring = self.groups.get(group_id)
+        if ring is None:
+            return
+        ids = set(message_ids)
+        kept = deque(entry for entry in ring.entries if entry[0] not in ids)
+        size = sum(len(frame) for _, frame in kept)
+        self.size -= ring.size - size
+        ring.entries, ring.size = kept, size
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self.groups) > 1:
+            _, ring = self.groups.popitem(last=False)
+            self.size -= ring.size
+
+    async def _warm(self, group_id: int) -> _Ring:
+        async with ChatAsyncSession() as db:
+            rows = list((await db.scalars(
+                select(Message)
+                .where(Message.group_id == group_id)
+                .order_by(Message.id.desc())
+                .limit(self.per_group + 1)
+            )).all())
+            complete = len(rows) <= self.per_group
+            if complete:
+                # older history may live in archive segments
+                complete = await db.scalar(select(ArchiveBlock.id).where(ArchiveBlock.group_id == group_id).limit(1)) is None
+        del rows[self.per_group:]
+        rows.reverse()
+        authors = await user_directory.get_many(m.author_id for m in rows)
+        ring = _Ring()
+        for m in rows:
+            author = authors[m.author_id].username if m.author_id in authors else f"user#{m.author_id}"
+            ring.entries.append((m.id, serialize_message(m.id, m.group_id, author, m.content, m.created_at)))
+        # keep anything appended while we were reading, including rows the writer has not committed yet
+        newest = ring.entries[-1][0] if ring.entries else 0
+        current = self.groups.pop(group_id, None)
+        if current is not None:
+            self.size -= current.size
+            ring.entries.extend(e for e in current.entries if e[0] > newest)
+        while len(ring.entries) > self.per_group:
+            ring.entries.popleft()
+            complete = False
+        ring.complete = complete
+        ring.size = sum(len(frame) for _, frame in ring.entries)
+        self.groups[group_id] = ring
+        self.size += ring.size
+        self._evict()
+        return ring
+
+    async def newest_page(self, group_id: int, limit: int) -> Optional[Tuple[list, bool]]:
+        """Newest ``limit`` frames (newest first) and whether older messages exist.
+
+        Returns None when the page cannot be answered from memory.
+        """
+        if limit > self.per_group:
+            return None
+        ring = self.groups.get(group_id)
+        if ring is not None and (len(ring.entries) >= limit or ring.complete):
+            self.hits += 1
+            self.groups.move_to_end(group_id)
+        else:
+            self.misses += 1
+            ring = await self._warm(group_id)
+        entries = ring.entries
+        if len(entries) < limit and not ring.complete:
+            # the rest of the page is archived; let the SQLite/archive path assemble it
+            return None
+        count = min(limit, len(entries))
+        page = [entries[-1 - i] for i in range(count)]
+        has_older = len(entries) > count or not ring.complete
+        return page, has_older
+
+    async def since(self, group_id: int, after_id: int, limit: int) -> Optional[List[str]]:
+        """Frames newer than ``after_id``, oldest first, for a reconnecting client.
+
+        Served from the ring when it reaches back far enough, otherwise the older
+        part comes from SQLite. Returns None when the gap exceeds ``limit``.
+        """
+        ring = self.groups.get(group_id)
+        if ring is not None:
+            self.hits += 1
+            self.groups.move_to_end(group_id)
+        else:
+            self.misses += 1
+            ring = await self._warm(group_id)
+        # newest first until the last message the client saw
+        gap = []
+        for message_id, frame in reversed(ring.entries):
+            if message_id <= after_id:
+                break
+            if len(gap) == limit:
+                return None
+            gap.append(frame)
+        gap.reverse()
+        oldest = ring.entries[0][0] if ring.entries else None
+        if oldest is None or oldest <= after_id or ring.complete:
+            return gap
+        # the ring starts inside the gap; rows before it are committed, pending ones are all in the ring
+        async with ChatAsyncSession() as db:
+            if await db.scalar(
+                select(ArchiveBlock.id).where(ArchiveBlock.group_id == group_id, ArchiveBlock.last_id > after_id).limit(1)
+            ) is not None:
+                return None
+            rows = list((await db.scalars(
+                select(Message)
+                .where(Message.group_id == group_id, Message.id > after_id, Message.id < oldest)
+                .order_by(Message.id)
+                .limit(limit - len(gap) + 1)
+            )).all())
+        if len(rows) > limit - len(gap):
+            return None
+        authors = await user_directory.get_many(m.author_id for m in rows)
+        older = [
+            serialize_message(
+                m.id, m.group_id, authors[m.author_id].username if m.author_id in authors else f"user#{m.author_id}",
+                m.content, m.created_at,
+            )
+            for m in rows
+        ]
+        return older + gap
+
+    def stats(self) -> dict:
+        return {"groups": len(self.groups), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+recent_messages = RecentMessages()
@@ -1,9 +1,22 @@
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
 from pathlib import Path
-from .db import init_db
+from .db import init_db, dispose_async_engines
 from .auth import router as auth_router
-from .chat import router as chat_router
+from .chat import router as chat_router, handle_bus_event, handle_dropped_messages, manager
+from .presence import presence
+from .hashing import hashing_pool
+from .assets import PrecompressedStaticFiles
+from .writer import message_writer
+from .directory import user_directory
+from .sessions import session_store
+from .bus import bus
+from .config import settings
+from .metrics import loop_monitor
+from .archive import archive
+from .membership import memberships
+from .catalog import catalog
+import asyncio
 import os
 from datetime import datetime
 
@@ -14,18 +27,56 @@ def create_app() -> FastAPI:
     templates_dir = base_dir / "templates"
     static_dir = base_dir / "static"
     app.state.templates_dir = templates_dir
-    app.mount("/static", StaticFiles(directory=static_dir), name="static")
+    # one template environment per app; every template is compiled here, not on first request
+    templates = Jinja2Templates(directory=str(templates_dir))
+    templates.env.auto_reload = settings.template_auto_reload
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
+    app.state.templates = templates
 
     # asset version for cache-busting
     # Prefer explicit ASSET_VERSION env var; otherwise derive from UTC timestamp at startup
     env_version = os.getenv("ASSET_VERSION")
     app.state.asset_version = env_version if env_version else datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    # text assets are precompressed in memory; versioned URLs are served as immutable
+    app.mount(
+        "/static",
+        PrecompressedStaticFiles(directory=static_dir, asset_version=app.state.asset_version),
+        name="static",
+    )
 
     app.include_router(auth_router)
     app.include_router(chat_router)
 
     @app.on_event("startup")
-    def _startup():
+    async def _startup():
         init_db()
+        user_directory.warm()
+        memberships.warm()
+        catalog.warm()
+        hashing_pool.start()
+        await bus.start(handle_bus_event)
+        message_writer.start(slot=bus.slot, stride=settings.workers, on_dropped=handle_dropped_messages)
+        presence.start(manager.deliver, slot=bus.slot)
+        app.state.session_sweeper = asyncio.create_task(session_store.run_sweeper())
+        app.state.reaper = asyncio.create_task(manager.run_reaper())
+        loop_monitor.start()
+        app.state.archiver = None
+        if archive.enabled and bus.slot == 0:
+            # one worker compacts; the others only read segments
+            app.state.archiver = asyncio.create_task(archive.run())
+
+    @app.on_event("shutdown")
+    async def _shutdown():
+        loop_monitor.stop()
+        app.state.session_sweeper.cancel()
+        app.state.reaper.cancel()
+        if app.state.archiver is not None:
+            app.state.archiver.cancel()
+        presence.stop()
+        await message_writer.stop()
+        await bus.stop()
+        await dispose_async_engines()
+        hashing_pool.stop()
 
     return app
@@ -0,0 +1,138 @@
+import heapq
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import literal, select
+from .db import ChatSessionLocal
+from .models import ArchiveBlock, Membership, Message
+
+
+class ReadState:
+    __slots__ = ("last_read_id", "read_total")
+
+    def __init__(self, last_read_id: int, read_total: int):
+        self.last_read_id = last_read_id
+        # the group's message total when the pointer last moved; unread = total - read_total
+        self.read_total = read_total
+
+
+class MembershipIndex:
+    """In-memory group -> member read state, warmed from ``memberships``.
+
+    Unread counts are kept per group rather than per member: every message
+    bumps one group total, and a member's unread count is that total minus the
+    total recorded when their read pointer last moved. Sending is O(1) however
+    many members a group has, and membership and unread lookups never query.
+    """
+
+    def __init__(self, session_factory=ChatSessionLocal):
+        self.session_factory = session_factory
+        self.members: Dict[int, Dict[int, ReadState]] = {}
+        # messages seen per group (including ones still queued in the writer) and the newest id
+        self.totals: Dict[int, int] = {}
+        self.newest: Dict[int, int] = {}
+
+    def warm(self):
+        """Load every membership with one ordered pass over the message ids.
+
+        A member's ``read_total`` is the number of messages up to their pointer.
+        Rather than counting per membership, the pointers of each group are
+        sorted and the group's ids are walked once in order (archived blocks
+        first, as whole blocks), so warming is linear in history plus
+        memberships. A pointer inside an archived block counts the whole block
+        as unread.
+        """
+        with self.session_factory() as db:
+            pointers: Dict[int, List[Tuple[int, int]]] = {}
+            for user_id, group_id, last_read_id in db.execute(
+                select(Membership.user_id, Membership.group_id, Membership.last_read_id)
+            ):
+                pointers.setdefault(group_id, []).append((last_read_id, user_id))
+            # blocks are few next to rows; reading them up front keeps one cursor open at a time
+            archived = [
+                tuple(row)
+                for row in db.execute(
+                    select(ArchiveBlock.group_id, ArchiveBlock.last_id, ArchiveBlock.count).order_by(
+                        ArchiveBlock.group_id, ArchiveBlock.last_id
+                    )
+                )
+            ]
+            hot = db.execute(
+                select(Message.group_id, Message.id, literal(1))
+                .order_by(Message.group_id, Message.id)
+                .execution_options(yield_per=5000)
+            )
+            group_id, total, newest, pending = None, 0, 0, []
+            # archived ids of a group are older than any of its hot rows, so one merge keeps id order
+            for row_group, last_id, count in heapq.merge(archived, map(tuple, hot)):
+                if row_group != group_id:
+                    if group_id is not None:
+                        self._warm_group(group_id, total, newest, pending)
+                    # descending, so the lowest pointer pops off the end
+                    group_id, total, pending = row_group, 0, sorted(pointers.pop(row_group, ()), reverse=True)
+                while pending and pending[-1][0] < last_id:
+                    last_read_id, user_id = pending.pop()
+                    self._set(group_id, user_id, ReadState(last_read_id, total))
+                total += count
+                newest = last_id
+            if group_id is not None:
+                self._warm_group(group_id, total, newest, pending)
+        # groups without any messages
+        for group_id, pending in pointers.items():
+            self._warm_group(group_id, 0, 0, pending)
+
+    def _warm_group(self, group_id: int, total: int, newest: int, pending: List[Tuple[int, int]]):
+        if newest:
+            self.totals[group_id] = total
+            self.newest[group_id] = newest
+        for last_read_id, user_id in pending:
+            self._set(group_id, user_id, ReadState(last_read_id, total))
+
+    def _set(self, group_id: int, user_id: int, state: ReadState):
+        self.members.setdefault(group_id, {})[user_id] = state
+
+    def is_member(self, group_id: int, user_id: int) -> bool:
+        return user_id in self.members.get(group_id, ())
+
+    def state(self, group_id: int, user_id: int) -> Optional[ReadState]:
+        return self.members.get(group_id, {}).get(user_id)
+
+    def add_member(self, group_id: int, user_id: int, last_read_id: Optional[int] = None):
+        """A new member starts with everything already in the group marked read."""
+        if self.is_member(group_id, user_id):
+            return
+        if last_read_id is None:
+            last_read_id = self.newest.get(group_id, 0)
+        self._set(group_id, user_id, ReadState(last_read_id, self.totals.get(group_id, 0)))
+
+    def on_message(self, group_id: int, message_id: int, author_id: Optional[int] = None):
+        """Count a new message; its author has read the group up to it (the writer persists that)."""
+        total = self.totals[group_id] = self.totals.get(group_id, 0) + 1
+        if message_id > self.newest.get(group_id, 0):
+            self.newest[group_id] = message_id
+        state = self.state(group_id, author_id) if author_id is not None else None
+        if state is not None and message_id > state.last_read_id:
+            state.last_read_id = message_id
+            state.read_total = total
+
+    def on_lost(self, group_id: int, count: int):
+        """Uncount messages the writer could not store; pointers already past them keep their place."""
+        self.totals[group_id] = max(0, self.totals.get(group_id, 0) - count)
+
+    def mark_read(self, group_id: int, user_id: int, message_id: int, unread: int):
+        """Move a read pointer forward; ``unread`` is what remains after ``message_id``."""
+        state = self.state(group_id, user_id)
+        if state is None or message_id <= state.last_read_id:
+            return
+        state.last_read_id = message_id
+        state.read_total = self.totals.get(group_id, 0) - unread
+
+    def unread(self, group_id: int, user_id: int) -> int:
+        state = self.state(group_id, user_id)
+        if state is None:
+            return 0
+        return max(0, self.totals.get(group_id, 0) - state.read_total)
+
+    def stats(self) -> dict:
+        return {"groups": len(self.members), "memberships": sum(len(m) for m in self.members.values())}
+
+
+memberships = MembershipIndex()
@@ -0,0 +1,245 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from .config import settings
+
+
+logger = logging.getLogger(__name__)
+
+# seconds; tuned for in-process work from tens of microseconds up to a slow fsync
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# password hashing is deliberately slow
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for n, v in zip(names, values))
+    return "{%s}" % pairs
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._function: Optional[Callable] = None
+
+    def labels(self, *values) -> "_Metric":
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def set_function(self, function: Callable):
+        """Compute the value at scrape time: a number, or {label values: number} for labelled metrics."""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            value = self._function()
+            if not self.labelnames:
+                return [f"{self.name} {value}"]
+            return [f"{self.name}{_format_labels(self.labelnames, k if isinstance(k, tuple) else (k,))} {v}" for k, v in value.items()]
+        if not self.labelnames:
+            return self._child_samples(self, "")
+        lines = []
+        for key, child in list(self._children.items()):
+            lines.extend(self._child_samples(child, _format_labels(self.labelnames, key)[1:-1]))
+        return lines
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+
+    def _new_child(self):
+        return Counter(self.name, self.help)
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def _child_samples(self, child, labels: str) -> List[str]:
+        return [f"{self.name}{{{labels}}} {child.value}" if labels else f"{self.name} {child.value}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def _new_child(self):
+        return Gauge(self.name, self.help)
+
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # non-cumulative per-bucket counts; the last slot is +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def _child_samples(self, child, labels: str) -> List[str]:
+        sep = "," if labels else ""
+        lines, total = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            total += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="{le}"}} {total}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{self.name}_sum{suffix} {child.sum}")
+        lines.append(f"{self.name}_count{suffix} {total}")
+        return lines
+
+
+class Registry:
+    """Process-local metrics rendered in the Prometheus text format.
+
+    Updates are plain attribute arithmetic (no locks); under the GIL a rare lost
+    increment from a worker thread is an acceptable price on the hot path.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics.values()) + "\n"
+
+
+registry = Registry()
+
+broadcast_seconds = registry.histogram("scd_broadcast_seconds", "Time to serialize and enqueue one frame for every local recipient")
+broadcast_recipients = registry.counter("scd_broadcast_recipients_total", "Frames enqueued to sockets by broadcast fan-out")
+send_seconds = registry.histogram("scd_ws_send_seconds", "Time to write one frame to a WebSocket")
+send_frames = registry.counter("scd_ws_frames_total", "Envelope frames written to WebSockets")
+send_events = registry.counter("scd_ws_events_total", "Events written to WebSockets (several per frame when batched)")
+send_bytes = registry.counter("scd_ws_frame_bytes_total", "Frame bytes written to WebSockets before permessage-deflate")
+db_query_seconds = registry.histogram("scd_db_query_seconds", "SQL statement execution time", ["db", "statement"])
+db_commit_seconds = registry.histogram("scd_db_commit_seconds", "Write-behind message batch commit time")
+db_commit_rows = registry.counter("scd_db_commit_rows_total", "Messages committed by the write-behind writer")
+hash_seconds = registry.histogram("scd_password_hash_seconds", "Password hash/verify time including pool queueing", ["op"], buckets=HASH_BUCKETS)
+session_lookup_seconds = registry.histogram("scd_session_lookup_seconds", "Session store lookup time", ["backend"])
+session_lookups = registry.counter("scd_session_lookups_total", "Session lookups by outcome", ["result"])
+group_connections = registry.gauge("scd_group_connections", "Open chat sockets per group on this worker", ["group_id"])
+connections = registry.gauge("scd_connections", "Open WebSockets on this worker")
+flood_rejected = registry.counter("scd_ws_flood_rejected_total", "Chat messages over a rate or size limit", ["reason", "mode"])
+loop_lag_seconds = registry.histogram("scd_event_loop_lag_seconds", "Extra delay of the loop monitor's timer (only with SCD_LOOP_STALL_MS)")
+loop_stalls = registry.counter("scd_event_loop_stalls_total", "Event loop stalls longer than SCD_LOOP_STALL_MS")
+
+
+def instrument_engine(engine, db: str):
+    """Time every statement run on a (sync) SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    # the start time lives on the statement's execution context, so a statement
+    # that raises (and never reaches after_cursor_execute) leaves nothing behind
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        context._scd_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_scd_query_start", None)
+        if started is None:
+            return
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        db_query_seconds.labels(db, kind).observe(time.perf_counter() - started)
+
+
+class LoopMonitor:
+    """Opt-in event loop stall detector.
+
+    A timer task on the loop records how late it wakes up; a watchdog thread
+    notices when the loop has not ticked for ``threshold`` seconds and logs the
+    stack the loop thread is stuck in, once per stall.
+    """
+
+    def __init__(self, threshold: float = settings.loop_stall_ms / 1000):
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self._last_tick = 0.0
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.threshold <= 0:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_tick = now
+            loop_lag_seconds.observe(max(0.0, now - expected))
+
+    def _watch(self):
+        reported = 0.0
+        while not self._stop.wait(self.interval):
+            last = self._last_tick
+            stalled = time.monotonic() - last
+            if stalled < self.threshold or last == reported:
+                continue
+            reported = last
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            logger.warning("event loop stalled for %.0f ms; loop thread is at:\n%s", stalled * 1000, stack)
+
+
+loop_monitor = LoopMonitor()
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from .db import UsersBase, ChatBase
 
@@ -34,12 +34,16 @@ class Membership(ChatBase):
     user_id: Mapped[int] = mapped_column(Integer, index=True)
     group_id: Mapped[int] = mapped_column(ForeignKey("groups.id", ondelete="CASCADE"))
     joined_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # read pointer: newest message id the user has seen in this group
+    last_read_id: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
     group = relationship("Group", back_populates="members")
 
 
 class Message(ChatBase):
     __tablename__ = "messages"
+    # keyset pagination walks (group_id, id) in either direction
+    __table_args__ = (Index("ix_messages_group_id_id", "group_id", "id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     group_id: Mapped[int] = mapped_column(ForeignKey("groups.id", ondelete="CASCADE"))
@@ -51,4 +55,23 @@ class Message(ChatBase):
     group = relationship("Group", back_populates="messages")
 
 
+class ArchiveBlock(ChatBase):
+    """Location and id/time range of one compressed block of archived messages."""
+
+    __tablename__ = "archive_blocks"
+    __table_args__ = (Index("ix_archive_blocks_group_id_last_id", "group_id", "last_id"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    group_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    # segment file relative to the archive directory
+    segment: Mapped[str] = mapped_column(String(255), nullable=False)
+    offset: Mapped[int] = mapped_column(Integer, nullable=False)
+    length: Mapped[int] = mapped_column(Integer, nullable=False)
+    count: Mapped[int] = mapped_column(Integer, nullable=False)
+    first_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    last_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    first_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    last_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+
 # Removed cross-DB association table; use Membership in chat DB.
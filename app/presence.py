@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from .bus import bus
+from .config import settings
+from .directory import user_directory
+from .envelope import Event
+
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """Reference-counted per-group presence, replicated between workers over the bus.
+
+    Each worker keeps the aggregate of every worker's connections and pushes
+    coalesced join/leave deltas to its own sockets. ``None`` as a group id
+    stands for the global "online anywhere" list shown on the notification socket.
+    """
+
+    def __init__(self, window: float = settings.presence_window_ms / 1000):
+        self.window = window
+        self.slot = 0
+        # worker slot -> (group_id, user_id) -> open connections on that worker
+        self._by_worker: Dict[int, Dict[Tuple[int, int], int]] = {}
+        # aggregated over all workers
+        self.groups: Dict[int, Dict[int, int]] = {}
+        self.users: Dict[int, int] = {}
+        self.user_ips: Dict[int, str] = {}
+        # membership last pushed to clients, per group (None = global)
+        self._published: Dict[Optional[int], Set[int]] = {}
+        self._dirty: Set[Optional[int]] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._deliver: Optional[Callable[[Event, Optional[int]], None]] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, deliver: Callable[[Event, Optional[int]], None], slot: int = 0):
+        self._deliver = deliver
+        self.slot = slot
+        self._wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+        # ask peers for their current state
+        bus.publish({"type": "hello", "slot": slot})
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def _apply(self, slot: int, group_id: int, user_id: int, delta: int) -> bool:
+        """Adjust counts; returns True when the user's presence in the group flipped."""
+        per_worker = self._by_worker.setdefault(slot, {})
+        key = (group_id, user_id)
+        count = per_worker.get(key, 0) + delta
+        if count > 0:
+            per_worker[key] = count
+        else:
+            per_worker.pop(key, None)
+
+        members = self.groups.setdefault(group_id, {})
+        before = members.get(user_id, 0)
+        after = before + delta
+        if after > 0:
+            members[user_id] = after
+        else:
+            members.pop(user_id, None)
+            if not members:
+                del self.groups[group_id]
+        was_online = user_id in self.users
+        total = self.users.get(user_id, 0) + delta
+        if total > 0:
+            self.users[user_id] = total
+        else:
+            self.users.pop(user_id, None)
+        if was_online != (total > 0):
+            self._mark(None)
+
+        flipped = (before > 0) != (after > 0)
+        if flipped:
+            self._mark(group_id)
+        return flipped
+
+    def _mark(self, group_id: Optional[int]):
+        self._dirty.add(group_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def join(self, group_id: int, user_id: int, ip: Optional[str] = None) -> bool:
+        if ip:
+            self.user_ips[user_id] = ip
+        bus.publish({"type": "presence", "slot": self.slot, "group_id": group_id, "user_id": user_id, "ip": ip, "delta": 1})
+        return self._apply(self.slot, group_id, user_id, 1)
+
+    def leave(self, group_id: int, user_id: int) -> bool:
+        bus.publish({"type": "presence", "slot": self.slot, "group_id": group_id, "user_id": user_id, "delta": -1})
+        flipped = self._apply(self.slot, group_id, user_id, -1)
+        if user_id not in self.users:
+            self.user_ips.pop(user_id, None)
+        return flipped
+
+    def apply_remote(self, event: dict):
+        if event.get("ip"):
+            self.user_ips[event["user_id"]] = event["ip"]
+        self._apply(event["slot"], event["group_id"], event["user_id"], event["delta"])
+        if event["user_id"] not in self.users:
+            self.user_ips.pop(event["user_id"], None)
+
+    def drop_worker(self, slot: int):
+        for (group_id, user_id), count in list(self._by_worker.get(slot, {}).items()):
+            self._apply(slot, group_id, user_id, -count)
+        self._by_worker.pop(slot, None)
+
+    def sync(self, slot: int, entries: Iterable[List]):
+        """Replace everything known about a peer's connections with its own report."""
+        self.drop_worker(slot)
+        for group_id, user_id, count, ip in entries:
+            if ip:
+                self.user_ips[user_id] = ip
+            self._apply(slot, group_id, user_id, count)
+
+    def publish_sync(self):
+        entries = [
+            [group_id, user_id, count, self.user_ips.get(user_id)]
+            for (group_id, user_id), count in self._by_worker.get(self.slot, {}).items()
+        ]
+        bus.publish({"type": "presence_sync", "slot": self.slot, "entries": entries})
+
+    def group_user_ids(self, group_id: int) -> List[int]:
+        return list(self.groups.get(group_id, ()))
+
+    def online_user_ids(self) -> List[int]:
+        return list(self.users)
+
+    async def _describe(self, user_ids: Iterable[int]) -> List[dict]:
+        users = await user_directory.get_many(user_ids)
+        return [{"id": u.id, "username": u.username, "ip": self.user_ips.get(u.id)} for u in users.values()]
+
+    async def snapshot(self, group_id: Optional[int] = None) -> Event:
+        ids = self.online_user_ids() if group_id is None else self.group_user_ids(group_id)
+        return Event("presence", {"group_id": group_id, "snapshot": await self._describe(ids)})
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # let a burst of joins/leaves (e.g. a reconnect storm) settle into one delta
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            dirty, self._dirty = self._dirty, set()
+            failed = False
+            for group_id in dirty:
+                try:
+                    await self._publish(group_id)
+                except Exception:
+                    # e.g. the user lookup hit a locked database: keep the group dirty and try again
+                    logger.exception("presence update for group %s failed", group_id)
+                    self._dirty.add(group_id)
+                    failed = True
+            if failed:
+                await asyncio.sleep(1)
+                self._wakeup.set()
+
+    async def _publish(self, group_id: Optional[int]):
+        current = set(self.users) if group_id is None else set(self.groups.get(group_id, ()))
+        published = self._published.get(group_id, set())
+        joined, left = current - published, published - current
+        if not joined and not left:
+            return
+        # described before anything is recorded, so a failure leaves the delta to be sent again
+        event = Event("presence", {"group_id": group_id, "joined": await self._describe(joined), "left": sorted(left)})
+        if current:
+            self._published[group_id] = current
+        else:
+            self._published.pop(group_id, None)
+        self._deliver(event, group_id)
+
+
+presence = PresenceTracker()
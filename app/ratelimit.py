@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import Dict, Literal, Optional, Tuple
+from pydantic import BaseModel
+from .config import settings
+from .metrics import flood_rejected
+
+
+# Close code sent to clients evicted by the "disconnect" flood mode (1009 is used for oversized messages)
+FLOOD_CLOSE_CODE = 4429
+TOO_BIG_CLOSE_CODE = 1009
+
+
+class FloodPolicy(BaseModel):
+    connection_rate: float = settings.flood_connection_rate
+    connection_burst: int = settings.flood_connection_burst
+    user_rate: float = settings.flood_user_rate
+    user_burst: int = settings.flood_user_burst
+    max_message_bytes: int = settings.flood_max_message_bytes
+    # drop: discard the message; delay: stop reading the socket until a token is free; disconnect: close it
+    mode: Literal["drop", "delay", "disconnect"] = settings.flood_mode
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+
+    def take(self) -> float:
+        """Consume a token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FloodGuard:
+    """Limits for one chat connection: its own bucket plus the user's bucket shared with their other tabs."""
+
+    __slots__ = ("policy", "connection", "user")
+
+    def __init__(self, policy: FloodPolicy, connection: Optional[TokenBucket], user: Optional[TokenBucket]):
+        self.policy = policy
+        self.connection = connection
+        self.user = user
+
+    async def admit(self, text: str) -> Optional[int]:
+        """Decide on one received message.
+
+        Returns None to process it, 0 to drop it, or a close code. In delay mode
+        this waits for a token; not calling ``receive_text`` meanwhile pushes
+        back on the client through the transport.
+        """
+        policy = self.policy
+        if len(text) > policy.max_message_bytes or len(text.encode()) > policy.max_message_bytes:
+            flood_rejected.labels("size", policy.mode).inc()
+            return TOO_BIG_CLOSE_CODE if policy.mode == "disconnect" else 0
+        for reason, bucket in (("connection", self.connection), ("user", self.user)):
+            if bucket is None:
+                continue
+            wait = bucket.take()
+            if not wait:
+                continue
+            flood_rejected.labels(reason, policy.mode).inc()
+            if policy.mode == "drop":
+                return 0
+            if policy.mode == "disconnect":
+                return FLOOD_CLOSE_CODE
+            while wait:
+                await asyncio.sleep(wait)
+                wait = bucket.take()
+        return None
+
+
+class FloodControl:
+    """Per-group flood policies and the per-user buckets of this worker."""
+
+    def __init__(self, overrides: Dict[int, dict] = settings.flood_groups):
+        self.default = FloodPolicy()
+        self.policies = {group_id: FloodPolicy(**dict(self.default.model_dump(), **fields)) for group_id, fields in overrides.items()}
+        # (group_id, user_id) -> [bucket, open connections]
+        self._users: Dict[Tuple[int, int], list] = {}
+
+    def policy(self, group_id: int) -> FloodPolicy:
+        return self.policies.get(group_id, self.default)
+
+    @property
+    def max_message_bytes(self) -> int:
+        return max([self.default.max_message_bytes] + [p.max_message_bytes for p in self.policies.values()])
+
+    def acquire(self, group_id: int, user_id: int) -> FloodGuard:
+        policy = self.policy(group_id)
+        connection = TokenBucket(policy.connection_rate, policy.connection_burst) if policy.connection_rate > 0 else None
+        user = None
+        if policy.user_rate > 0:
+            entry = self._users.get((group_id, user_id))
+            if entry is None:
+                entry = self._users[(group_id, user_id)] = [TokenBucket(policy.user_rate, policy.user_burst), 0]
+            entry[1] += 1
+            user = entry[0]
+        return FloodGuard(policy, connection, user)
+
+    def release(self, group_id: int, user_id: int):
+        entry = self._users.get((group_id, user_id))
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._users[(group_id, user_id)]
+
+
+flood_control = FloodControl()
@@ -0,0 +1,98 @@
+import argparse
+import html
+from typing import List, Optional
+from sqlalchemy import DateTime, Float, Integer, String, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# External-content FTS5 index over messages: only the inverted index is stored,
+# rows are read back from the messages table. group_id is indexed as a token so
+# a search intersects posting lists instead of filtering every hit of the term.
+FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        group_id, content,
+        content='messages', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, group_id, content) VALUES (new.id, new.group_id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, group_id, content) VALUES ('delete', old.id, old.group_id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, group_id, content) VALUES ('delete', old.id, old.group_id, old.content);
+        INSERT INTO messages_fts(rowid, group_id, content) VALUES (new.id, new.group_id, new.content);
+    END""",
+]
+
+# snippet() markers; the snippet is HTML-escaped before they become <mark> tags
+_HIT_START, _HIT_END = "\x01", "\x02"
+
+_SEARCH_SQL = text(
+    """SELECT m.id, m.author_id, m.created_at,
+              snippet(messages_fts, 1, char(1), char(2), '…', 16) AS snippet,
+              bm25(messages_fts, 0.0, 1.0) AS score
+       FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+       WHERE messages_fts MATCH :match
+       ORDER BY score
+       LIMIT :limit OFFSET :offset"""
+).columns(id=Integer, author_id=Integer, created_at=DateTime, snippet=String, score=Float)
+
+
+def ensure_search_index(engine):
+    with engine.begin() as conn:
+        for statement in FTS_DDL:
+            conn.exec_driver_sql(statement)
+
+
+def rebuild(engine):
+    """Re-index every stored message (backfill after upgrading an existing database)."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+
+def optimize(engine):
+    """Merge index segments; worth running after a large backfill or import."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+
+
+def build_match(query: str, group_id: int) -> Optional[str]:
+    """Turn free text into an FTS5 expression: every word must match, the last one as a prefix.
+
+    Words are quoted so user input can never be parsed as FTS5 syntax.
+    """
+    words = ['"%s"' % w.replace('"', '""') for w in query.split()]
+    if not words:
+        return None
+    words[-1] += "*"
+    return 'group_id : "%d" AND content : (%s)' % (group_id, " ".join(words))
+
+
+def highlight(snippet: str) -> str:
+    return html.escape(snippet).replace(_HIT_START, "<mark>").replace(_HIT_END, "</mark>")
+
+
+async def search_messages(db: AsyncSession, group_id: int, query: str, limit: int, offset: int) -> List:
+    match = build_match(query, group_id)
+    if match is None:
+        return []
+    result = await db.execute(_SEARCH_SQL, {"match": match, "limit": limit, "offset": offset})
+    return list(result.all())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the message search index")
+    parser.add_argument("command", choices=["rebuild", "optimize"])
+    args = parser.parse_args()
+    from .db import chat_engine, init_db
+    init_db()
+    if args.command == "rebuild":
+        rebuild(chat_engine)
+    optimize(chat_engine)
+    print(f"messages_fts: {args.command} done")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import asyncio
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+from .config import settings
+from .db import DATA_DIR
+from .metrics import session_lookup_seconds, session_lookups
+
+
+SESSIONS_DB_PATH = DATA_DIR / "sessions.sqlite3"
+
+
+class SessionStore(ABC):
+    """Session id -> user id mapping with TTL expiry and sliding renewal."""
+
+    backend = ""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    def create(self, user_id: int) -> str:
+        sid = secrets.token_urlsafe(24)
+        self._put(sid, user_id, time.time() + self.ttl)
+        return sid
+
+    @abstractmethod
+    def _put(self, sid: str, user_id: int, expires_at: float):
+        ...
+
+    def get(self, sid: str) -> Optional[int]:
+        """Return the user id for a live session, extending its lifetime."""
+        started = time.perf_counter()
+        user_id = self._get(sid)
+        session_lookup_seconds.labels(self.backend).observe(time.perf_counter() - started)
+        session_lookups.labels("hit" if user_id else "miss").inc()
+        return user_id
+
+    async def get_async(self, sid: str) -> Optional[int]:
+        """:meth:`get` for the event loop; stores that do I/O override it."""
+        return self.get(sid)
+
+    async def create_async(self, user_id: int) -> str:
+        """:meth:`create` for the event loop."""
+        return self.create(user_id)
+
+    async def delete_async(self, sid: str):
+        """:meth:`delete` for the event loop."""
+        self.delete(sid)
+
+    @abstractmethod
+    def _get(self, sid: str) -> Optional[int]:
+        ...
+
+    @abstractmethod
+    def delete(self, sid: str):
+        ...
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """Remove expired sessions; returns how many were dropped."""
+
+    async def run_sweeper(self, interval: float = settings.session_sweep_interval):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.sweep)
+
+
+class MemorySessionStore(SessionStore):
+    backend = "memory"
+
+    def __init__(self, ttl: float = settings.session_ttl, max_entries: int = settings.session_max_entries):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        # ordered by last use, which with a single TTL is also expiry order
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _put(self, sid: str, user_id: int, expires_at: float):
+        with self._lock:
+            self._entries[sid] = (user_id, expires_at)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get(self, sid: str) -> Optional[int]:
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            now = time.time()
+            if entry[1] < now:
+                del self._entries[sid]
+                return None
+            self._entries[sid] = (entry[0], now + self.ttl)
+            self._entries.move_to_end(sid)
+            return entry[0]
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def sweep(self) -> int:
+        now = time.time()
+        dropped = 0
+        with self._lock:
+            while self._entries:
+                sid, (_, expires_at) = next(iter(self._entries.items()))
+                if expires_at >= now:
+                    break
+                del self._entries[sid]
+                dropped += 1
+        return dropped
+
+
+class SQLiteSessionStore(SessionStore):
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        path: Path = SESSIONS_DB_PATH,
+        ttl: float = settings.session_ttl,
+        cache_seconds: float = settings.session_cache_seconds,
+        cache_entries: int = settings.session_max_entries,
+    ):
+        super().__init__(ttl)
+        self.cache_seconds = cache_seconds
+        self.cache_entries = cache_entries
+        # sid -> (user_id, expires_at, trusted until): sessions this worker saw recently, answered
+        # without SQLite; least recently remembered first, so login churn evicts the oldest
+        self._cache: "OrderedDict[str, Tuple[int, float, float]]" = OrderedDict()
+        # lookups run both on the event loop and in threads
+        self._cache_lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "sid TEXT PRIMARY KEY, user_id INTEGER NOT NULL, expires_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)")
+        self._lock = threading.Lock()
+
+    def _put(self, sid: str, user_id: int, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (sid, user_id, expires_at) VALUES (?, ?, ?)",
+                (sid, user_id, expires_at),
+            )
+        self._remember(sid, user_id, expires_at)
+
+    def _remember(self, sid: str, user_id: int, expires_at: float):
+        if self.cache_seconds <= 0:
+            return
+        with self._cache_lock:
+            self._cache[sid] = (user_id, expires_at, time.time() + self.cache_seconds)
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def _forget(self, sid: str):
+        with self._cache_lock:
+            self._cache.pop(sid, None)
+
+    def _cached(self, sid: str) -> Optional[int]:
+        """The user id when the cache can answer: recently seen and not due for renewal."""
+        with self._cache_lock:
+            entry = self._cache.get(sid)
+        if entry is None:
+            return None
+        now = time.time()
+        if now >= entry[2] or entry[1] - now < self.ttl / 2:
+            return None
+        return entry[0]
+
+    async def get_async(self, sid: str) -> Optional[int]:
+        # misses and renewals wait on SQLite (busy_timeout, the sweeper's lock) in a thread
+        if self._cached(sid) is not None:
+            return self.get(sid)
+        return await asyncio.to_thread(self.get, sid)
+
+    async def create_async(self, user_id: int) -> str:
+        return await asyncio.to_thread(self.create, user_id)
+
+    async def delete_async(self, sid: str):
+        await asyncio.to_thread(self.delete, sid)
+
+    def _get(self, sid: str) -> Optional[int]:
+        user_id = self._cached(sid)
+        if user_id is not None:
+            return user_id
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id, expires_at FROM sessions WHERE sid = ?", (sid,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                self._forget(sid)
+                return None
+            user_id, expires_at = row
+            # renew at most once per half-TTL so reads stay read-only most of the time
+            if expires_at - now < self.ttl / 2:
+                expires_at = now + self.ttl
+                self._conn.execute("UPDATE sessions SET expires_at = ? WHERE sid = ?", (expires_at, sid))
+        self._remember(sid, user_id, expires_at)
+        return user_id
+
+    def delete(self, sid: str):
+        self._forget(sid)
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._cache_lock:
+            for sid in [sid for sid, entry in self._cache.items() if entry[2] <= now]:
+                del self._cache[sid]
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,)).rowcount
+
+
+def create_session_store(backend: str = settings.session_backend) -> SessionStore:
+    if backend == "sqlite":
+        return SQLiteSessionStore()
+    return MemorySessionStore()
+
+
+session_store = create_session_store()
@@ -10,6 +10,25 @@
   const groupActiveUsers = document.getElementById('groupActiveUsers');
   let currentGroup = null;
   let ws = null;
+  let olderCursor = null;
+  // newest message id rendered for the open group; sent as ?since= when reconnecting
+  let lastSeenId = null;
+  let seenIds = new Set();
+  let reconnectAttempts = 0;
+  let reconnectTimer = null;
+  let readTimer = null;
+  let groupList = [];
+  // catalog version of groupList (X-Groups-Version) and the ETag of the last catalog delta
+  let groupsVersion = null;
+  let groupsEtag = null;
+  let loadingOlder = false;
+  // presence is pushed by the server: a snapshot on connect, then join/leave deltas
+  const groupPresence = new Map();
+  const globalPresence = new Map();
+  let groupPoll = null;
+  let globalPoll = null;
+  // server frames are {"v": 1, "e": [{"t": kind, "d": data}, ...]}
+  const PROTOCOL = 'scd.v1.json';
 
   function api(url, opts={}){
     return fetch(url, opts).then(r => {
@@ -32,74 +51,193 @@
   }
 
   function renderGroups(list){
+    groupList = list;
     groupsDiv.innerHTML = '';
     list.forEach(g => {
       const btn = document.createElement('button');
       btn.textContent = g.name;
       btn.className = 'ghost';
+      if (g.unread && g.id !== currentGroup) {
+        const badge = document.createElement('span');
+        badge.className = 'badge';
+        badge.textContent = g.unread > 99 ? '99+' : String(g.unread);
+        btn.appendChild(badge);
+      }
       btn.onclick = () => joinAndOpen(g.id, g.name);
       groupsDiv.appendChild(btn);
     });
   }
 
-  function renderMessages(list){
+  function messageDiv(m){
+    const div = document.createElement('div');
+    div.className = 'msg';
+    div.dataset.id = m.id;
+    const t = fmtTimeHHMMSS(m.created_at);
+    div.textContent = `[${t}] ${m.author}: ${m.content}`;
+    return div;
+  }
+
+  // pages arrive newest-first; the list is rendered oldest-first
+  function renderMessages(page){
     messagesDiv.innerHTML = '';
-    list.forEach(m => {
-      const div = document.createElement('div');
-      div.className = 'msg';
-      const t = fmtTimeHHMMSS(m.created_at);
-      div.textContent = `[${t}] ${m.author}: ${m.content}`;
-      messagesDiv.appendChild(div);
-    });
+    seenIds = new Set(page.messages.map(m => m.id));
+    lastSeenId = page.messages.length ? page.messages[0].id : null;
+    page.messages.slice().reverse().forEach(m => messagesDiv.appendChild(messageDiv(m)));
+    olderCursor = page.older;
     messagesDiv.scrollTop = messagesDiv.scrollHeight;
   }
 
-  function addIncoming(text){
+  function prependOlder(page){
+    const prevHeight = messagesDiv.scrollHeight;
+    page.messages.forEach(m => messagesDiv.insertBefore(messageDiv(m), messagesDiv.firstChild));
+    olderCursor = page.older;
+    // keep the viewport anchored on the message the user was reading
+    messagesDiv.scrollTop += messagesDiv.scrollHeight - prevHeight;
+  }
+
+  function loadOlder(){
+    if (!currentGroup || !olderCursor || loadingOlder) return;
+    const groupId = currentGroup;
+    loadingOlder = true;
+    api(`/api/messages?group_id=${groupId}&before=${encodeURIComponent(olderCursor)}`)
+      .then(page => { if (groupId === currentGroup) prependOlder(page); })
+      .catch(console.error)
+      .finally(() => { loadingOlder = false; });
+  }
+
+  messagesDiv.addEventListener('scroll', () => {
+    if (messagesDiv.scrollTop === 0) loadOlder();
+  });
+
+  function applyPresence(store, ev){
+    if (ev.snapshot) {
+      store.clear();
+      ev.snapshot.forEach(u => store.set(u.id, u));
+    }
+    (ev.joined || []).forEach(u => store.set(u.id, u));
+    (ev.left || []).forEach(id => store.delete(id));
+  }
+
+  function eachEvent(data, handler){
+    const frame = JSON.parse(data);
+    if (frame.v !== 1) return;
+    frame.e.forEach(ev => handler(ev.t, ev.d));
+  }
+
+  function systemDiv(d){
     const div = document.createElement('div');
-    try {
-        const message = JSON.parse(text);
-        div.className = 'msg';
-        const t = fmtTimeHHMMSS(message.created_at || new Date());
-        div.textContent = `[${t}] ${message.author}: ${message.content}`;
-    } catch (e) {
-        div.className = 'sys';
-        const t = fmtTimeHHMMSS(new Date());
-        div.textContent = `[${t}] ${text}`;
+    div.className = 'sys';
+    div.textContent = `[${fmtTimeHHMMSS(new Date())}] [system] ${d.user} ${d.action}`;
+    return div;
+  }
+
+  function addIncoming(data){
+    let added = false;
+    eachEvent(data, (kind, d) => {
+      if (kind === 'presence') {
+        applyPresence(groupPresence, d);
+        renderGroupActiveUsers(Array.from(groupPresence.values()));
+      } else if (kind === 'message') {
+        // a replayed gap may overlap live frames queued during the reconnect
+        if (seenIds.has(d.id)) return;
+        seenIds.add(d.id);
+        if (lastSeenId === null || d.id > lastSeenId) lastSeenId = d.id;
+        messagesDiv.appendChild(messageDiv(d));
+        added = true;
+      } else if (kind === 'system') {
+        messagesDiv.appendChild(systemDiv(d));
+        added = true;
+      } else if (kind === 'failed') {
+        // messages the server broadcast but could not save
+        d.ids.forEach(id => {
+          const div = messagesDiv.querySelector(`.msg[data-id="${id}"]`);
+          if (div && !div.classList.contains('failed')) {
+            div.classList.add('failed');
+            div.textContent += ' (not saved)';
+          }
+        });
+      } else if (kind === 'resume' && !d.complete) {
+        // too much was missed to replay: start over from the newest page
+        reloadNewest(d.group_id);
+      }
+    });
+    // one layout pass per frame, however many events it batched
+    if (added) {
+      messagesDiv.scrollTop = messagesDiv.scrollHeight;
+      scheduleRead();
     }
-    messagesDiv.appendChild(div);
-    messagesDiv.scrollTop = messagesDiv.scrollHeight;
   }
 
-  function openWS(groupId){
+  // move the read pointer at most once a second, and only while the room is actually visible
+  function scheduleRead(){
+    if (readTimer || document.hidden || !currentGroup || lastSeenId === null) return;
+    readTimer = setTimeout(() => {
+      readTimer = null;
+      if (!currentGroup || lastSeenId === null) return;
+      api(`/api/groups/${currentGroup}/read?message_id=${lastSeenId}`, { method: 'POST' }).catch(console.error);
+    }, 1000);
+  }
+  document.addEventListener('visibilitychange', scheduleRead);
+
+  function reloadNewest(groupId){
+    api('/api/messages?group_id='+groupId)
+      .then(page => { if (groupId === currentGroup) renderMessages(page); })
+      .catch(console.error);
+  }
+
+  function openWS(groupId, since){
     if (ws) ws.close();
+    if (reconnectTimer) { clearTimeout(reconnectTimer); reconnectTimer = null; }
+    groupPresence.clear();
     const proto = location.protocol === 'https:' ? 'wss' : 'ws';
-    ws = new WebSocket(`${proto}://${location.host}/ws/chat/${groupId}`);
-    ws.onmessage = (e) => addIncoming(e.data);
-    ws.onclose = () => {};
+    const query = since != null ? `?since=${since}` : '';
+    const sock = new WebSocket(`${proto}://${location.host}/ws/chat/${groupId}${query}`, PROTOCOL);
+    ws = sock;
+    sock.onmessage = (e) => addIncoming(e.data);
+    sock.onopen = () => {
+      reconnectAttempts = 0;
+      if (groupPoll) { clearInterval(groupPoll); groupPoll = null; }
+    };
+    sock.onclose = (e) => {
+      if (ws !== sock) return;  // replaced by a group switch
+      // fall back to polling only while this room's socket is down
+      if (!groupPoll) groupPoll = setInterval(updateGroupActiveUsers, 4000);
+      if (e.code === 4401 || e.code === 4403) return;  // session gone or not a member: reconnecting cannot help
+      // full jitter spreads a mass reconnect (deploy, network blip) over the backoff window
+      const backoff = Math.min(30000, 500 * 2 ** reconnectAttempts++);
+      reconnectTimer = setTimeout(() => {
+        reconnectTimer = null;
+        if (currentGroup === groupId) openWS(groupId, lastSeenId);
+      }, Math.random() * backoff);
+    };
+  }
+
+  function renderGroupActiveUsers(list){
+    if (!groupActiveUsers) return;
+    if (!Array.isArray(list) || list.length === 0) {
+      groupActiveUsers.textContent = '—';
+      return;
+    }
+    groupActiveUsers.textContent = list.map(u => u.username).join(', ');
   }
 
   function updateGroupActiveUsers(){
     if (!currentGroup || !groupActiveUsers) return;
     api(`/api/groups/${currentGroup}/active_users`)
-      .then(list => {
-        if (!Array.isArray(list) || list.length === 0) {
-          groupActiveUsers.textContent = '—';
-          return;
-        }
-        groupActiveUsers.textContent = list.map(u => u.username).join(', ');
-      })
+      .then(renderGroupActiveUsers)
       .catch(() => { groupActiveUsers.textContent = '—'; });
   }
 
   function joinAndOpen(groupId, groupName){
     api('/api/groups/join?group_id='+groupId, { method: 'POST' })
       .then(() => api('/api/messages?group_id='+groupId))
-      .then(msgs => {
+      .then(page => {
         currentGroup = groupId;
         if (currentGroupTitle) currentGroupTitle.textContent = groupName || `#${groupId}`;
-        renderMessages(msgs);
+        renderMessages(page);
         openWS(groupId);
-        updateGroupActiveUsers();
+        scheduleRead();
+        loadGroups();
       })
       .catch(e => console.error(e));
   }
@@ -121,24 +259,51 @@
     messageInput.value = '';
   });
 
+  // groups with unread counts in one call; afterwards badges follow "unread" pushes on the notification socket
+  let groupsPoll = null;
   function loadGroups(){
-    api('/api/groups').then(renderGroups).catch(console.error);
+    fetch('/api/me/groups').then(r => {
+      if (!r.ok) throw new Error('HTTP '+r.status);
+      groupsVersion = Number(r.headers.get('X-Groups-Version'));
+      return r.json();
+    }).then(renderGroups).catch(console.error);
   }
-  function loadActiveUsers(){
-    api('/api/users/active').then(list => {
-      activeUsersUl.innerHTML='';
-      list.forEach(u => {
-        const li = document.createElement('li');
-        li.textContent = u.ip ? `${u.username} (${u.ip})` : u.username;
-        activeUsersUl.appendChild(li);
+
+  function addGroups(list){
+    const known = new Set(groupList.map(g => g.id));
+    const added = list.filter(g => !known.has(g.id))
+      .map(g => ({ id: g.id, name: g.name, member: false, unread: 0, last_read_id: null }));
+    if (added.length) renderGroups(groupList.concat(added));
+  }
+
+  // groups added since groupsVersion; a 304 means the catalog has not changed since the last delta
+  function loadMissedGroups(){
+    if (groupsVersion === null) return;
+    const headers = groupsEtag ? { 'If-None-Match': groupsEtag } : {};
+    fetch(`/api/groups?since_version=${groupsVersion}`, { headers }).then(r => {
+      if (r.status === 304) return;
+      if (!r.ok) throw new Error('HTTP '+r.status);
+      groupsEtag = r.headers.get('ETag');
+      const version = Number(r.headers.get('X-Groups-Version'));
+      return r.json().then(list => {
+        addGroups(list);
+        groupsVersion = Math.max(groupsVersion, version);
       });
     }).catch(console.error);
   }
+  function renderActiveUsers(list){
+    activeUsersUl.innerHTML='';
+    list.forEach(u => {
+      const li = document.createElement('li');
+      li.textContent = u.ip ? `${u.username} (${u.ip})` : u.username;
+      activeUsersUl.appendChild(li);
+    });
+  }
+  function loadActiveUsers(){
+    api('/api/users/active').then(renderActiveUsers).catch(console.error);
+  }
 
   loadGroups();
-  loadActiveUsers();
-  setInterval(loadActiveUsers, 4000);
-  setInterval(updateGroupActiveUsers, 4000);
 
   const themeToggle = document.getElementById('theme-toggle');
   if (themeToggle) {
@@ -147,14 +312,45 @@
       });
   }
 
-  const notificationWs = new WebSocket(`${location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws`);
+  const notificationWs = new WebSocket(`${location.protocol === 'https:' ? 'wss' : 'ws'}://${window.location.host}/ws`, PROTOCOL);
 
   notificationWs.onmessage = function(event) {
-      const message = event.data;
-      if (message.startsWith("new_group:")) {
-          // Refresh groups list without reloading the page to keep current chat open
-          loadGroups();
+      eachEvent(event.data, (kind, d) => {
+          if (kind === 'group') {
+              // the push carries the new group itself: no refetch, so a new group costs one small frame per client
+              addGroups([d]);
+              if (groupsVersion !== null && d.version > groupsVersion + 1) {
+                  // pushes were missed (e.g. while the list was loading): fetch just the gap
+                  loadMissedGroups();
+              } else if (groupsVersion !== null) {
+                  groupsVersion = Math.max(groupsVersion, d.version);
+              }
+          } else if (kind === 'presence') {
+              applyPresence(globalPresence, d);
+              renderActiveUsers(Array.from(globalPresence.values()));
+          } else if (kind === 'resume' && !d.complete) {
+              // the server shed events for this socket: reload what they would have updated
+              loadGroups();
+              api('/api/users/active').then(list => {
+                  applyPresence(globalPresence, { snapshot: list });
+                  renderActiveUsers(list);
+              }).catch(console.error);
+          } else if (kind === 'unread') {
+              const g = groupList.find(g => g.id === d.group_id);
+              if (g && g.unread !== d.unread) {
+                  g.unread = d.unread;
+                  renderGroups(groupList);
+              }
+          }
+      });
+  };
+  notificationWs.onclose = function() {
+      if (!globalPoll) {
+          loadActiveUsers();
+          globalPoll = setInterval(loadActiveUsers, 4000);
       }
+      // no more pushed badges: poll the counts while the socket is down
+      if (!groupsPoll) groupsPoll = setInterval(loadGroups, 15000);
   };
 
 })();
@@ -0,0 +1,33 @@
+import ssl
+from typing import Optional
+import uvicorn
+from .config import TLSConfig
+
+
+def apply_tls_profile(ctx: ssl.SSLContext, cfg: TLSConfig):
+    """Protocol floor and resumption policy from ``tls_config.json``."""
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_3 if cfg.min_version == "1.3" else ssl.TLSVersion.TLSv1_2
+    if cfg.session_tickets:
+        ctx.options &= ~ssl.OP_NO_TICKET
+    else:
+        ctx.options |= ssl.OP_NO_TICKET
+    ctx.num_tickets = cfg.num_tickets
+
+
+class TLSServerConfig(uvicorn.Config):
+    """uvicorn config whose SSL context also gets the TLS profile.
+
+    uvicorn builds the context itself in ``load`` (once per worker process) and
+    only exposes cert, key and cipher options, so the rest is applied afterwards.
+    """
+
+    def __init__(self, app, tls: Optional[TLSConfig] = None, **kwargs):
+        self.tls = tls
+        if tls is not None and tls.ciphers:
+            kwargs.setdefault("ssl_ciphers", tls.ciphers)
+        super().__init__(app, **kwargs)
+
+    def load(self):
+        super().load()
+        if self.is_ssl and self.tls is not None:
+            apply_tls_profile(self.ssl, self.tls)
@@ -0,0 +1,324 @@
+import argparse
+import gzip
+import io
+import json
+import lzma
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+from sqlalchemy import DateTime, select
+from sqlalchemy.orm import Session
+from .archive import archive
+from .db import ChatBase, _ensure_indexes, chat_engine, init_db, users_engine
+from .models import Group, Membership, Message, User
+from .search import ensure_search_index, optimize, rebuild
+
+try:
+    import zstandard
+except ImportError:  # optional: .zst files are only supported when zstandard is installed
+    zstandard = None
+
+
+# One JSON object per line: a header, then users, groups, memberships and messages,
+# each tagged with "type". Ids are kept; user references also carry the username
+# so an import into another users database can re-link them.
+FORMAT_VERSION = 1
+KINDS = ("user", "group", "membership", "message")
+
+# stay well under SQLite's host parameter limit (999 on older builds)
+_IN_BATCH = 500
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+_INSERT = {
+    "user": "INSERT INTO users (id, username, password_hash, created_at) VALUES (?, ?, ?, ?)",
+    "group": "INSERT INTO groups (id, name, created_at) VALUES (?, ?, ?)",
+    "membership": "INSERT INTO memberships (user_id, group_id, joined_at, last_read_id) VALUES (?, ?, ?, ?)",
+    "message": "INSERT INTO messages (id, group_id, author_id, content, created_at) VALUES (?, ?, ?, ?, ?)",
+}
+# into a users database that already has accounts: existing usernames keep theirs
+_MERGE_USER = "INSERT OR IGNORE INTO users (username, password_hash, created_at) VALUES (?, ?, ?)"
+
+
+def open_stream(path: str, mode: str, level: int = 6) -> TextIO:
+    """Text stream over ``path`` ("-" for stdin/stdout), compressed by suffix: .gz, .xz or .zst."""
+    if path == "-":
+        return io.TextIOWrapper(sys.stdout.buffer if mode == "w" else sys.stdin.buffer, encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=level)
+    if path.endswith(".xz"):
+        return lzma.open(path, mode + "t", encoding="utf-8", preset=level if mode == "w" else None)
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("reading or writing .zst files needs the zstandard package")
+        raw = open(path, mode + "b")
+        if mode == "w":
+            return io.TextIOWrapper(zstandard.ZstdCompressor(level=level).stream_writer(raw), encoding="utf-8")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(raw), encoding="utf-8")
+    return open(path, mode, encoding="utf-8", buffering=1 << 20)
+
+
+class _Lookup:
+    """Memoized key -> value map filled a batch of unknown keys per query.
+
+    Only users are cached, so memory follows the number of accounts, not the
+    length of the history streamed past it.
+    """
+
+    def __init__(self, fetch: Callable[[List], Iterable]):
+        self.fetch = fetch
+        self.known: Dict = {}
+
+    def resolve(self, keys: Iterable) -> Dict:
+        missing = list({k for k in keys if k not in self.known})
+        for start in range(0, len(missing), _IN_BATCH):
+            batch = missing[start:start + _IN_BATCH]
+            self.known.update((key, value) for key, value in self.fetch(batch))
+            for key in batch:
+                self.known.setdefault(key, None)
+        return self.known
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _partitions(conn, query, chunk: int) -> Iterator[list]:
+    # yield_per streams the cursor: at most ``chunk`` rows are materialized at a time
+    return conn.execute(query.execution_options(yield_per=chunk)).partitions()
+
+
+def export(
+    out: TextIO,
+    users: bool = True,
+    archived: bool = True,
+    chunk: int = 10_000,
+    chat_bind=chat_engine,
+    users_bind=users_engine,
+    store=archive,
+) -> Dict[str, int]:
+    """Stream both databases to ``out`` as NDJSON; returns the record count per type."""
+    counts = dict.fromkeys(KINDS, 0)
+    out.write(_encode({"type": "header", "version": FORMAT_VERSION, "exported_at": datetime.utcnow().isoformat()}) + "\n")
+    with users_bind.connect() as users_conn, chat_bind.connect() as chat_conn:
+        # pysqlite only opens a transaction for writes, so each SELECT would read its own snapshot
+        # and rows the archiver moves between the archive scan and the hot query would be lost.
+        # An explicit read transaction pins every chat read below to one snapshot.
+        chat_conn.exec_driver_sql("BEGIN")
+        names = _Lookup(lambda ids: users_conn.execute(select(User.id, User.username).where(User.id.in_(ids))))
+
+        if users:
+            query = select(User.id, User.username, User.password_hash, User.created_at).order_by(User.id)
+            for rows in _partitions(users_conn, query, chunk):
+                out.write("".join(
+                    _encode({"type": "user", "id": r.id, "username": r.username, "password_hash": r.password_hash, "created_at": _iso(r.created_at)}) + "\n"
+                    for r in rows
+                ))
+                counts["user"] += len(rows)
+
+        for rows in _partitions(chat_conn, select(Group.id, Group.name, Group.created_at).order_by(Group.id), chunk):
+            out.write("".join(_encode({"type": "group", "id": r.id, "name": r.name, "created_at": _iso(r.created_at)}) + "\n" for r in rows))
+            counts["group"] += len(rows)
+
+        query = select(Membership.user_id, Membership.group_id, Membership.joined_at, Membership.last_read_id).order_by(Membership.id)
+        for rows in _partitions(chat_conn, query, chunk):
+            known = names.resolve(r.user_id for r in rows)
+            out.write("".join(
+                _encode({"type": "membership", "user_id": r.user_id, "user": known[r.user_id], "group_id": r.group_id,
+                         "joined_at": _iso(r.joined_at), "last_read_id": r.last_read_id}) + "\n"
+                for r in rows
+            ))
+            counts["membership"] += len(rows)
+
+        def write_messages(rows):
+            known = names.resolve(r.author_id for r in rows)
+            out.write("".join(
+                _encode({"type": "message", "id": r.id, "group_id": r.group_id, "author_id": r.author_id, "author": known[r.author_id],
+                         "content": r.content, "created_at": _iso(r.created_at)}) + "\n"
+                for r in rows
+            ))
+            counts["message"] += len(rows)
+
+        if archived:
+            with Session(bind=chat_conn) as db:
+                for block in store.scan(db):
+                    write_messages(block)
+        query = select(Message.id, Message.group_id, Message.author_id, Message.content, Message.created_at).order_by(Message.id)
+        for rows in _partitions(chat_conn, query, chunk):
+            write_messages(rows)
+    return counts
+
+
+def _bulk_indexes() -> list:
+    # non-unique indexes on the bulk tables are rebuilt once at the end instead of per row
+    return [
+        index
+        for table in ChatBase.metadata.sorted_tables if table.name in ("memberships", "messages")
+        for index in table.indexes if not index.unique
+    ]
+
+
+def import_records(
+    lines: Iterable[str],
+    batch: int = 10_000,
+    commit_every: int = 500_000,
+    chat_bind=chat_engine,
+    users_bind=users_engine,
+) -> Dict[str, int]:
+    """Load an export into empty chat tables; returns the record count per type.
+
+    Into an empty users database user ids are kept as exported. Into one that
+    already has accounts, authors and members are re-linked by username; rows
+    whose user is not there (the export left accounts out, or the name is
+    unknown) would otherwise take someone else's id, so they are skipped and
+    counted as ``unlinked``.
+
+    Rows go in with ``executemany`` in transactions of ``commit_every`` rows,
+    with secondary indexes and the search trigger dropped meanwhile; both are
+    rebuilt afterwards, also when the import fails part way.
+    """
+    chat_raw, users_raw = chat_bind.raw_connection(), users_bind.raw_connection()
+    chat_db, users_db = chat_raw.driver_connection, users_raw.driver_connection
+    if chat_db.execute("SELECT EXISTS (SELECT 1 FROM groups) OR EXISTS (SELECT 1 FROM messages)").fetchone()[0]:
+        chat_raw.close()
+        users_raw.close()
+        raise RuntimeError("the chat database is not empty; import into a fresh SCD_DATA_DIR")
+    try:
+        keep_user_ids = not users_db.execute("SELECT EXISTS (SELECT 1 FROM users)").fetchone()[0]
+        to_db_time = chat_bind.dialect.type_descriptor(DateTime()).bind_processor(chat_bind.dialect)
+
+        def when(value: Optional[str]):
+            return to_db_time(datetime.fromisoformat(value)) if value else None
+
+        chat_db.execute("PRAGMA synchronous=OFF")
+        chat_db.execute("PRAGMA cache_size=-262144")
+        for index in _bulk_indexes():
+            chat_db.execute(f"DROP INDEX IF EXISTS {index.name}")
+        chat_db.execute("DROP TRIGGER IF EXISTS messages_fts_ai")
+        chat_db.commit()
+
+        def fetch_ids(usernames: List[str]):
+            marks = ",".join("?" * len(usernames))
+            return users_db.execute(f"SELECT username, id FROM users WHERE username IN ({marks})", usernames)
+
+        ids = _Lookup(fetch_ids)
+        counts = dict.fromkeys(KINDS, 0)
+        counts["unlinked"] = 0
+
+        def user_id(name: Optional[str], exported_id: int, known: Dict) -> Optional[int]:
+            # an exported id only means the same account when the users database came from the same export
+            if keep_user_ids:
+                return known.get(name) or exported_id
+            return known.get(name)
+        pending: Dict[str, List[dict]] = {kind: [] for kind in KINDS}
+        uncommitted = 0
+
+        def flush(kind: str):
+            nonlocal uncommitted
+            records = pending[kind]
+            if not records:
+                return
+            if kind == "user":
+                if keep_user_ids:
+                    users_db.executemany(_INSERT["user"], [(r["id"], r["username"], r["password_hash"], when(r["created_at"])) for r in records])
+                else:
+                    users_db.executemany(_MERGE_USER, [(r["username"], r["password_hash"], when(r["created_at"])) for r in records])
+                # committed right away so the name lookups below see the accounts
+                users_db.commit()
+            else:
+                if kind == "group":
+                    rows = [(r["id"], r["name"], when(r["created_at"])) for r in records]
+                elif kind == "membership":
+                    known = ids.resolve(r["user"] for r in records if r.get("user"))
+                    rows = [
+                        (uid, r["group_id"], when(r["joined_at"]), r["last_read_id"])
+                        for r in records
+                        for uid in [user_id(r.get("user"), r["user_id"], known)] if uid is not None
+                    ]
+                else:
+                    known = ids.resolve(r["author"] for r in records if r.get("author"))
+                    rows = [
+                        (r["id"], r["group_id"], uid, r["content"], when(r["created_at"]))
+                        for r in records
+                        for uid in [user_id(r.get("author"), r["author_id"], known)] if uid is not None
+                    ]
+                counts["unlinked"] += len(records) - len(rows)
+                chat_db.executemany(_INSERT[kind], rows)
+                uncommitted += len(rows)
+                if uncommitted >= commit_every:
+                    chat_db.commit()
+                    uncommitted = 0
+            counts[kind] += len(rows) if kind != "user" else len(records)
+            records.clear()
+
+        current = None
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.pop("type")
+            if kind == "header":
+                if record.get("version") != FORMAT_VERSION:
+                    raise RuntimeError(f"unsupported export version {record.get('version')!r}")
+                continue
+            if kind not in pending:
+                raise RuntimeError(f"unknown record type {kind!r}")
+            # users land before anything that refers to them is resolved
+            if kind != current and current is not None:
+                flush(current)
+            current = kind
+            pending[kind].append(record)
+            if len(pending[kind]) >= batch:
+                flush(kind)
+        if current is not None:
+            flush(current)
+        chat_db.commit()
+        return counts
+    finally:
+        chat_db.rollback()
+        # discarded rather than pooled: it still carries the bulk-load pragmas
+        chat_raw.invalidate()
+        users_raw.close()
+        _ensure_indexes(ChatBase, chat_bind)
+        ensure_search_index(chat_bind)
+        rebuild(chat_bind)
+        optimize(chat_bind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream chat history and accounts to or from NDJSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    out = commands.add_parser("export", help="write both databases to FILE")
+    out.add_argument("file", help="output path, '-' for stdout; .gz, .xz and .zst are compressed")
+    out.add_argument("--level", type=int, default=6, help="compression level")
+    out.add_argument("--chunk", type=int, default=10_000, help="rows read per batch")
+    out.add_argument("--no-users", action="store_true", help="leave out accounts (and their password hashes)")
+    out.add_argument("--no-archive", action="store_true", help="leave out messages moved to the archive")
+    into = commands.add_parser("import", help="load FILE into an empty chat database")
+    into.add_argument("file", help="input path, '-' for stdin")
+    into.add_argument("--batch", type=int, default=10_000, help="rows per executemany")
+    into.add_argument("--commit-every", type=int, default=500_000, help="rows per transaction")
+    args = parser.parse_args()
+
+    init_db()
+    started = time.perf_counter()
+    try:
+        if args.command == "export":
+            with open_stream(args.file, "w", args.level) as f:
+                counts = export(f, users=not args.no_users, archived=not args.no_archive, chunk=args.chunk)
+        else:
+            with open_stream(args.file, "r") as f:
+                counts = import_records(f, batch=args.batch, commit_every=args.commit_every)
+    except RuntimeError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - started
+    summary = ", ".join(f"{counts[kind]} {kind}s" for kind in KINDS)
+    if counts.get("unlinked"):
+        summary += f" ({counts['unlinked']} skipped: their user is not in the users database)"
+    # stderr: stdout may be carrying the export itself
+    print(f"{args.command}: {summary} in {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Callable, List, Optional
+from sqlalchemy import bindparam, func, insert, select, update
+from .config import settings
+from .db import ChatSessionLocal
+from .metrics import db_commit_rows, db_commit_seconds
+from .models import ArchiveBlock, Membership, Message
+
+
+logger = logging.getLogger(__name__)
+
+
+_ADVANCE_POINTER = (
+    update(Membership.__table__)
+    .where(
+        Membership.group_id == bindparam("p_group"),
+        Membership.user_id == bindparam("p_user"),
+        Membership.last_read_id < bindparam("p_id"),
+    )
+    .values(last_read_id=bindparam("p_id"))
+)
+
+
+class MessageWriter:
+    """Write-behind persistence: messages are queued and committed in batches.
+
+    Ids and timestamps are assigned at submit time so a message can be broadcast
+    before its batch reaches disk. With several workers each one hands out ids
+    congruent to its slot modulo the worker count and skips ahead past ids seen
+    from peers, so ids stay unique and roughly chronological without a shared
+    sequencer.
+
+    The queue is bounded: :meth:`submit` waits for room, which pushes back on
+    the sending sockets instead of growing memory while the disk is slow. A
+    batch that cannot be committed after ``max_attempts`` tries is dropped and
+    handed to ``on_dropped`` so its senders can be told.
+    """
+
+    def __init__(
+        self,
+        session_factory=ChatSessionLocal,
+        batch_size: int = settings.writer_batch_size,
+        max_delay: float = settings.writer_max_delay_ms / 1000,
+        max_pending: int = settings.writer_max_pending,
+        max_attempts: int = settings.writer_max_attempts,
+        retry_delay: float = 1.0,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.on_dropped: Optional[Callable[[List[dict]], None]] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self._next_id = 1
+        self.slot = 0
+        self.stride = 1
+        self.batches = 0
+        self.written = 0
+        self.dropped = 0
+
+    def start(self, slot: int = 0, stride: int = 1, on_dropped: Optional[Callable[[List[dict]], None]] = None):
+        self.slot = slot
+        self.stride = stride
+        self.on_dropped = on_dropped
+        with self.session_factory() as db:
+            # retention may have moved every hot row to the archive; its ids must not be reused
+            newest = max(db.scalar(select(func.max(Message.id))) or 0, db.scalar(select(func.max(ArchiveBlock.last_id))) or 0)
+        self._next_id = self._align(newest + 1)
+        self.queue = asyncio.Queue(self.max_pending)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        # the sentinel is queued behind every pending message, so they are flushed first
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    def _align(self, n: int) -> int:
+        # smallest id >= n that belongs to this worker's slot
+        return n + (self.slot - n) % self.stride
+
+    def observe(self, message_id: int):
+        """Note an id assigned by another worker so ours keep moving forward."""
+        if message_id >= self._next_id:
+            self._next_id = self._align(message_id + 1)
+
+    async def submit(self, group_id: int, author_id: int, content: str) -> dict:
+        """Assign the id and timestamp and queue the row, waiting while the queue is full."""
+        row = {
+            "id": self._next_id,
+            "group_id": group_id,
+            "author_id": author_id,
+            "content": content,
+            "created_at": datetime.utcnow(),
+        }
+        self._next_id += self.stride
+        await self.queue.put(row)
+        return row
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self.queue.get()
+            if row is None:
+                break
+            batch = [row]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.batch_size:
+                if self.queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        row = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    row = self.queue.get_nowait()
+                if row is None:
+                    stopping = True
+                    break
+                batch.append(row)
+            await self._write(batch)
+
+    async def _write(self, batch: List[dict]):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await asyncio.to_thread(self._commit, batch)
+                return
+            except Exception:
+                logger.exception("message batch commit failed (attempt %d of %d)", attempt, self.max_attempts)
+            if attempt < self.max_attempts:
+                await asyncio.sleep(self.retry_delay)
+        # keep the queue moving: a batch that cannot be stored must not stall every later one
+        logger.error("dropping %d messages after %d failed commits", len(batch), self.max_attempts)
+        self.dropped += len(batch)
+        if self.on_dropped is not None:
+            self.on_dropped(batch)
+
+    def _commit(self, batch: List[dict]):
+        started = time.perf_counter()
+        # an author has read their group up to their own message; one pointer update per author and group
+        pointers = {}
+        for row in batch:
+            key = (row["group_id"], row["author_id"])
+            pointers[key] = max(pointers.get(key, 0), row["id"])
+        with self.session_factory() as db:
+            db.execute(insert(Message), batch)
+            db.connection().execute(
+                _ADVANCE_POINTER,
+                [{"p_group": group_id, "p_user": user_id, "p_id": message_id} for (group_id, user_id), message_id in pointers.items()],
+            )
+            db.commit()
+        db_commit_seconds.observe(time.perf_counter() - started)
+        db_commit_rows.inc(len(batch))
+        self.batches += 1
+        self.written += len(batch)
+
+
+message_writer = MessageWriter()
@@ -0,0 +1 @@
+"""Load generator and benchmark suite: ``python -m bench --help``."""
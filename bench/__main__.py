@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict
+from .load import create_groups, create_users, drive_traffic, history_latency, join_groups, open_clients, percentiles
+from .server import ROOT, ServerProcess
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _raise_fd_limit():
+    # every socket is a descriptor on both ends when client and server share the host
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+async def _sockets_phase(server: ServerProcess, args, groups, sessions) -> Dict[str, dict]:
+    latencies = []
+    rss_before = server.rss()
+    t0 = time.perf_counter()
+    clients = await open_clients(server.base_url.replace("http", "ws", 1), groups, sessions, args.connections, args.connect_concurrency, latencies)
+    connect_seconds = time.perf_counter() - t0
+    await asyncio.sleep(1)  # let presence deltas settle before sampling memory
+    rss_after = server.rss()
+    try:
+        traffic = await drive_traffic(clients, args.senders, args.rate, args.duration)
+    finally:
+        for c in clients:
+            c.reader.cancel()
+        await asyncio.gather(*(c.ws.close() for c in clients), return_exceptions=True)
+    return {
+        "connections": {
+            "count": len(clients),
+            "connect_seconds": round(connect_seconds, 3),
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "rss_per_connection_bytes": round((rss_after - rss_before) / max(len(clients), 1)),
+        },
+        "traffic": traffic,
+        "fanout_latency_ms": percentiles(latencies),
+    }
+
+
+def run(args) -> dict:
+    _raise_fd_limit()
+    env = dict(kv.split("=", 1) for kv in args.env)
+    with ServerProcess(workers=args.workers, env=env) as server:
+        sessions, logins = create_users(server.base_url, args.users, "bench-password", args.login_concurrency)
+        groups = create_groups(server.base_url, sessions[0], args.groups)
+        join_groups(server.base_url, groups, sessions, args.connections, args.login_concurrency)
+        results = asyncio.run(_sockets_phase(server, args, groups, sessions))
+        time.sleep(0.5)  # write-behind batches reach SQLite before history is read
+        results["history"] = history_latency(server.base_url, sessions[0], groups, args.history_requests, args.history_limit)
+        results["login"] = logins
+    return {
+        "commit": _commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()},
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "results": results,
+    }
+
+
+def _flatten(prefix: str, value, out: Dict[str, float]):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+def compare(old_path: Path, new_path: Path):
+    old, new = json.loads(old_path.read_text()), json.loads(new_path.read_text())
+    a, b = {}, {}
+    _flatten("", old["results"], a)
+    _flatten("", new["results"], b)
+    print(f"{'metric':48} {old['commit']:>14} {new['commit']:>14} {'change':>9}")
+    for key in sorted(a.keys() & b.keys()):
+        change = f"{(b[key] - a[key]) / a[key] * 100:+.1f}%" if a[key] else ""
+        print(f"{key:48} {a[key]:>14} {b[key]:>14} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Load-test the chat server on localhost")
+    parser.add_argument("--workers", type=int, default=1, help="run.py --workers")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--connections", type=int, default=1000, help="chat sockets, spread over groups and users")
+    parser.add_argument("--senders", type=int, default=50, help="sockets that send messages")
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second per sender")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of message traffic")
+    parser.add_argument("--history-requests", type=int, default=200)
+    parser.add_argument("--history-limit", type=int, default=50)
+    parser.add_argument("--login-concurrency", type=int, default=16)
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--env", action="append", default=[], metavar="SCD_X=VALUE", help="extra server setting (repeatable)")
+    parser.add_argument("--out", type=Path, help="result file (default: bench-results/<commit>-<time>.json)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="diff two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    report = run(args)
+    out = args.out or ROOT / "bench-results" / f"{report['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report["results"], indent=2))
+    print(f"saved {out}")
+
+
+if __name__ == "__main__":
+    main()
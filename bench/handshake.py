@@ -0,0 +1,106 @@
+import argparse
+import json
+import socket
+import ssl
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from .load import percentiles
+from .server import ROOT, ServerProcess
+
+# one small request per connection, as a reconnecting client would make; reading the
+# reply is also what makes the client process TLS 1.3 session tickets
+REQUEST = b"GET /login HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n"
+VERSIONS = {"1.2": ssl.TLSVersion.TLSv1_2, "1.3": ssl.TLSVersion.TLSv1_3}
+
+
+def _client_context(version: str) -> ssl.SSLContext:
+    # chain checks are skipped for the self-signed cert; the server's handshake signature is still verified
+    ctx = ssl._create_unverified_context()
+    ctx.minimum_version = ctx.maximum_version = VERSIONS[version]
+    return ctx
+
+
+def _connect(port: int, ctx: ssl.SSLContext, session: Optional[ssl.SSLSession]) -> Tuple[float, ssl.SSLSession, bool]:
+    with socket.create_connection(("127.0.0.1", port)) as raw:
+        raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        started = time.perf_counter()
+        with ctx.wrap_socket(raw, server_hostname="localhost", session=session) as tls:
+            elapsed = time.perf_counter() - started
+            tls.sendall(REQUEST)
+            try:
+                while tls.recv(65536):
+                    pass
+            except (ssl.SSLError, ConnectionError):
+                pass
+            return elapsed, tls.session, tls.session_reused
+
+
+def measure(port: int, version: str, resume: bool, duration: float, concurrency: int) -> dict:
+    """Handshakes per second with fresh sessions, or each connection resuming the previous one."""
+    ctx = _client_context(version)
+    timings: List[float] = []
+    reused = 0
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        nonlocal reused
+        session = None
+        while time.perf_counter() < deadline:
+            elapsed, new_session, was_reused = _connect(port, ctx, session if resume else None)
+            timings.append(elapsed)
+            reused += was_reused
+            session = new_session
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    return {
+        "handshakes": len(timings),
+        "per_second": round(len(timings) / elapsed, 1),
+        "resumed_fraction": round(reused / len(timings), 3) if timings else None,
+        "handshake_ms": percentiles(timings),
+    }
+
+
+def run(args) -> Dict[str, dict]:
+    base = json.loads(args.tls_config.read_text())
+    results: Dict[str, dict] = {}
+    with tempfile.TemporaryDirectory(prefix="scd-tls-") as tmp:
+        for key_type in args.key_types:
+            config = Path(tmp) / f"{key_type}.json"
+            config.write_text(json.dumps(dict(base, key_type=key_type, min_version="1.2")))
+            with ServerProcess(workers=args.workers, tls_config=config) as server:
+                per_version = results[key_type] = {}
+                for version in args.versions:
+                    per_version[f"tls{version}"] = {
+                        mode: measure(server.port, version, mode == "resumed", args.duration, args.concurrency)
+                        for mode in ("full", "resumed")
+                    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench.handshake", description="Full vs resumed TLS handshakes against run.py --tls")
+    parser.add_argument("--key-types", nargs="+", default=["rsa", "ecdsa-p256", "ed25519"], choices=["rsa", "ecdsa-p256", "ed25519"])
+    parser.add_argument("--versions", nargs="+", default=["1.2", "1.3"], choices=sorted(VERSIONS))
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per key type, version and mode")
+    parser.add_argument("--concurrency", type=int, default=4, help="client threads")
+    parser.add_argument("--workers", type=int, default=1, help="run.py --workers")
+    parser.add_argument("--tls-config", type=Path, default=ROOT / "tls_config.json", help="profile to start from; key_type is overridden")
+    parser.add_argument("--out", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps({"params": {k: str(v) for k, v in vars(args).items() if k != "out"}, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
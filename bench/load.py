@@ -0,0 +1,225 @@
+import asyncio
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from websockets.asyncio.client import connect
+
+SESSION_COOKIE = "scd_session"
+# chat messages sent by the load generator: "bench|<sender>|<perf_counter at send>"
+TAG = "bench|"
+SUBPROTOCOL = "scd.v1.json"
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def http(method: str, url: str, data: Optional[dict] = None, cookie: Optional[str] = None) -> Tuple[int, dict, bytes]:
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, method=method)
+    if cookie:
+        req.add_header("Cookie", f"{SESSION_COOKIE}={cookie}")
+    try:
+        with _opener.open(req, timeout=60) as resp:
+            return resp.status, dict(resp.headers), resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+def login(base_url: str, username: str, password: str) -> Optional[str]:
+    """Log in and return the session id, retrying while the hashing pool answers 503."""
+    while True:
+        status, headers, _ = http("POST", base_url + "/login", {"username": username, "password": password})
+        if status == 503:
+            time.sleep(float(headers.get("Retry-After", "1")))
+            continue
+        cookie = headers.get("set-cookie") or headers.get("Set-Cookie") or ""
+        prefix = f"{SESSION_COOKIE}="
+        return cookie[len(prefix):].split(";")[0] if cookie.startswith(prefix) else None
+
+
+def register(base_url: str, username: str, password: str):
+    while True:
+        status, headers, body = http("POST", base_url + "/register", {"username": username, "password": password})
+        if status == 503:
+            time.sleep(float(headers.get("Retry-After", "1")))
+            continue
+        if status >= 400 and b"exists" not in body:
+            raise RuntimeError(f"register {username}: {status} {body[:200]!r}")
+        return
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Nearest-rank percentiles in milliseconds."""
+    if not samples:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+
+    return {"count": len(ordered), "p50": rank(0.50), "p90": rank(0.90), "p99": rank(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+def create_users(base_url: str, count: int, password: str, concurrency: int) -> Tuple[List[str], dict]:
+    """Register ``count`` users, then log them all in concurrently; returns session ids and login stats."""
+    names = [f"bench{i:05d}" for i in range(count)]
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda n: register(base_url, n, password), names))
+        started = time.perf_counter()
+        timings: List[float] = []
+
+        def timed_login(name: str) -> Optional[str]:
+            t0 = time.perf_counter()
+            sid = login(base_url, name, password)
+            timings.append(time.perf_counter() - t0)
+            return sid
+
+        sessions = list(pool.map(timed_login, names))
+        elapsed = time.perf_counter() - started
+    if not all(sessions):
+        raise RuntimeError("some logins failed")
+    return sessions, {"logins": count, "seconds": round(elapsed, 3), "per_second": round(count / elapsed, 1), "latency_ms": percentiles(timings)}
+
+
+def create_groups(base_url: str, cookie: str, count: int) -> List[int]:
+    ids = []
+    for i in range(count):
+        status, _, body = http("POST", base_url + "/api/groups?" + urllib.parse.urlencode({"name": f"bench-{i}"}), cookie=cookie)
+        if status != 200:
+            raise RuntimeError(f"create group: {status} {body[:200]!r}")
+        ids.append(json.loads(body)["id"])
+    return ids
+
+
+def join_groups(base_url: str, groups: List[int], sessions: List[str], count: int, concurrency: int):
+    """Join every (group, user) pair that ``open_clients`` will use; chat sockets require membership."""
+    pairs = {(groups[i % len(groups)], sessions[i % len(sessions)]) for i in range(count)}
+
+    def join(pair: Tuple[int, str]):
+        status, _, body = http("POST", base_url + "/api/groups/join?" + urllib.parse.urlencode({"group_id": pair[0]}), cookie=pair[1])
+        if status != 200:
+            raise RuntimeError(f"join group: {status} {body[:200]!r}")
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(join, pairs))
+
+
+class Client:
+    __slots__ = ("ws", "group_id", "received", "frames", "bytes", "latencies", "reader")
+
+    def __init__(self, ws, group_id: int, latencies: List[float]):
+        self.ws = ws
+        self.group_id = group_id
+        self.received = 0
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = latencies
+        self.reader: Optional[asyncio.Task] = None
+
+    async def read(self):
+        async for frame in self.ws:
+            now = time.perf_counter()
+            self.frames += 1
+            self.bytes += len(frame)
+            if TAG not in frame:
+                continue
+            for event in json.loads(frame)["e"]:
+                content = event["d"].get("content", "") if event["t"] == "message" else ""
+                if content.startswith(TAG):
+                    self.received += 1
+                    self.latencies.append(now - float(content.rsplit("|", 1)[1]))
+
+
+async def open_clients(ws_url: str, groups: List[int], sessions: List[str], count: int, concurrency: int, latencies: List[float]) -> List[Client]:
+    """Open ``count`` chat sockets, spread round-robin over groups and users."""
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> Client:
+        async with gate:
+            group_id = groups[i % len(groups)]
+            ws = await connect(
+                f"{ws_url}/ws/chat/{group_id}",
+                additional_headers={"Cookie": f"{SESSION_COOKIE}={sessions[i % len(sessions)]}"},
+                subprotocols=[SUBPROTOCOL],
+                max_queue=None,
+                open_timeout=60,
+            )
+            await ws.recv()  # presence snapshot: the socket is registered
+            client = Client(ws, group_id, latencies)
+            client.reader = asyncio.create_task(client.read())
+            return client
+
+    return list(await asyncio.gather(*(one(i) for i in range(count))))
+
+
+async def drive_traffic(clients: List[Client], senders: int, rate: float, duration: float) -> dict:
+    """``senders`` sockets each send ``rate`` messages per second for ``duration`` seconds."""
+    sent = 0
+    members: Dict[int, int] = {}
+    for c in clients:
+        members[c.group_id] = members.get(c.group_id, 0) + 1
+    expected = 0
+    started = time.perf_counter()
+
+    async def sender(index: int, client: Client):
+        nonlocal sent, expected
+        interval = 1.0 / rate
+        next_at = started + index * interval / max(senders, 1)
+        while True:
+            now = time.perf_counter()
+            if now - started >= duration:
+                return
+            if next_at > now:
+                await asyncio.sleep(next_at - now)
+            await client.ws.send(f"{TAG}{index}|{time.perf_counter()}")
+            sent += 1
+            expected += members[client.group_id]
+            next_at += interval
+
+    await asyncio.gather(*(sender(i, clients[i]) for i in range(min(senders, len(clients)))))
+    send_seconds = time.perf_counter() - started
+    # let in-flight frames drain
+    deadline = time.perf_counter() + 10
+    while sum(c.received for c in clients) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    received = sum(c.received for c in clients)
+    frames = sum(c.frames for c in clients)
+    elapsed = time.perf_counter() - started
+    return {
+        "sent": sent,
+        "sent_per_second": round(sent / send_seconds, 1),
+        "deliveries_expected": expected,
+        "deliveries": received,
+        "deliveries_per_second": round(received / elapsed, 1),
+        # frame bytes are counted after permessage-deflate inflation, i.e. envelope size
+        "frames_per_delivery": round(frames / received, 3) if received else None,
+        "frame_bytes_per_delivery": round(sum(c.bytes for c in clients) / received, 1) if received else None,
+    }
+
+
+def history_latency(base_url: str, cookie: str, groups: List[int], requests: int, limit: int) -> dict:
+    """Newest page (ring buffer) and one page back (SQLite keyset query) for each group in turn.
+
+    ``cookie`` must belong to a member of every group, e.g. the user who created them.
+    """
+    newest, older = [], []
+    for i in range(requests):
+        group_id = groups[i % len(groups)]
+        t0 = time.perf_counter()
+        status, _, body = http("GET", f"{base_url}/api/messages?group_id={group_id}&limit={limit}", cookie=cookie)
+        newest.append(time.perf_counter() - t0)
+        cursor = json.loads(body).get("older") if status == 200 else None
+        if cursor:
+            t0 = time.perf_counter()
+            http("GET", f"{base_url}/api/messages?group_id={group_id}&limit={limit}&before={cursor}", cookie=cookie)
+            older.append(time.perf_counter() - t0)
+    return {"newest_page_ms": percentiles(newest), "older_page_ms": percentiles(older)}
@@ -0,0 +1,116 @@
+import os
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def _rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class ServerProcess:
+    """``run.py`` in a subprocess on localhost, with its databases in a throwaway directory.
+
+    With ``tls_config`` the server runs over HTTPS with a certificate generated
+    into that directory from the given ``tls_config.json``.
+    """
+
+    def __init__(self, workers: int = 1, env: Optional[Dict[str, str]] = None, tls_config: Optional[Path] = None):
+        self.workers = workers
+        self.tls_config = tls_config
+        self.port = free_port()
+        self.data_dir = tempfile.TemporaryDirectory(prefix="scd-bench-")
+        self.env = dict(os.environ, SCD_DATA_DIR=self.data_dir.name, **(env or {}))
+        self.proc: Optional[subprocess.Popen] = None
+        # uvicorn logs every socket open/close; a file never fills up the way an unread pipe does
+        self.log_path = Path(self.data_dir.name) / "server.log"
+
+    @property
+    def base_url(self) -> str:
+        return f"{'https' if self.tls_config else 'http'}://127.0.0.1:{self.port}"
+
+    @property
+    def certfile(self) -> Path:
+        return Path(self.data_dir.name) / "cert.pem"
+
+    def start(self, timeout: float = 30.0):
+        cmd = [sys.executable, "run.py", "--host", "127.0.0.1", "--port", str(self.port), "--workers", str(self.workers)]
+        context = None
+        if self.tls_config:
+            keyfile = Path(self.data_dir.name) / "key.pem"
+            cmd += ["--tls", "--certfile", str(self.certfile), "--keyfile", str(keyfile), "--tls-config", str(self.tls_config)]
+            context = ssl._create_unverified_context()
+        with open(self.log_path, "wb") as log:
+            self.proc = subprocess.Popen(cmd, cwd=ROOT, env=self.env, stdout=subprocess.DEVNULL, stderr=log)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited: {self.log_path.read_bytes().decode(errors='replace')[-2000:]}")
+            try:
+                urllib.request.urlopen(self.base_url + "/login", timeout=1, context=context).read()
+                return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError("server did not come up")
+
+    def rss(self) -> int:
+        """Resident memory of the server and all its worker processes, in bytes."""
+        if self.proc is None:
+            return 0
+        total, pending = 0, [self.proc.pid]
+        while pending:
+            pid = pending.pop()
+            total += _rss(pid)
+            pending.extend(_children(pid))
+        return total
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+            try:
+                self.proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.proc = None
+        self.data_dir.cleanup()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
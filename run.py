@@ -1,24 +1,43 @@
 import argparse
+import os
 from pathlib import Path
+import socket
 import ssl
+import tempfile
 import uvicorn
+from uvicorn.supervisors import Multiprocess
 from app.main import create_app
-from app.config import load_tls_config, TLSConfig
+from app.db import init_db
+from app.bus import BusBroker
+from app.config import load_tls_config, settings, TLSConfig
+from app.tls import TLSServerConfig, apply_tls_profile
+from app.ratelimit import flood_control
 
 
 def ensure_self_signed(cert_path: Path, key_path: Path, cfg: TLSConfig):
+    # Certificates generated here are recorded in a marker next to the key. Only those are
+    # regenerated when tls_config.json asks for another key type; anything else is left alone.
+    marker = key_path.with_name(key_path.name + ".generated")
     if cert_path.exists() and key_path.exists():
-        return
+        if not marker.exists() or marker.read_text().strip() == cfg.key_type:
+            return
     # Ensure target directory exists
     cert_path.parent.mkdir(parents=True, exist_ok=True)
     key_path.parent.mkdir(parents=True, exist_ok=True)
     from cryptography import x509
     from cryptography.x509.oid import NameOID
     from cryptography.hazmat.primitives import hashes, serialization
-    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
     from datetime import datetime, timedelta
 
-    key = rsa.generate_private_key(public_exponent=65537, key_size=cfg.key_bits)
+    if cfg.key_type == "rsa":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=cfg.key_bits)
+    elif cfg.key_type == "ecdsa-p256":
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+    # Ed25519 signs the message itself and takes no separate digest
+    digest = None if cfg.key_type == "ed25519" else hashes.SHA256()
     subject = issuer = x509.Name(
         [
             x509.NameAttribute(NameOID.COUNTRY_NAME, cfg.country),
@@ -37,16 +56,17 @@ def ensure_self_signed(cert_path: Path, key_path: Path, cfg: TLSConfig):
         .not_valid_before(datetime.utcnow() - timedelta(minutes=1))
         .not_valid_after(datetime.utcnow() + timedelta(days=cfg.valid_days))
         .add_extension(x509.SubjectAlternativeName([x509.DNSName(cfg.common_name)]), critical=False)
-        .sign(key, hashes.SHA256())
+        .sign(key, digest)
     )
     key_path.write_bytes(
         key.private_bytes(
             encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            format=serialization.PrivateFormat.PKCS8,
             encryption_algorithm=serialization.NoEncryption(),
         )
     )
     cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    marker.write_text(cfg.key_type)
 
 
 def main():
@@ -57,18 +77,62 @@ def main():
     parser.add_argument("--certfile", type=Path, default=Path(".tls/cert.pem"))
     parser.add_argument("--keyfile", type=Path, default=Path(".tls/key.pem"))
     parser.add_argument("--tls-config", type=Path, default=Path("tls_config.json"))
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port")
     args = parser.parse_args()
 
-    app = create_app()
+    bus_path = None
+    if args.workers > 1:
+        if not hasattr(socket, "AF_UNIX"):
+            parser.error("--workers requires Unix domain sockets")
+        if settings.session_backend == "memory":
+            parser.error("the memory session backend cannot be shared between workers")
+        # create the schema once here so workers do not race on it at startup
+        init_db()
+        # workers relay chat fan-out through a broker living in this supervisor process
+        bus_path = Path(tempfile.gettempdir()) / f"scd-bus-{os.getpid()}.sock"
+        BusBroker(str(bus_path), args.workers).start_in_thread()
+        os.environ["SCD_WORKERS"] = str(args.workers)
+        os.environ["SCD_BUS_PATH"] = str(bus_path)
+        app = "app.main:create_app"
+    else:
+        app = create_app()
 
-    ssl_ctx = None
+    tls_cfg = None
     if args.tls:
-        cfg = load_tls_config(args.tls_config)
-        ensure_self_signed(args.certfile, args.keyfile, cfg)
+        tls_cfg = load_tls_config(args.tls_config)
+        ensure_self_signed(args.certfile, args.keyfile, tls_cfg)
+        # fail here, before workers start, on a bad cert/key pair or profile
         ssl_ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         ssl_ctx.load_cert_chain(certfile=str(args.certfile), keyfile=str(args.keyfile))
+        apply_tls_profile(ssl_ctx, tls_cfg)
 
-    uvicorn.run(app, host=args.host, port=args.port, ssl_keyfile=None if not ssl_ctx else str(args.keyfile), ssl_certfile=None if not ssl_ctx else str(args.certfile))
+    # uvicorn.run() without its reload branch, so the config can carry the TLS profile
+    config = TLSServerConfig(
+        app,
+        tls=tls_cfg,
+        factory=args.workers > 1,
+        workers=args.workers,
+        host=args.host,
+        port=args.port,
+        ws_per_message_deflate=settings.ws_per_message_deflate,
+        ws_ping_interval=settings.ws_ping_interval,
+        ws_ping_timeout=settings.ws_ping_timeout,
+        # frames far beyond the chat size cap are refused (1009) before being buffered whole
+        ws_max_size=4 * flood_control.max_message_bytes,
+        ssl_keyfile=str(args.keyfile) if tls_cfg else None,
+        ssl_certfile=str(args.certfile) if tls_cfg else None,
+    )
+    server = uvicorn.Server(config)
+    try:
+        if args.workers > 1:
+            Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+        else:
+            server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if bus_path is not None:
+            bus_path.unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+import itertools
+import os
+import tempfile
+
+# settings and the default engines are built at import time: point them at a scratch directory first
+os.environ["SCD_DATA_DIR"] = tempfile.mkdtemp(prefix="scd-tests-")
+os.environ.setdefault("SCD_SESSION_BACKEND", "memory")
+os.environ.setdefault("SCD_HASH_WORKERS", "1")
+
+from pathlib import Path
+from typing import Tuple
+import pytest
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models  # noqa: F401 register the tables
+from app.db import ChatBase, UsersBase, _ensure_indexes
+from app.search import ensure_search_index
+
+
+def make_engines(directory: Path) -> Tuple[Engine, Engine]:
+    """A chat and a users database under ``directory``, with the full schema."""
+    directory.mkdir(parents=True, exist_ok=True)
+    chat = create_engine(f"sqlite:///{directory / 'chat.sqlite3'}")
+    users = create_engine(f"sqlite:///{directory / 'users.sqlite3'}")
+    with chat.connect() as conn:
+        # as in production (SCD_SQLITE_JOURNAL_MODE): readers and the batch writer do not block each other
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    ChatBase.metadata.create_all(chat)
+    _ensure_indexes(ChatBase, chat)
+    ensure_search_index(chat)
+    UsersBase.metadata.create_all(users)
+    return chat, users
+
+
+@pytest.fixture
+def engines(tmp_path):
+    chat, users = make_engines(tmp_path)
+    yield chat, users
+    chat.dispose()
+    users.dispose()
+
+
+@pytest.fixture
+def chat_sessions(engines):
+    return sessionmaker(bind=engines[0])
+
+
+@pytest.fixture(scope="session")
+def client():
+    """One app for the whole run; tests keep apart by using their own users and groups."""
+    from fastapi.testclient import TestClient
+    from app.main import create_app
+
+    with TestClient(create_app()) as client:
+        yield client
+
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def make_user(client):
+    """Register and log in a fresh user; returns request headers carrying their session."""
+    from app.auth import SESSION_COOKIE
+
+    def make() -> dict:
+        name = f"user{next(_names)}"
+        client.post("/register", data={"username": name, "password": "secret-pw"}, follow_redirects=False)
+        response = client.post("/login", data={"username": name, "password": "secret-pw"}, follow_redirects=False)
+        sid = response.cookies[SESSION_COOKIE]
+        client.cookies.clear()
+        return {"Cookie": f"{SESSION_COOKIE}={sid}"}
+
+    return make
+
+
+@pytest.fixture
+def make_group(client):
+    def make(headers: dict) -> int:
+        response = client.post("/api/groups", params={"name": f"group{next(_names)}"}, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    return make
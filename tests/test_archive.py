@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from app.archive import Archive
+from app.membership import MembershipIndex
+from app.models import Group, Membership, Message
+from app.writer import MessageWriter
+
+
+def _seed(sessions, count: int, group_id: int = 1):
+    started = datetime(2024, 1, 1)
+    with sessions() as db:
+        db.add(Group(id=group_id, name=f"g{group_id}"))
+        db.add_all(
+            Message(id=i, group_id=group_id, author_id=1, content=f"m{i}", created_at=started + timedelta(seconds=i))
+            for i in range(1, count + 1)
+        )
+        db.commit()
+
+
+def _archive(sessions, tmp_path, keep: int) -> Archive:
+    # small segments and blocks so a few dozen messages span several of each
+    return Archive(
+        directory=tmp_path / "archive", session_factory=sessions,
+        max_age_days=0, max_messages=keep, segment_messages=10, block_messages=3,
+    )
+
+
+def test_compact_keeps_newest_hot(chat_sessions, tmp_path):
+    _seed(chat_sessions, 50)
+    archive = _archive(chat_sessions, tmp_path, keep=5)
+    assert archive.compact() == 45
+    with chat_sessions() as db:
+        assert list(db.scalars(select(Message.id).order_by(Message.id))) == [46, 47, 48, 49, 50]
+
+
+def test_paging_crosses_blocks_and_segments(chat_sessions, tmp_path):
+    _seed(chat_sessions, 50)
+    archive = _archive(chat_sessions, tmp_path, keep=5)
+    archive.compact()
+    assert [m.id for m in archive.read_before(1, None, 100)] == list(range(45, 0, -1))
+    # 20 sits at a segment boundary (11-20 | 21-30), 13 and 10 at block boundaries
+    assert [m.id for m in archive.read_before(1, 22, 7)] == list(range(21, 14, -1))
+    assert [m.id for m in archive.read_before(1, 11, 3)] == [10, 9, 8]
+    assert [m.id for m in archive.read_after(1, 8, 15)] == list(range(9, 24))
+    assert archive.read_after(1, 45, 10) == []
+    assert [m.content for m in archive.read_after(1, 0, 2)] == ["m1", "m2"]
+
+
+def test_scan_returns_every_block_in_order(chat_sessions, tmp_path):
+    _seed(chat_sessions, 30)
+    archive = _archive(chat_sessions, tmp_path, keep=0)
+    archive.max_age = timedelta(0)
+    archive.compact()
+    with chat_sessions() as db:
+        assert [m.id for block in archive.scan(db) for m in block] == list(range(1, 31))
+
+
+def test_ids_continue_after_everything_was_archived(chat_sessions, tmp_path):
+    _seed(chat_sessions, 3)
+    archive = _archive(chat_sessions, tmp_path, keep=0)
+    archive.max_age = timedelta(0)
+    archive.compact()
+    with chat_sessions() as db:
+        assert db.scalar(select(func.count()).select_from(Message)) == 0
+
+    async def restart_and_send():
+        writer = MessageWriter(session_factory=chat_sessions, max_delay=0)
+        writer.start()
+        row = await writer.submit(1, 1, "after restart")
+        await writer.stop()
+        return row["id"]
+
+    assert asyncio.run(restart_and_send()) == 4
+
+
+def test_membership_index_counts_archived_messages(chat_sessions, tmp_path):
+    _seed(chat_sessions, 12)
+    with chat_sessions() as db:
+        db.add(Membership(user_id=7, group_id=1, last_read_id=12))
+        db.commit()
+    archive = _archive(chat_sessions, tmp_path, keep=2)
+    archive.compact()
+    index = MembershipIndex(session_factory=chat_sessions)
+    index.warm()
+    assert index.newest[1] == 12
+    assert index.totals[1] == 12
+    assert index.unread(1, 7) == 0
+
+
+def test_membership_warm_counts_unread_across_archive_and_hot(chat_sessions, tmp_path):
+    _seed(chat_sessions, 50)
+    with chat_sessions() as db:
+        db.add_all([Group(id=2, name="g2"), Group(id=3, name="empty")])
+        db.add_all(
+            Message(id=i, group_id=2, author_id=1, content=f"m{i}", created_at=datetime(2024, 1, 2)) for i in range(101, 105)
+        )
+        # 0: nothing read; 3 and 6: block boundaries; 4: inside block 4-6; 47: hot; 60: past the end
+        db.add_all(Membership(user_id=u, group_id=1, last_read_id=u) for u in (0, 3, 4, 6, 47, 60))
+        db.add_all([Membership(user_id=1, group_id=2, last_read_id=102), Membership(user_id=1, group_id=3)])
+        db.commit()
+    _archive(chat_sessions, tmp_path, keep=5).compact()
+    index = MembershipIndex(session_factory=chat_sessions)
+    index.warm()
+    assert (index.totals[1], index.newest[1]) == (50, 50)
+    # a pointer inside an archived block counts the whole block as unread
+    assert {u: index.unread(1, u) for u in (0, 3, 4, 6, 47, 60)} == {0: 50, 3: 47, 4: 47, 6: 44, 47: 3, 60: 0}
+    assert index.unread(2, 1) == 2
+    assert index.is_member(3, 1) and index.unread(3, 1) == 0
+    index.on_message(3, 51)
+    assert index.unread(3, 1) == 1
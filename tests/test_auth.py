@@ -0,0 +1,24 @@
+import bcrypt
+from fastapi import HTTPException
+from sqlalchemy import select
+from app.db import UsersSessionLocal
+from app.hashing import hashing_pool
+from app.models import User
+
+
+def test_a_busy_pool_skips_the_legacy_rehash_instead_of_failing_the_login(client, monkeypatch):
+    legacy = bcrypt.hashpw(b"old-password", bcrypt.gensalt(4)).decode()
+    with UsersSessionLocal() as db:
+        db.add(User(username="legacy-user", password_hash=legacy))
+        db.commit()
+
+    async def busy(password):
+        raise HTTPException(status_code=503, detail="Server busy, try again")
+
+    monkeypatch.setattr(hashing_pool, "hash", busy)
+    response = client.post("/login", data={"username": "legacy-user", "password": "old-password"}, follow_redirects=False)
+    client.cookies.clear()
+    assert response.status_code == 302 and "scd_session" in response.cookies
+    with UsersSessionLocal() as db:
+        # left for the next login to upgrade
+        assert db.scalar(select(User.password_hash).where(User.username == "legacy-user")) == legacy
@@ -0,0 +1,37 @@
+from app.catalog import GroupCatalog
+
+
+def test_version_counts_out_of_order_arrivals(chat_sessions):
+    catalog = GroupCatalog(session_factory=chat_sessions)
+    catalog.add(1, "a")
+    catalog.add(3, "c")
+    seen = catalog.version
+    # a peer's group with a lower id arrives after 3
+    catalog.add(2, "b")
+    assert catalog.version == seen + 1
+    assert catalog.since(seen) == [{"id": 2, "name": "b"}]
+    assert not catalog.add(2, "b") and catalog.version == seen + 1
+
+
+def test_etag_depends_on_content_not_arrival_order(chat_sessions):
+    first, second = GroupCatalog(session_factory=chat_sessions), GroupCatalog(session_factory=chat_sessions)
+    for group_id in (1, 2, 3):
+        first.add(group_id, str(group_id))
+    for group_id in (1, 3, 2):
+        second.add(group_id, str(group_id))
+    assert first.etag == second.etag
+    second.add(4, "4")
+    assert first.etag != second.etag
+
+
+def test_since_version_and_revalidation(client, make_user, make_group):
+    owner = make_user()
+    make_group(owner)
+    listed = client.get("/api/me/groups", headers=owner)
+    version = int(listed.headers["X-Groups-Version"])
+    new_id = make_group(owner)
+    delta = client.get("/api/groups", params={"since_version": version})
+    assert [g["id"] for g in delta.json()] == [new_id]
+    assert int(delta.headers["X-Groups-Version"]) == version + 1
+    again = client.get("/api/groups", params={"since_version": version}, headers={"If-None-Match": delta.headers["ETag"]})
+    assert again.status_code == 304
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from app.chat import manager
+from app.envelope import Event
+from app.fanout import Connection
+from app.membership import memberships
+
+
+def _wait_for(predicate, timeout: float = 2.0) -> bool:
+    # the server drops a socket from its indexes shortly after the client closes it
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_by_user_indexes_chat_and_notification_sockets(client, make_user, make_group):
+    owner = make_user()
+    group_id = make_group(owner)
+    user_id, = memberships.members[group_id]
+    with client.websocket_connect("/ws", headers=owner) as notifications:
+        notifications.receive_json()
+        with client.websocket_connect(f"/ws/chat/{group_id}", headers=owner) as chat:
+            chat.receive_json()
+            assert sorted(conn.group_id or 0 for conn in manager.by_user[user_id]) == [0, group_id]
+            assert client.get("/api/stats").json()["fanout"]["users"] >= 1
+        assert _wait_for(lambda: [conn.group_id for conn in manager.by_user.get(user_id, ())] == [None])
+    assert _wait_for(lambda: user_id not in manager.by_user)
+
+
+def test_anonymous_notification_sockets_are_not_indexed(client):
+    with client.websocket_connect("/ws") as notifications:
+        notifications.receive_json()
+        assert all(conn.user_id is not None for tabs in manager.by_user.values() for conn in tabs)
+        assert any(conn.user_id is None for conn in manager.by_group.get(None, ()))
+
+
+class _Socket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, frame: str):
+        self.frames.append(json.loads(frame))
+
+
+def test_drop_oldest_tells_the_client_about_the_gap():
+    owner = SimpleNamespace(outbox_size=2, policy="drop_oldest", batch_max=10, batch_window=0)
+
+    async def run():
+        socket = _Socket()
+        conn = Connection(socket, owner, group_id=5)
+        for n in range(3):
+            assert conn.offer(Event("message", {"id": n}))
+        conn.start()
+        await asyncio.sleep(0.01)
+        conn.offer(Event("message", {"id": 3}))
+        await asyncio.sleep(0.01)
+        conn.close()
+        return socket.frames
+
+    first, second = asyncio.run(run())
+    assert first["e"] == [
+        {"t": "resume", "d": {"group_id": 5, "since": None, "replayed": 0, "complete": False}},
+        {"t": "message", "d": {"id": 1}},
+        {"t": "message", "d": {"id": 2}},
+    ]
+    # one notice per gap
+    assert second["e"] == [{"t": "message", "d": {"id": 3}}]
+
+
+def _queued(conn):
+    return [(event.kind, json.loads(event.data)) for event in conn.pending]
+
+
+def test_drop_flags_the_gap():
+    owner = SimpleNamespace(outbox_size=1, policy="drop", batch_max=10, batch_window=0)
+    conn = Connection(_Socket(), owner, group_id=5)
+    assert conn.offer(Event("message", {"id": 1}))
+    assert not conn.offer(Event("message", {"id": 2}))
+    assert conn.gap and _queued(conn) == [("message", {"id": 1})]
+
+
+def test_coalesce_folds_superseded_state_events():
+    owner = SimpleNamespace(outbox_size=3, policy="coalesce", batch_max=10, batch_window=0)
+    conn = Connection(_Socket(), owner)
+    ann, bob = {"id": 1, "username": "ann", "ip": None}, {"id": 2, "username": "bob", "ip": None}
+    conn.offer(Event("unread", {"group_id": 1, "unread": 1}))
+    conn.offer(Event("presence", {"group_id": None, "joined": [ann], "left": [3]}))
+    conn.offer(Event("group", {"id": 9, "name": "new"}))
+    assert conn.offer(Event("unread", {"group_id": 1, "unread": 2}))
+    assert conn.offer(Event("presence", {"group_id": None, "joined": [bob], "left": [1]}))
+    assert not conn.gap
+    assert _queued(conn) == [
+        ("group", {"id": 9, "name": "new"}),
+        ("unread", {"group_id": 1, "unread": 2}),
+        ("presence", {"group_id": None, "joined": [bob], "left": [1, 3]}),
+    ]
+    # nothing to fold into: the oldest goes and the client is told
+    assert conn.offer(Event("message", {"id": 4}))
+    assert conn.gap and [kind for kind, _ in _queued(conn)] == ["unread", "presence", "message"]
+
+
+def test_an_evicted_socket_still_announces_the_departure(client, make_user, make_group):
+    owner = make_user()
+    group_id = make_group(owner)
+    user_id, = memberships.members[group_id]
+    with client.websocket_connect(f"/ws/chat/{group_id}", headers=owner) as evicted:
+        evicted.receive_json()
+        conn, = manager.by_group[group_id]
+        # what the reaper or the disconnect policy does to a stalled consumer
+        client.portal.call(conn.evict)
+        assert evicted.receive()["type"] == "websocket.close"
+    # the handler's disconnect() learns it was the user's last socket and schedules the "left" line
+    assert _wait_for(lambda: (group_id, user_id) in manager._pending_leaves)
+    client.portal.call(manager.cancel_leave, group_id, user_id)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+from app.membership import MembershipIndex
+
+
+def test_history_and_search_are_for_members_only(client, make_user, make_group):
+    owner, outsider = make_user(), make_user()
+    group_id = make_group(owner)
+    for headers, expected in ((owner, 200), (outsider, 403), ({}, 401)):
+        assert client.get("/api/messages", params={"group_id": group_id}, headers=headers).status_code == expected
+        assert client.get(f"/api/groups/{group_id}/search", params={"q": "hi"}, headers=headers).status_code == expected
+    client.post("/api/groups/join", params={"group_id": group_id}, headers=outsider)
+    assert client.get("/api/messages", params={"group_id": group_id}, headers=outsider).status_code == 200
+
+
+def _send(client, headers, group_id, *texts):
+    with client.websocket_connect(f"/ws/chat/{group_id}", headers=headers) as ws:
+        ws.receive_text()  # presence snapshot
+        for text in texts:
+            ws.send_text(text)
+        ids = []
+        while len(ids) < len(texts):
+            frame = json.loads(ws.receive_text())
+            ids += [event["d"]["id"] for event in frame["e"] if event["t"] == "message"]
+    return ids
+
+
+def _unread(client, headers, group_id):
+    return next(g["unread"] for g in client.get("/api/me/groups", headers=headers).json() if g["id"] == group_id)
+
+
+def test_read_pointer_is_clamped_to_the_newest_message(client, make_user, make_group):
+    owner, reader = make_user(), make_user()
+    group_id = make_group(owner)
+    client.post("/api/groups/join", params={"group_id": group_id}, headers=reader)
+    first, = _send(client, owner, group_id, "one")
+
+    response = client.post(f"/api/groups/{group_id}/read", params={"message_id": first + 10_000}, headers=reader)
+    assert response.json() == {"last_read_id": first, "unread": 0}
+    second, = _send(client, owner, group_id, "two")
+    assert _unread(client, reader, group_id) == 1
+    client.post(f"/api/groups/{group_id}/read", params={"message_id": second}, headers=reader)
+    assert _unread(client, reader, group_id) == 0
+
+
+def test_own_messages_are_not_unread(client, make_user, make_group):
+    owner, other = make_user(), make_user()
+    group_id = make_group(owner)
+    client.post("/api/groups/join", params={"group_id": group_id}, headers=other)
+    _send(client, owner, group_id, "one", "two")
+    assert _unread(client, owner, group_id) == 0
+    assert _unread(client, other, group_id) == 2
+    # the sender's pointer is persisted with the batch, so a restart keeps it
+    _send(client, other, group_id, "three")
+    assert _unread(client, other, group_id) == 0
+    assert _unread(client, owner, group_id) == 1
+
+
+def test_writer_persists_the_author_pointer(chat_sessions):
+    from app.models import Group, Membership
+    from app.writer import MessageWriter
+
+    with chat_sessions() as db:
+        db.add(Group(id=1, name="g"))
+        db.add_all([Membership(user_id=1, group_id=1), Membership(user_id=2, group_id=1)])
+        db.commit()
+
+    async def send():
+        writer = MessageWriter(session_factory=chat_sessions, max_delay=0)
+        writer.start()
+        ids = [(await writer.submit(1, author, text))["id"] for author, text in ((1, "a"), (1, "b"), (2, "c"))]
+        await writer.stop()
+        return ids
+
+    a, b, c = asyncio.run(send())
+    index = MembershipIndex(session_factory=chat_sessions)
+    index.warm()
+    assert (index.state(1, 1).last_read_id, index.state(1, 2).last_read_id) == (b, c)
+    assert (index.unread(1, 1), index.unread(1, 2)) == (1, 0)
+
+
+def test_unread_counts_are_pushed_to_the_notification_socket(client, make_user, make_group):
+    owner, other = make_user(), make_user()
+    group_id = make_group(owner)
+    client.post("/api/groups/join", params={"group_id": group_id}, headers=other)
+    with client.websocket_connect("/ws", headers=other) as notifications:
+        notifications.receive_json()  # presence snapshot
+        message_id, = _send(client, owner, group_id, "hello")
+        assert _next_unread(notifications) == {"group_id": group_id, "unread": 1}
+        client.post(f"/api/groups/{group_id}/read", params={"message_id": message_id}, headers=other)
+        assert _next_unread(notifications) == {"group_id": group_id, "unread": 0}
+
+
+def _next_unread(socket) -> dict:
+    # global presence deltas for the sender may arrive in between
+    while True:
+        for event in socket.receive_json()["e"]:
+            if event["t"] == "unread":
+                return event["d"]
+
+
+def test_a_join_on_another_worker_is_found_in_the_table(client, make_user, make_group):
+    from app.db import ChatSessionLocal
+    from app.membership import memberships
+    from app.models import Membership
+
+    owner, joiner = make_user(), make_user()
+    joiner_id, = memberships.members[make_group(joiner)]
+    group_id = make_group(owner)
+    # a peer committed the join; its bus "member" event has not reached this worker yet
+    with ChatSessionLocal() as db:
+        db.add(Membership(user_id=joiner_id, group_id=group_id, last_read_id=0))
+        db.commit()
+    assert not memberships.is_member(group_id, joiner_id)
+    assert client.get("/api/messages", params={"group_id": group_id}, headers=joiner).status_code == 200
+    assert memberships.is_member(group_id, joiner_id)
+    _send(client, joiner, group_id, "hello")
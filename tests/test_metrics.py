@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from app.metrics import db_query_seconds, instrument_engine
+
+
+def test_failed_statements_leave_no_timing_state_on_the_connection():
+    engine = create_engine("sqlite://")
+    instrument_engine(engine, "test")
+    timed = db_query_seconds.labels("test", "SELECT")
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        # nothing piles up on the pooled connection for statements that raised
+        assert not conn.info.get("scd_query_start")
+    assert sum(timed.counts) == 1
+    engine.dispose()
@@ -0,0 +1,29 @@
+import asyncio
+from app.presence import PresenceTracker
+
+
+def test_a_failed_lookup_does_not_stop_presence_updates():
+    delivered = []
+
+    async def run():
+        tracker = PresenceTracker(window=0)
+        calls = []
+
+        async def flaky_describe(user_ids):
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("database is locked")
+            return [{"id": user_id, "username": f"u{user_id}", "ip": None} for user_id in user_ids]
+
+        tracker._describe = flaky_describe
+        tracker.start(lambda event, group_id: delivered.append((group_id, event.kind)), slot=0)
+        tracker.join(1, 42)
+        # the first attempt fails; the retry after a second sends the delta
+        for _ in range(300):
+            if {(1, "presence"), (None, "presence")} <= set(delivered):
+                break
+            await asyncio.sleep(0.01)
+        tracker.task.cancel()
+
+    asyncio.run(run())
+    assert {(1, "presence"), (None, "presence")} <= set(delivered)
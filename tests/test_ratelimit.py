@@ -0,0 +1,66 @@
+import asyncio
+import time
+import pytest
+from starlette.websockets import WebSocketDisconnect
+from app.ratelimit import FLOOD_CLOSE_CODE, TOO_BIG_CLOSE_CODE, FloodControl, FloodPolicy, flood_control
+
+
+def _admit_all(guard, texts):
+    async def run():
+        return [await guard.admit(text) for text in texts]
+    return asyncio.run(run())
+
+
+def _control(**fields):
+    return FloodControl({1: dict(connection_rate=0.001, connection_burst=2, user_rate=0, **fields)})
+
+
+def test_drop_mode_discards_messages_over_the_burst():
+    guard = _control(mode="drop").acquire(1, 7)
+    assert _admit_all(guard, ["a", "b", "c"]) == [None, None, 0]
+
+
+def test_disconnect_mode_returns_the_flood_close_code():
+    guard = _control(mode="disconnect").acquire(1, 7)
+    assert _admit_all(guard, ["a", "b", "c"]) == [None, None, FLOOD_CLOSE_CODE]
+
+
+def test_delay_mode_waits_for_a_token_instead_of_rejecting():
+    control = FloodControl({1: dict(connection_rate=20, connection_burst=1, user_rate=0, mode="delay")})
+    guard = control.acquire(1, 7)
+    started = time.monotonic()
+    assert _admit_all(guard, ["a", "b", "c"]) == [None, None, None]
+    # two refills at 20 tokens/s
+    assert time.monotonic() - started >= 0.08
+
+
+def test_the_user_bucket_is_shared_between_tabs_and_freed_with_the_last_one():
+    control = FloodControl({1: dict(connection_rate=0, user_rate=0.001, user_burst=2, mode="drop")})
+    first, second = control.acquire(1, 7), control.acquire(1, 7)
+    assert _admit_all(first, ["a", "b"]) == [None, None]
+    assert _admit_all(second, ["c"]) == [0]
+    control.release(1, 7)
+    control.release(1, 7)
+    assert _admit_all(control.acquire(1, 7), ["d"]) == [None]
+
+
+@pytest.mark.parametrize("mode, verdict", [("drop", 0), ("delay", 0), ("disconnect", TOO_BIG_CLOSE_CODE)])
+def test_oversized_messages_are_rejected_before_taking_a_token(mode, verdict):
+    guard = _control(mode=mode, max_message_bytes=8).acquire(1, 7)
+    # multi-byte characters count by their encoded size
+    assert _admit_all(guard, ["x" * 9, "é" * 5, "fits"]) == [verdict, verdict, None]
+    assert guard.connection.tokens < 2
+
+
+def test_a_flooding_socket_is_closed_in_disconnect_mode(client, make_user, make_group, monkeypatch):
+    owner = make_user()
+    group_id = make_group(owner)
+    policy = FloodPolicy(connection_rate=0.001, connection_burst=1, user_rate=0, mode="disconnect")
+    monkeypatch.setitem(flood_control.policies, group_id, policy)
+    with client.websocket_connect(f"/ws/chat/{group_id}", headers=owner) as chat:
+        chat.send_text("first")
+        chat.send_text("second")
+        with pytest.raises(WebSocketDisconnect) as closed:
+            while True:
+                chat.receive_json()
+    assert closed.value.code == FLOOD_CLOSE_CODE
@@ -0,0 +1,106 @@
+import time
+from datetime import datetime
+from sqlalchemy import delete, func, select
+from app.config import settings
+from app.db import ChatSessionLocal
+from app.history import recent_messages
+from app.models import ArchiveBlock, Message
+from .test_membership import _send
+
+
+def _committed(group_id: int, count: int, timeout: float = 5.0) -> bool:
+    # the write-behind writer commits shortly after the broadcast
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with ChatSessionLocal() as db:
+            if db.scalar(select(func.count()).select_from(Message).where(Message.group_id == group_id)) >= count:
+                return True
+        time.sleep(0.02)
+    return False
+
+
+def _resume(client, headers, group_id, since):
+    """Reconnect with ``since``; returns the replayed ids, the resume event and the system lines seen."""
+    with client.websocket_connect(f"/ws/chat/{group_id}?since={since}", headers=headers) as ws:
+        replayed, resume, system = [], None, []
+        while resume is None:
+            for event in ws.receive_json()["e"]:
+                if event["t"] == "message":
+                    replayed.append(event["d"]["id"])
+                elif event["t"] == "resume":
+                    resume = event["d"]
+        # anything broadcast on (re)connect arrives before the echo of this message
+        ws.send_text("back")
+        while True:
+            events = ws.receive_json()["e"]
+            system += [event["d"] for event in events if event["t"] == "system"]
+            if any(event["t"] == "message" and event["d"]["content"] == "back" for event in events):
+                break
+    return replayed, resume, system
+
+
+def _join(client, make_user, group_id):
+    reader = make_user()
+    client.post("/api/groups/join", params={"group_id": group_id}, headers=reader)
+    return reader
+
+
+def test_the_gap_is_replayed_from_the_ring_without_a_joined_line(client, make_user, make_group):
+    owner = make_user()
+    group_id = make_group(owner)
+    # a member whose only socket is the resumed one: a fresh connect would announce it
+    reader = _join(client, make_user, group_id)
+    first, *rest = _send(client, owner, group_id, "one", "two", "three")
+    replayed, resume, system = _resume(client, reader, group_id, first)
+    assert replayed == rest
+    assert resume == {"group_id": group_id, "since": first, "replayed": 2, "complete": True}
+    assert not [line for line in system if line.get("action") == "joined"]
+
+
+def test_the_older_part_of_the_gap_comes_from_sqlite(client, make_user, make_group, monkeypatch):
+    owner = make_user()
+    group_id = make_group(owner)
+    reader = _join(client, make_user, group_id)
+    monkeypatch.setattr(recent_messages, "per_group", 2)
+    first, *rest = _send(client, owner, group_id, "one", "two", "three", "four", "five")
+    assert [entry[0] for entry in recent_messages.groups[group_id].entries] == rest[-2:]
+    assert _committed(group_id, 5)
+    replayed, resume, _ = _resume(client, reader, group_id, first)
+    assert replayed == rest
+    assert resume["complete"] and resume["replayed"] == 4
+
+
+def test_a_gap_over_the_limit_is_incomplete(client, make_user, make_group, monkeypatch):
+    owner = make_user()
+    group_id = make_group(owner)
+    reader = _join(client, make_user, group_id)
+    first, *_ = _send(client, owner, group_id, "one", "two", "three", "four")
+    monkeypatch.setattr(settings, "resume_max_messages", 2)
+    replayed, resume, _ = _resume(client, reader, group_id, first)
+    assert replayed == []
+    assert resume == {"group_id": group_id, "since": first, "replayed": 0, "complete": False}
+
+
+def test_a_gap_reaching_into_the_archive_is_incomplete(client, make_user, make_group, monkeypatch):
+    owner = make_user()
+    group_id = make_group(owner)
+    reader = _join(client, make_user, group_id)
+    monkeypatch.setattr(recent_messages, "per_group", 1)
+    first, second, third = _send(client, owner, group_id, "one", "two", "three")
+    assert _committed(group_id, 3)
+    # the part of the gap before the ring has been compacted away
+    now = datetime.utcnow()
+    with ChatSessionLocal() as db:
+        db.add(ArchiveBlock(
+            group_id=group_id, segment="missing.seg", offset=0, length=0, count=1,
+            first_id=second, last_id=second, first_at=now, last_at=now,
+        ))
+        db.commit()
+    try:
+        replayed, resume, _ = _resume(client, reader, group_id, first)
+    finally:
+        with ChatSessionLocal() as db:
+            db.execute(delete(ArchiveBlock).where(ArchiveBlock.group_id == group_id))
+            db.commit()
+    assert replayed == []
+    assert resume["complete"] is False
@@ -0,0 +1,53 @@
+import asyncio
+import sqlite3
+import time
+from app.sessions import SQLiteSessionStore
+
+
+def _drop_rows(path):
+    # another worker's logout: the row goes away behind this store's back
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    conn.execute("DELETE FROM sessions")
+    conn.close()
+
+
+def test_sqlite_sessions_are_cached_for_a_short_window(tmp_path):
+    path = tmp_path / "sessions.sqlite3"
+    store = SQLiteSessionStore(path, ttl=3600, cache_seconds=60)
+    sid = store.create(7)
+    _drop_rows(path)
+    assert asyncio.run(store.get_async(sid)) == 7
+    store.cache_seconds = 0
+    store._cache.clear()
+    assert asyncio.run(store.get_async(sid)) is None
+
+
+def test_local_logout_evicts_the_cache(tmp_path):
+    store = SQLiteSessionStore(tmp_path / "sessions.sqlite3", ttl=3600, cache_seconds=60)
+    sid = store.create(7)
+    assert store.get(sid) == 7
+    store.delete(sid)
+    assert asyncio.run(store.get_async(sid)) is None
+
+
+def test_renewal_bypasses_the_cache(tmp_path):
+    path = tmp_path / "sessions.sqlite3"
+    store = SQLiteSessionStore(path, ttl=3600, cache_seconds=60)
+    sid = store.create(7)
+    # past half its lifetime the session is renewed in SQLite, not answered from memory
+    store._put(sid, 7, time.time() + 600)
+    assert asyncio.run(store.get_async(sid)) == 7
+    conn = sqlite3.connect(str(path))
+    expires_at, = conn.execute("SELECT expires_at FROM sessions WHERE sid = ?", (sid,)).fetchone()
+    conn.close()
+    assert expires_at > time.time() + 3000
+
+
+def test_cache_is_bounded_under_login_churn(tmp_path):
+    store = SQLiteSessionStore(tmp_path / "sessions.sqlite3", ttl=3600, cache_seconds=60, cache_entries=3)
+    sids = [asyncio.run(store.create_async(n)) for n in range(10)]
+    assert list(store._cache) == sids[-3:]
+    # evicted sessions still resolve, from SQLite
+    assert asyncio.run(store.get_async(sids[0])) == 0
+    asyncio.run(store.delete_async(sids[0]))
+    assert store.get(sids[0]) is None and len(store._cache) <= 3
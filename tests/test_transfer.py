@@ -0,0 +1,127 @@
+import io
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+from app.archive import Archive
+from app.models import Group, Membership, Message, User
+from app.transfer import export, import_records, open_stream
+from .conftest import make_engines
+
+
+def _seed(engines, tmp_path, messages: int = 40) -> Archive:
+    chat, users = engines
+    started = datetime(2024, 1, 1, 12, 0, 0)
+    with Session(users) as db:
+        db.add_all(User(id=i, username=f"u{i}", password_hash=f"hash{i}", created_at=started) for i in (1, 2, 3))
+        db.commit()
+    with Session(chat) as db:
+        db.add_all([Group(id=1, name="one", created_at=started), Group(id=2, name="two", created_at=started)])
+        db.add_all([
+            Membership(user_id=1, group_id=1, joined_at=started, last_read_id=10),
+            Membership(user_id=2, group_id=2, joined_at=started, last_read_id=0),
+        ])
+        db.add_all(
+            Message(id=i, group_id=1 + i % 2, author_id=1 + i % 3, content=f"hello {i} ünïcode", created_at=started + timedelta(seconds=i))
+            for i in range(1, messages + 1)
+        )
+        db.commit()
+    return Archive(directory=tmp_path / "archive", session_factory=lambda: Session(chat), max_age_days=0,
+                   max_messages=5, segment_messages=8, block_messages=3)
+
+
+def _messages(chat):
+    with chat.connect() as conn:
+        return conn.execute(select(Message.id, Message.group_id, Message.author_id, Message.content, Message.created_at).order_by(Message.id)).all()
+
+
+def test_round_trip_includes_archived_messages(engines, tmp_path):
+    archive = _seed(engines, tmp_path)
+    expected = _messages(engines[0])
+    assert archive.compact() == 30
+
+    path = str(tmp_path / "export.ndjson.gz")
+    with open_stream(path, "w") as f:
+        counts = export(f, chat_bind=engines[0], users_bind=engines[1], store=archive, chunk=7)
+    assert counts == {"user": 3, "group": 2, "membership": 2, "message": 40}
+
+    chat, users = make_engines(tmp_path / "target")
+    with open_stream(path, "r") as f:
+        assert import_records(f, batch=6, commit_every=10, chat_bind=chat, users_bind=users) == dict(counts, unlinked=0)
+    assert _messages(chat) == expected
+    with chat.connect() as conn:
+        assert conn.execute(select(Membership.user_id, Membership.group_id, Membership.last_read_id).order_by(Membership.user_id)).all() == [(1, 1, 10), (2, 2, 0)]
+        # indexes and the search trigger are back, and the index covers the imported rows
+        names = set(conn.execute(text("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")).scalars())
+        assert {"ix_messages_group_id_id", "ix_messages_author_id", "messages_fts_ai"} <= names
+        assert conn.execute(text("SELECT count(*) FROM messages_fts WHERE messages_fts MATCH 'hello'")).scalar() == 40
+    with users.connect() as conn:
+        assert conn.execute(select(User.id, User.username, User.password_hash).order_by(User.id)).all() == [(1, "u1", "hash1"), (2, "u2", "hash2"), (3, "u3", "hash3")]
+
+
+def test_authors_are_relinked_by_name(engines, tmp_path):
+    _seed(engines, tmp_path, messages=6)
+    out = io.StringIO()
+    export(out, chat_bind=engines[0], users_bind=engines[1], archived=False)
+
+    chat, users = make_engines(tmp_path / "target")
+    with Session(users) as db:
+        # the target already has accounts, with other ids
+        db.add_all([User(id=10, username="u3", password_hash="x"), User(id=11, username="someone", password_hash="x")])
+        db.commit()
+    import_records(io.StringIO(out.getvalue()), chat_bind=chat, users_bind=users)
+    with users.connect() as conn:
+        ids = dict(conn.execute(select(User.username, User.id)).all())
+        assert conn.execute(select(User.password_hash).where(User.username == "u3")).scalar() == "x"
+    assert {(m.id, m.author_id) for m in _messages(chat)} == {(i, ids[f"u{1 + i % 3}"]) for i in range(1, 7)}
+
+
+def test_merge_never_hands_rows_to_whoever_has_the_exported_id(engines, tmp_path):
+    _seed(engines, tmp_path, messages=6)
+    out = io.StringIO()
+    export(out, chat_bind=engines[0], users_bind=engines[1], users=False, archived=False)
+
+    chat, users = make_engines(tmp_path / "target")
+    with Session(users) as db:
+        # id 1 is someone else here; only u2 has an account
+        db.add_all([User(id=1, username="mallory", password_hash="x"), User(id=5, username="u2", password_hash="x")])
+        db.commit()
+    counts = import_records(io.StringIO(out.getvalue()), chat_bind=chat, users_bind=users)
+    # u1 and u3 wrote 4 of the messages and u1 has a membership: skipped, not given to ids 1 and 3
+    assert counts == {"user": 0, "group": 2, "membership": 1, "message": 2, "unlinked": 5}
+    assert {(m.id, m.author_id) for m in _messages(chat)} == {(1, 5), (4, 5)}
+    with chat.connect() as conn:
+        assert conn.execute(select(Membership.user_id, Membership.group_id)).all() == [(5, 2)]
+
+
+def test_export_is_one_snapshot_while_the_archiver_runs(engines, tmp_path):
+    archive = _seed(engines, tmp_path)
+    archive.max_messages = 15
+    assert archive.compact() == 10
+
+    class CompactMidway(io.StringIO):
+        # the archiver moves more rows after the archive scan started but before the hot rows are read
+        moved = None
+
+        def write(self, s):
+            if self.moved is None and '"type":"message"' in s:
+                archive.max_messages = 5
+                self.moved = archive.compact()
+            return super().write(s)
+
+    out = CompactMidway()
+    counts = export(out, chat_bind=engines[0], users_bind=engines[1], store=archive)
+    assert out.moved == 20
+    assert counts["message"] == 40
+    ids = sorted(int(line.split('"id":')[1].split(",")[0]) for line in out.getvalue().splitlines() if '"type":"message"' in line)
+    assert ids == list(range(1, 41))
+
+
+def test_import_refuses_a_non_empty_database(engines, tmp_path):
+    _seed(engines, tmp_path, messages=2)
+    out = io.StringIO()
+    export(out, chat_bind=engines[0], users_bind=engines[1], archived=False)
+    with pytest.raises(RuntimeError):
+        import_records(io.StringIO(out.getvalue()), chat_bind=engines[0], users_bind=engines[1])
+    with engines[0].connect() as conn:
+        assert conn.scalar(select(func.count()).select_from(Message)) == 2
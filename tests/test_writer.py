@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from sqlalchemy import func, select
+from app.config import settings
+from app.models import Message
+from app.writer import MessageWriter
+
+
+def _wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_a_batch_is_dropped_after_max_attempts(chat_sessions):
+    dropped = []
+    attempts = []
+
+    def broken_session():
+        attempts.append(1)
+        raise OSError("disk full")
+
+    async def run():
+        writer = MessageWriter(session_factory=chat_sessions, max_delay=0, max_attempts=3, retry_delay=0)
+        writer.start(on_dropped=dropped.append)
+        writer.session_factory = broken_session
+        row = await writer.submit(1, 7, "lost")
+        await writer.stop()
+        return row, writer
+
+    row, writer = asyncio.run(run())
+    assert len(attempts) == 3
+    assert dropped == [[row]] and writer.dropped == 1
+    with chat_sessions() as db:
+        assert db.scalar(select(func.count()).select_from(Message)) == 0
+
+
+def test_senders_wait_while_the_queue_is_full(chat_sessions):
+    gate = threading.Event()
+
+    def slow_session():
+        gate.wait(5)
+        return chat_sessions()
+
+    async def run():
+        writer = MessageWriter(session_factory=chat_sessions, max_delay=0, max_pending=1)
+        writer.start()
+        writer.session_factory = slow_session
+        await writer.submit(1, 7, "a")
+        await asyncio.sleep(0.05)  # "a" is taken and its commit is stuck on the gate
+        await writer.submit(1, 7, "b")
+        third = asyncio.create_task(writer.submit(1, 7, "c"))
+        await asyncio.sleep(0.05)
+        assert not third.done() and writer.queue.full()
+        gate.set()
+        await third
+        await writer.stop()
+
+    asyncio.run(run())
+    with chat_sessions() as db:
+        assert list(db.scalars(select(Message.content).order_by(Message.id))) == ["a", "b", "c"]
+
+
+def test_dropped_messages_are_forgotten_and_announced_to_the_group(client, make_user, make_group):
+    from app.writer import message_writer
+    from .test_membership import _send, _unread
+
+    owner, other = make_user(), make_user()
+    group_id = make_group(owner)
+    client.post("/api/groups/join", params={"group_id": group_id}, headers=other)
+    written = message_writer.written
+    kept, = _send(client, owner, group_id, "kept")
+    assert _wait_for(lambda: message_writer.written > written)
+
+    commit = message_writer._commit
+
+    def failing_commit(batch):
+        if any(row["content"] == "lost" for row in batch):
+            raise OSError("disk full")
+        commit(batch)
+
+    message_writer._commit, message_writer.max_attempts = failing_commit, 1
+    try:
+        with client.websocket_connect(f"/ws/chat/{group_id}", headers=other) as ws:
+            ws.receive_json()  # presence snapshot
+            lost, = _send(client, owner, group_id, "lost")
+            events = []
+            while not any(event["t"] == "failed" for event in events):
+                events += ws.receive_json()["e"]
+    finally:
+        del message_writer._commit
+        message_writer.max_attempts = settings.writer_max_attempts
+    assert {"t": "failed", "d": {"group_id": group_id, "ids": [lost]}} in events
+    page = client.get("/api/messages", params={"group_id": group_id}, headers=other).json()
+    assert [m["id"] for m in page["messages"]] == [kept]
+    assert _unread(client, other, group_id) == 1